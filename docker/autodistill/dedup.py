@@ -0,0 +1,284 @@
+import os
+import sys
+import math
+import time
+import argparse
+import resource
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+HASH_METHODS = ('phash', 'dhash')
+# Above this many images, candidate pairs come from multi-index probes
+BRUTE_FORCE_LIMIT = 20000
+# Bands up to this wide get a dense bucket table (2**bits entries) instead of binary search
+DENSE_BAND_BITS = 24
+
+# Set bits per byte value, for popcount over uint64 hashes viewed as bytes
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def _dct_matrix(n):
+    """Orthonormal DCT-II basis, so a 2D DCT is two matrix products"""
+    k = np.arange(n)[:, None]
+    x = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * x + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+DCT_32 = _dct_matrix(32)
+
+def _pack_bits(bits):
+    """64 booleans -> one uint64 (as a Python int)"""
+    return int(np.packbits(bits.ravel()).view('>u8')[0])
+
+def _load_gray(image_path, size):
+    from PIL import Image
+    
+    with Image.open(image_path) as img:
+        # Let the JPEG decoder downscale in the DCT domain first
+        img.draft('L', (size[0] * 4, size[1] * 4))
+        return np.asarray(img.convert('L').resize(size, Image.BILINEAR), dtype=np.float32)
+
+def perceptual_hash(image_path, method='phash'):
+    """64-bit perceptual hash of an image (phash: DCT, dhash: gradients)"""
+    if method == 'phash':
+        pixels = _load_gray(image_path, (32, 32))
+        low = (DCT_32 @ pixels @ DCT_32.T)[:8, :8]
+        return _pack_bits(low > np.median(low))
+    if method == 'dhash':
+        pixels = _load_gray(image_path, (9, 8))
+        return _pack_bits(pixels[:, 1:] > pixels[:, :-1])
+    raise ValueError(f"Unknown hash method: {method}")
+
+def _hash_chunk(args):
+    paths, method = args
+    return [perceptual_hash(path, method) for path in paths]
+
+def compute_hashes(image_paths, method='phash', workers=None):
+    """uint64 array of perceptual hashes, computed across a process pool"""
+    workers = workers or os.cpu_count() or 1
+    chunk = max(1, len(image_paths) // (workers * 4))
+    chunks = [(image_paths[i:i + chunk], method) for i in range(0, len(image_paths), chunk)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        values = [h for part in pool.map(_hash_chunk, chunks) for h in part]
+    return np.array(values, dtype=np.uint64)
+
+def hamming(a, b):
+    """Elementwise Hamming distance between broadcastable uint64 arrays"""
+    xor = np.bitwise_xor(a, b)
+    return POPCOUNT[xor.view(np.uint8).reshape(xor.shape + (8,))].sum(axis=-1, dtype=np.uint8)
+
+def _brute_force_pairs(hashes, threshold, block_elements=1 << 22):
+    """All i < j pairs within threshold, one block of rows at a time"""
+    n = len(hashes)
+    block = max(1, block_elements // max(n, 1))
+    left, right = [], []
+    for start in range(0, n, block):
+        rows = hashes[start:start + block]
+        distances = hamming(rows[:, None], hashes[None, :])
+        i, j = np.nonzero(distances <= threshold)
+        i += start
+        keep = i < j
+        left.append(i[keep])
+        right.append(j[keep])
+    if not left:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64)
+    return np.concatenate(left), np.concatenate(right)
+
+def _flip_masks(width, radius):
+    """Every mask of at most radius set bits within a width-bit band"""
+    return [
+        sum(1 << bit for bit in bits)
+        for k in range(radius + 1)
+        for bits in itertools.combinations(range(width), k)
+    ]
+
+def _band_plan(n, threshold):
+    """Band count for multi-index search with the lowest estimated cost
+    
+    With m bands, hashes within threshold bits differ by at most
+    threshold // m bits in some band. Few long bands keep buckets small
+    but need many bit-flip probes; many short bands need one probe but
+    their buckets hold n / 2**bits hashes each, so candidates grow as n**2.
+    """
+    best = None
+    for bands in range(1, min(threshold + 1, 64) + 1):
+        widths = np.diff(np.linspace(0, 64, bands + 1).astype(int))
+        radius = threshold // bands
+        # One lookup per probe plus the candidates each lookup returns
+        cost = sum(
+            sum(math.comb(int(width), k) for k in range(radius + 1)) * n * (1 + n / 2.0 ** width)
+            for width in widths
+        )
+        if best is None or cost < best[0]:
+            best = (cost, bands)
+    return best[1]
+
+def _probe_pairs(keys, width, masks, block_elements):
+    """Unverified (i, j), i < j, whose band keys differ by one of masks, in bounded chunks"""
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    if width <= DENSE_BAND_BITS:
+        # Bucket offsets for every possible key: one gather per probe instead of two binary searches
+        bucket_counts = np.bincount(keys.astype(np.int64), minlength=1 << width)
+        bucket_starts = np.cumsum(bucket_counts) - bucket_counts
+    for mask in masks:
+        query = keys ^ np.uint64(mask)
+        if width <= DENSE_BAND_BITS:
+            query = query.astype(np.int64)
+            starts, counts = bucket_starts[query], bucket_counts[query]
+        else:
+            starts = np.searchsorted(sorted_keys, query, side='left')
+            counts = np.searchsorted(sorted_keys, query, side='right') - starts
+        rows = np.flatnonzero(counts)
+        if not len(rows):
+            continue
+        # Split the query rows so no chunk materializes more than block_elements candidates
+        ends = np.cumsum(counts[rows])
+        cuts = np.searchsorted(ends, np.arange(block_elements, ends[-1], block_elements), side='right')
+        for chunk in np.split(rows, np.unique(cuts)):
+            if not len(chunk):
+                continue
+            chunk_counts = counts[chunk]
+            total = int(chunk_counts.sum())
+            first = np.repeat(chunk, chunk_counts)
+            offset = np.arange(total) - np.repeat(np.cumsum(chunk_counts) - chunk_counts, chunk_counts)
+            other = order[starts[first] + offset]
+            keep = first < other
+            yield first[keep], other[keep]
+
+def _multi_index_pairs(hashes, threshold, block_elements=1 << 20):
+    """Near-duplicate links via multi-index hashing with bit-flip probes
+    
+    Identical hashes are linked to their first occurrence rather than to
+    each other, so the output stays linear in the number of duplicates;
+    distinct hashes are searched once each. The 64 bits are split into
+    bands (see _band_plan) and every hash probes each band's sorted keys
+    for all keys within the band radius; candidates are verified chunk by
+    chunk, so memory holds the true pairs plus one chunk of candidates.
+    """
+    values, first_index, inverse = np.unique(hashes, return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+    copies = np.flatnonzero(first_index[inverse] != np.arange(len(hashes)))
+    left, right = [first_index[inverse[copies]]], [copies]
+    
+    bands = _band_plan(len(values), threshold)
+    edges = np.linspace(0, 64, bands + 1).astype(int)
+    radius = threshold // bands
+    found_left, found_right = [], []
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        keys = (values >> np.uint64(lo)) & np.uint64((1 << (hi - lo)) - 1)
+        for i, j in _probe_pairs(keys, hi - lo, _flip_masks(hi - lo, radius), block_elements):
+            keep = hamming(values[i], values[j]) <= threshold
+            found_left.append(i[keep])
+            found_right.append(j[keep])
+    if found_left:
+        # A pair can match in several bands
+        pair_ids = np.unique(np.concatenate(found_left) * len(values) + np.concatenate(found_right))
+        left.append(first_index[pair_ids // len(values)])
+        right.append(first_index[pair_ids % len(values)])
+    i, j = np.concatenate(left), np.concatenate(right)
+    return np.minimum(i, j), np.maximum(i, j)
+
+def near_duplicate_pairs(hashes, threshold, index='auto'):
+    """(i, j) index arrays linking hashes within threshold bits (same clusters either way)"""
+    if index == 'auto':
+        index = 'brute' if len(hashes) <= BRUTE_FORCE_LIMIT else 'multi-index'
+    if index == 'brute':
+        return _brute_force_pairs(hashes, threshold)
+    return _multi_index_pairs(hashes, threshold)
+
+def connected_components(n, i, j):
+    """Cluster id (smallest member index) per node, by min-label propagation"""
+    labels = np.arange(n)
+    while True:
+        previous = labels.copy()
+        lowest = np.minimum(labels[i], labels[j])
+        np.minimum.at(labels, i, lowest)
+        np.minimum.at(labels, j, lowest)
+        labels = labels[labels]  # pointer jumping
+        if np.array_equal(labels, previous):
+            return labels
+
+def find_clusters(image_paths, threshold=6, method='phash', index='auto', workers=None):
+    """Near-duplicate clusters: {cluster id: [image paths]}, in input order"""
+    start = time.perf_counter()
+    hashes = compute_hashes(image_paths, method, workers)
+    hashed = time.perf_counter()
+    i, j = near_duplicate_pairs(hashes, threshold, index)
+    labels = connected_components(len(image_paths), i, j)
+    
+    clusters = {}
+    for image_path, label in zip(image_paths, labels):
+        clusters.setdefault(int(label), []).append(image_path)
+    print(f"🔍 {method} of {len(image_paths)} images in {hashed - start:.1f}s, "
+          f"{len(i)} near-duplicate pairs in {time.perf_counter() - hashed:.2f}s")
+    return clusters
+
+def choose_representative(members, image_hashes, labeled):
+    """Member whose labels stand in for the cluster
+    
+    Prefers a member that is already labeled, so a new retake never
+    triggers relabeling; otherwise the smallest content hash, which is
+    stable across runs and instances.
+    """
+    done = [path for path in members if path in labeled]
+    return min(done or members, key=lambda path: image_hashes[path])
+
+def planted_hashes(n, threshold, duplicate_fraction=0.2, seed=0):
+    """Random 64-bit hashes with near-duplicates planted within threshold bits"""
+    rng = np.random.default_rng(seed)
+    hashes = rng.integers(0, 1 << 63, size=n, dtype=np.int64).astype(np.uint64) << np.uint64(1)
+    hashes |= rng.integers(0, 2, size=n).astype(np.uint64)
+    copies = int(n * duplicate_fraction)
+    noise = np.zeros(copies, dtype=np.uint64)
+    for _ in range(threshold):
+        noise |= np.uint64(1) << rng.integers(0, 64, size=copies).astype(np.uint64)
+    hashes[rng.choice(n, copies, replace=False)] = hashes[rng.integers(0, n, size=copies)] ^ noise
+    # A burst of identical frames
+    hashes[:min(n, 100)] = hashes[0]
+    return hashes
+
+def self_test(scale=200000, threshold=6, max_seconds=60.0, max_rss_mb=1024):
+    """Multi-index search at scale within time/memory budgets, and exact against brute force"""
+    hashes = planted_hashes(scale, threshold)
+    start = time.perf_counter()
+    i, j = _multi_index_pairs(hashes, threshold)
+    elapsed = time.perf_counter() - start
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"📏 {scale} hashes: {len(i)} links in {elapsed:.1f}s, peak RSS {rss_mb:.0f} MB "
+          f"({_band_plan(scale, threshold)} bands)")
+    failures = []
+    if elapsed > max_seconds:
+        failures.append(f"took {elapsed:.1f}s (budget {max_seconds:.0f}s)")
+    if rss_mb > max_rss_mb:
+        failures.append(f"peak RSS {rss_mb:.0f} MB (budget {max_rss_mb} MB)")
+    
+    sample = planted_hashes(BRUTE_FORCE_LIMIT, threshold, seed=1)
+    expected = connected_components(len(sample), *_brute_force_pairs(sample, threshold))
+    actual = connected_components(len(sample), *_multi_index_pairs(sample, threshold))
+    if not np.array_equal(expected, actual):
+        failures.append(f"clusters differ from brute force on {len(sample)} hashes")
+    else:
+        print(f"✅ Same {len(np.unique(expected))} clusters as brute force on {len(sample)} hashes")
+    
+    for failure in failures:
+        print(f"❌ {failure}")
+    return 1 if failures else 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Near-duplicate search checks")
+    parser.add_argument('--self-test', action='store_true', help='Run the scale and exactness check')
+    parser.add_argument('--scale', type=int, default=200000, help='Hashes in the scale run')
+    parser.add_argument('--threshold', type=int, default=6)
+    parser.add_argument('--max-seconds', type=float, default=60.0)
+    parser.add_argument('--max-rss-mb', type=int, default=1024)
+    args = parser.parse_args()
+    
+    if args.self_test:
+        sys.exit(self_test(args.scale, args.threshold, args.max_seconds, args.max_rss_mb))
+    parser.print_help()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,477 @@
+import os
+import glob
+import json
+import random
+import time
+import hashlib
+import shutil
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+CACHE_MANIFEST = 'label_cache.json'
+CACHE_FORMAT_VERSION = 1
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg')
+
+RESOURCE_CONFIG = '/opt/ml/config/resourceconfig.json'
+BASE_MODELS = ('grounded-sam', 'self-distill', 'stub')
+# polygon = YOLO polygon label lines; rle/bits = box lines plus a per-split mask store
+MASK_FORMATS = ('polygon', 'rle', 'bits')
+
+# Autodistill drops mask polygons smaller than 1% of the image area
+MIN_POLYGON_AREA_FRACTION = 0.01
+
+def file_sha256(path, chunk_size=1 << 20):
+    """Hash a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def list_images(input_dir):
+    """List labelable images (top level only, like GroundedSAM.label)"""
+    images = []
+    for extension in IMAGE_EXTENSIONS:
+        images.extend(glob.glob(os.path.join(input_dir, f"*{extension}")))
+    return sorted(images)
+
+def hash_images(image_paths, workers=None):
+    """Hash images in parallel, returning {path: sha256}"""
+    workers = workers or min(32, (os.cpu_count() or 1) * 4)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return dict(zip(image_paths, pool.map(file_sha256, image_paths)))
+
+def ontology_fingerprint(ontology_mapping):
+    """Stable hash of a caption -> class ontology"""
+    payload = json.dumps(ontology_mapping, sort_keys=True).encode()
+    return hashlib.sha256(payload).hexdigest()[:16]
+
+def package_version(*packages):
+    """Version string for the labeling model packages"""
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+    except ImportError:
+        return 'unknown'
+
+    parts = []
+    for package in packages:
+        try:
+            parts.append(f"{package}=={version(package)}")
+        except PackageNotFoundError:
+            parts.append(f"{package}==unknown")
+    return ','.join(parts)
+
+class LabelCache:
+    """Content-addressed label manifest stored next to the output dataset
+
+    Entries are keyed by image content hash plus ontology and model
+    version, so changing either one naturally misses the cache. Labels
+    from fallback_versions (e.g. the GroundedSAM teacher) are accepted
+    too.
+    """
+
+    def __init__(self, ontology_fp, model_version, fallback_versions=()):
+        self.ontology_fp = ontology_fp
+        self.model_version = model_version
+        self.fallback_versions = list(fallback_versions)
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, image_hash, model_version=None):
+        payload = f"{image_hash}:{self.ontology_fp}:{model_version or self.model_version}"
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def load(self, path):
+        """Merge entries from an existing manifest, if present"""
+        if not path or not os.path.exists(path):
+            return 0
+        try:
+            with open(path, 'r') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Ignoring unreadable label cache {path}: {e}")
+            return 0
+        if manifest.get('format_version') != CACHE_FORMAT_VERSION:
+            print(f"⚠️ Ignoring label cache {path} with unknown format")
+            return 0
+        entries = manifest.get('entries', {})
+        self.entries.update(entries)
+        return len(entries)
+
+    def get(self, image_hash):
+        entry = None
+        for model_version in [self.model_version] + self.fallback_versions:
+            entry = self.entries.get(self.key(image_hash, model_version))
+            if entry is not None:
+                break
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def make_entry(self, image_hash, name, labels):
+        return {
+            'image_sha256': image_hash,
+            'name': name,
+            'ontology': self.ontology_fp,
+            'model_version': self.model_version,
+            'labels': list(labels),
+        }
+    
+    def put(self, image_hash, name, labels):
+        entry = self.make_entry(image_hash, name, labels)
+        self.entries[self.key(image_hash)] = entry
+        return entry
+    
+    def add(self, key, entry):
+        self.entries[key] = entry
+
+    def save(self, path):
+        """Atomically write the manifest"""
+        manifest = {
+            'format_version': CACHE_FORMAT_VERSION,
+            'entries': self.entries,
+        }
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, path)
+
+class CheckpointStore:
+    """Per-image label checkpoints so a restarted job skips finished images
+    
+    Each labeled image is written as its own small JSON file named after
+    its cache key. Extra resume directories (e.g. checkpoints downloaded
+    from a previous attempt) are consulted read-only.
+    """
+    
+    def __init__(self, directory, resume_dirs=()):
+        self.directory = directory
+        self.resume_dirs = [d for d in resume_dirs if d]
+        os.makedirs(directory, exist_ok=True)
+    
+    def get(self, key):
+        for directory in [self.directory] + self.resume_dirs:
+            path = os.path.join(directory, f"{key}.json")
+            if os.path.exists(path):
+                try:
+                    with open(path, 'r') as f:
+                        return json.load(f)
+                except (OSError, ValueError):
+                    # A torn write from a killed worker: label it again
+                    continue
+        return None
+    
+    def put(self, key, entry):
+        path = os.path.join(self.directory, f"{key}.json")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+
+def shard_for(image_hash, num_shards, level=0):
+    """Deterministic shard of an image from its content hash
+    
+    Each level reads a different slice of the hash, so nested sharding
+    (instances, then worker processes) stays balanced.
+    """
+    if num_shards <= 1:
+        return 0
+    start = 8 + 8 * level
+    return int(image_hash[start:start + 8], 16) % num_shards
+
+def resolve_shard(num_shards=0, shard_index=0, config_path=RESOURCE_CONFIG):
+    """Shard count/index from arguments or the SageMaker host list"""
+    if num_shards:
+        return num_shards, shard_index
+    if os.path.exists(config_path):
+        with open(config_path, 'r') as f:
+            config = json.load(f)
+        hosts = sorted(config.get('hosts', []))
+        if len(hosts) > 1:
+            return len(hosts), hosts.index(config['current_host'])
+    return 1, 0
+
+class StubDetections:
+    """Minimal stand-in for supervision.Detections"""
+    
+    def __init__(self, xyxy, class_id):
+        self.xyxy = xyxy
+        self.class_id = class_id
+        self.mask = None
+    
+    def __len__(self):
+        return len(self.xyxy)
+
+class StubBaseModel:
+    """Deterministic stand-in for GroundedSAM for local runs and tests"""
+    
+    def __init__(self, ontology_mapping, max_boxes=3):
+        self.num_classes = len(ontology_classes(ontology_mapping))
+        self.max_boxes = max_boxes
+    
+    def predict(self, image_path):
+        from PIL import Image
+        
+        with Image.open(image_path) as img:
+            width, height = img.size
+        rng = random.Random(file_sha256(image_path))
+        xyxy, class_id = [], []
+        for _ in range(rng.randint(0, self.max_boxes)):
+            w = rng.uniform(0.05, 0.3) * width
+            h = rng.uniform(0.05, 0.3) * height
+            x1 = rng.uniform(0, width - w)
+            y1 = rng.uniform(0, height - h)
+            xyxy.append([x1, y1, x1 + w, y1 + h])
+            class_id.append(rng.randrange(self.num_classes))
+        return StubDetections(xyxy, class_id)
+
+def ontology_classes(ontology_mapping):
+    """Class names in ontology order (matches CaptionOntology.classes)"""
+    return list(ontology_mapping.values())
+
+def base_model_version(model_name, options=None):
+    """Version string used to key cached labels for a base model"""
+    if model_name == 'stub':
+        return 'stub'
+    if model_name == 'self-distill':
+        # Student weights and thresholds decide which labels it accepts
+        options = options or {}
+        return (f"self-distill:{file_sha256(options['weights'])[:16]}:"
+                f"{options.get('accept_conf')}:{options.get('min_conf')}:"
+                f"{base_model_version(options.get('teacher', 'grounded-sam'))}")
+    return package_version('autodistill', 'autodistill-grounded-sam')
+
+def load_base_model(model_name, ontology_mapping, options=None):
+    """Instantiate a labeling base model by name"""
+    if model_name == 'stub':
+        return StubBaseModel(ontology_mapping)
+    if model_name == 'self-distill':
+        from self_distill import SelfDistillLabeler
+        return SelfDistillLabeler(ontology_mapping, **(options or {}))
+    if model_name == 'grounded-sam':
+        # Checkpoints come from the weights registry instead of a per-job download
+        from weights_registry import stage_grounded_sam_weights
+        stage_grounded_sam_weights()
+        from autodistill.detection import CaptionOntology
+        from autodistill_grounded_sam import GroundedSAM
+        return GroundedSAM(ontology=CaptionOntology(ontology_mapping))
+    raise ValueError(f"Unknown base model: {model_name}")
+
+def mask_to_polygons(mask, min_area):
+    """Extract external contour polygons from a binary mask"""
+    import cv2
+    import numpy as np
+
+    contours, _ = cv2.findContours(
+        mask.astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
+    )
+    polygons = []
+    for contour in contours:
+        if len(contour) < 3 or cv2.contourArea(contour) < min_area:
+            continue
+        polygons.append(contour.reshape(-1, 2))
+    return polygons
+
+def detections_to_yolo_lines(detections, width, height):
+    """Convert supervision-style detections to YOLO label lines
+
+    Masks are written as polygons (as Autodistill does for GroundedSAM),
+    otherwise boxes are written as normalized cx/cy/w/h.
+    """
+    lines = []
+    xyxy = getattr(detections, 'xyxy', None)
+    if xyxy is None or len(xyxy) == 0:
+        return lines
+    class_ids = detections.class_id
+    masks = getattr(detections, 'mask', None)
+    min_area = MIN_POLYGON_AREA_FRACTION * width * height
+
+    for i in range(len(xyxy)):
+        class_id = int(class_ids[i])
+        if masks is not None:
+            for polygon in mask_to_polygons(masks[i], min_area):
+                coords = []
+                for x, y in polygon:
+                    coords.append(f"{x / width:.6f}")
+                    coords.append(f"{y / height:.6f}")
+                lines.append(f"{class_id} " + ' '.join(coords))
+        else:
+            x1, y1, x2, y2 = (float(v) for v in xyxy[i])
+            cx = (x1 + x2) / 2 / width
+            cy = (y1 + y2) / 2 / height
+            w = (x2 - x1) / width
+            h = (y2 - y1) / height
+            lines.append(f"{class_id} {cx:.6f} {cy:.6f} {w:.6f} {h:.6f}")
+    return lines
+
+def detections_to_mask_labels(detections, width, height):
+    """Box label lines plus full-resolution masks for the mask store
+    
+    Writes one box per stored mask, its full extent, so box rows and
+    mask instances pair up 1:1 when masks_to_polygon_labels swaps each
+    row for that mask's contours. The masks themselves go into the entry
+    as cropped COCO-style RLE (base64 varint runs) rather than polygons,
+    so fragmented damage regions keep every pixel.
+    """
+    import base64
+    
+    from dataset_utils import encode_mask
+    
+    masks = getattr(detections, 'mask', None)
+    if masks is None:
+        return detections_to_yolo_lines(detections, width, height), {}
+    min_area = MIN_POLYGON_AREA_FRACTION * width * height
+    lines, entries = [], []
+    for mask, class_id in zip(masks, detections.class_id):
+        class_id = int(class_id)
+        if not mask_to_polygons(mask, min_area):
+            continue
+        box, data = encode_mask(mask, 'rle')
+        x, y, w, h = box
+        lines.append(f"{class_id} {(x + w / 2) / width:.6f} {(y + h / 2) / height:.6f} "
+                     f"{w / width:.6f} {h / height:.6f}")
+        entries.append({'class_id': class_id, 'box': list(box), 'rle': base64.b64encode(data).decode('ascii')})
+    return lines, {'masks': entries, 'image_size': [height, width]}
+
+def detections_to_labels(detections, width, height, mask_format='polygon'):
+    """(label lines, entry metadata) in the requested mask format"""
+    if mask_format == 'polygon':
+        return detections_to_yolo_lines(detections, width, height), {}
+    return detections_to_mask_labels(detections, width, height)
+
+def label_image(base_model, image_path, image_hash=None, mask_format='polygon'):
+    """Run the base model on one image: (YOLO label lines, entry metadata)"""
+    from PIL import Image
+
+    if hasattr(base_model, 'label'):
+        # Labelers that pick their own path (self-distillation) report it
+        return base_model.label(image_path, image_hash, mask_format)
+    with Image.open(image_path) as img:
+        width, height = img.size
+    detections = base_model.predict(image_path)
+    return detections_to_labels(detections, width, height, mask_format)
+
+def label_shard(model_name, ontology_mapping, items, checkpoint_dir, shard_name='0', model_options=None,
+                mask_format='polygon'):
+    """Label one shard of (image_path, image_hash, key, entry_meta) items
+    
+    Runs in-process or inside a worker process; every finished image is
+    checkpointed immediately.
+    """
+    start = time.perf_counter()
+    base_model = load_base_model(model_name, ontology_mapping, model_options)
+    print(f"⏱️ [shard {shard_name}] {model_name} loaded in {time.perf_counter() - start:.1f}s")
+    store = CheckpointStore(checkpoint_dir)
+    labeled = 0
+    failed = []
+    for i, (image_path, image_hash, key, entry_meta) in enumerate(items, 1):
+        try:
+            labels, meta = label_image(base_model, image_path, image_hash, mask_format)
+        except Exception as e:
+            print(f"❌ [shard {shard_name}] Failed to label {image_path}: {e}")
+            failed.append(image_path)
+            continue
+        entry = dict(entry_meta, labels=labels, **meta)
+        store.put(key, entry)
+        labeled += 1
+        if i % 100 == 0 or i == len(items):
+            print(f"🏷️ [shard {shard_name}] Labeled {i}/{len(items)} images")
+    return labeled, failed
+
+def label_images(model_name, ontology_mapping, items, checkpoint_dir, workers=1, level=1,
+                 model_options=None, mask_format='polygon'):
+    """Label items, sharding them by content hash across worker processes"""
+    if workers <= 1:
+        return label_shard(model_name, ontology_mapping, items, checkpoint_dir,
+                           model_options=model_options, mask_format=mask_format)
+    
+    shards = [[] for _ in range(workers)]
+    for item in items:
+        shards[shard_for(item[1], workers, level=level)].append(item)
+    
+    labeled = 0
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(label_shard, model_name, ontology_mapping, shard,
+                        checkpoint_dir, str(index), model_options, mask_format)
+            for index, shard in enumerate(shards) if shard
+        ]
+        for future in as_completed(futures):
+            shard_labeled, shard_failed = future.result()
+            labeled += shard_labeled
+            failed.extend(shard_failed)
+    return labeled, failed
+
+def assign_split(image_hash, valid_fraction=0.2):
+    """Deterministic train/valid split so images never hop between runs"""
+    bucket = int(image_hash[:8], 16) / 0xFFFFFFFF
+    return 'valid' if bucket < valid_fraction else 'train'
+
+def _link_or_copy(src, dst):
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def write_entry_masks(writer, stem, entry):
+    """Copy a cache entry's RLE masks into a split's mask store"""
+    import base64
+    
+    from dataset_utils import decode_mask, encode_mask
+    
+    image = writer.add_image(stem)
+    height, width = entry.get('image_size') or (0, 0)
+    for mask in entry.get('masks', []):
+        data = base64.b64decode(mask['rle'])
+        if writer.encoding != 'rle':
+            crop = decode_mask(data, mask['box'])
+            data = encode_mask(crop, writer.encoding)[1]
+        writer.add(image, mask['class_id'], mask['box'], (height, width), data)
+
+def write_yolo_dataset(records, output_dir, class_names, valid_fraction=0.2, mask_format='polygon'):
+    """Assemble train/valid images, labels and data.yaml
+
+    records is a list of (image_path, image_hash, label_lines, entry)
+    where entry is the label cache entry. With an rle/bits mask_format
+    the entries' masks are written to one mask store per split (see
+    dataset_utils.MaskStoreWriter).
+    """
+    import yaml
+
+    counts = {'train': 0, 'valid': 0}
+    mask_writers = {}
+    for split in counts:
+        os.makedirs(os.path.join(output_dir, split, 'images'), exist_ok=True)
+        os.makedirs(os.path.join(output_dir, split, 'labels'), exist_ok=True)
+        if mask_format != 'polygon':
+            from dataset_utils import MaskStoreWriter
+            mask_writers[split] = MaskStoreWriter(os.path.join(output_dir, split), mask_format)
+
+    for image_path, image_hash, labels, entry in records:
+        split = assign_split(image_hash, valid_fraction)
+        name = os.path.basename(image_path)
+        stem = os.path.splitext(name)[0]
+        _link_or_copy(image_path, os.path.join(output_dir, split, 'images', name))
+        with open(os.path.join(output_dir, split, 'labels', f"{stem}.txt"), 'w') as f:
+            f.write('\n'.join(labels))
+        if mask_writers:
+            write_entry_masks(mask_writers[split], stem, entry)
+        counts[split] += 1
+    for writer in mask_writers.values():
+        writer.close()
+
+    # Relative paths keep data.yaml valid wherever the dataset is mounted
+    data = {
+        'names': list(class_names),
+        'nc': len(class_names),
+        'train': 'train/images',
+        'val': 'valid/images',
+    }
+    with open(os.path.join(output_dir, 'data.yaml'), 'w') as f:
+        yaml.safe_dump(data, f, sort_keys=False)
+    return counts
@@ -1,43 +1,108 @@
 #!/usr/bin/env python3
 import os
-import subprocess
+import argparse
 import glob
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
+# Shared helpers live in src/data in the repo and next to this script in the image
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src', 'data'))
+
 print("🚀 Starting Autodistill Processing Container")
 print(f"Python version: {sys.version}")
 print(f"Working directory: {os.getcwd()}")
 
-# Import after environment setup
-try:
-    from autodistill.detection import CaptionOntology
-    from autodistill_grounded_sam import GroundedSAM
-    print("✅ Autodistill imports successful")
-except ImportError as e:
-    print(f"❌ Import error: {e}")
-    sys.exit(1)
+from dedup import HASH_METHODS, choose_representative, find_clusters
+from labeling import (
+    BASE_MODELS,
+    CACHE_MANIFEST,
+    MASK_FORMATS,
+    CheckpointStore,
+    LabelCache,
+    base_model_version,
+    hash_images,
+    label_images,
+    list_images,
+    ontology_classes,
+    ontology_fingerprint,
+    resolve_shard,
+    shard_for,
+    write_yolo_dataset,
+)
+from self_distill import TEACHER_ROUTES, find_student_weights, summarize_routes
+from weights_registry import StartupTimer
+
+ONTOLOGY = {
+    "damaged roof shingles": "damage",
+}
+
+def _convert_one(png_file, jpg_file, quality):
+    """Decode a PNG and re-encode it as JPG in-process (runs in a worker)"""
+    from PIL import Image
+
+    with Image.open(png_file) as img:
+        if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+            # Flatten transparency onto white like ImageMagick does for JPG
+            rgba = img.convert('RGBA')
+            background = Image.new('RGB', rgba.size, (255, 255, 255))
+            background.paste(rgba, mask=rgba.split()[-1])
+            rgb = background
+        else:
+            rgb = img.convert('RGB')
+        tmp_file = jpg_file + '.tmp'
+        rgb.save(tmp_file, 'JPEG', quality=quality)
+    os.replace(tmp_file, jpg_file)
+    return os.path.getsize(png_file)
 
-def convert_png_to_jpg(input_dir):
-    """Convert PNG files to JPG format"""
+def convert_png_to_jpg(input_dir, quality=92, workers=None, remove_png=True):
+    """Convert PNG files to JPG format across a process pool"""
     print(f"🔄 Converting PNG files in {input_dir}")
-    png_files = glob.glob(os.path.join(input_dir, "*.png"))
-    converted_count = 0
-    
+    png_files = sorted(glob.glob(os.path.join(input_dir, "*.png")))
+    workers = workers or os.cpu_count() or 1
+
+    pending = []
+    skipped_count = 0
     for png_file in png_files:
-        jpg_file = png_file.replace('.png', '.jpg')
-        try:
-            # Use ImageMagick convert command
-            result = subprocess.run(['convert', png_file, jpg_file], 
-                                  capture_output=True, text=True, check=True)
-            os.remove(png_file)
-            converted_count += 1
-            print(f"✅ Converted: {os.path.basename(png_file)} → {os.path.basename(jpg_file)}")
-        except subprocess.CalledProcessError as e:
-            print(f"❌ Failed to convert {png_file}: {e}")
+        jpg_file = os.path.splitext(png_file)[0] + '.jpg'
+        # Skip PNGs that already have an up-to-date JPG next to them
+        if os.path.exists(jpg_file) and os.path.getmtime(jpg_file) >= os.path.getmtime(png_file):
+            skipped_count += 1
+            if remove_png:
+                os.remove(png_file)
             continue
-    
-    print(f"✅ Converted {converted_count} PNG files to JPG")
+        pending.append((png_file, jpg_file))
+
+    converted_count = 0
+    failed_count = 0
+    bytes_in = 0
+    start = time.perf_counter()
+    if pending:
+        print(f"⚙️ Converting {len(pending)} PNG files with {workers} workers (quality={quality})")
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(_convert_one, png_file, jpg_file, quality): png_file
+                for png_file, jpg_file in pending
+            }
+            for future in as_completed(futures):
+                png_file = futures[future]
+                try:
+                    bytes_in += future.result()
+                except Exception as e:
+                    failed_count += 1
+                    print(f"❌ Failed to convert {png_file}: {e}")
+                    continue
+                if remove_png:
+                    os.remove(png_file)
+                converted_count += 1
+    elapsed = time.perf_counter() - start
+
+    print(f"✅ Converted {converted_count} PNG files to JPG "
+          f"({skipped_count} up to date, {failed_count} failed)")
+    if converted_count and elapsed > 0:
+        print(f"📈 Conversion throughput: {converted_count / elapsed:.1f} images/sec, "
+              f"{bytes_in / elapsed / 1e6:.1f} MB/sec over {elapsed:.1f}s")
     return converted_count
 
 def list_directory_contents(directory):
@@ -56,10 +121,68 @@ def list_directory_contents(directory):
     else:
         print(f"❌ Directory {directory} does not exist")
 
-def main():
+def parse_args():
+    """Parse processing job arguments"""
+    parser = argparse.ArgumentParser()
     # SageMaker paths
-    input_dir = '/opt/ml/processing/input'
-    output_dir = '/opt/ml/processing/output'
+    parser.add_argument('--input-dir', default='/opt/ml/processing/input')
+    parser.add_argument('--output-dir', default='/opt/ml/processing/output')
+    parser.add_argument('--jpeg-quality', type=int, default=92)
+    parser.add_argument('--convert-workers', type=int, default=0,
+                        help='PNG conversion processes (0 = one per CPU)')
+    parser.add_argument('--keep-png', action='store_true',
+                        help='Keep source PNGs after conversion')
+    parser.add_argument('--cache-dir', default=None,
+                        help='Directory holding a previous label_cache.json')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Relabel every image, ignoring cached labels')
+    parser.add_argument('--base-model', choices=BASE_MODELS, default='grounded-sam',
+                        help='Labeling model (stub = deterministic fake for local runs)')
+    parser.add_argument('--student-weights', default=None,
+                        help='Trained best.pt, model dir or model.tar.gz for --base-model self-distill')
+    parser.add_argument('--teacher', choices=['grounded-sam', 'stub'], default='grounded-sam',
+                        help='Labeler for images the student is unsure about')
+    parser.add_argument('--accept-conf', type=float, default=0.6,
+                        help='Student detections must all reach this confidence to be accepted')
+    parser.add_argument('--min-conf', type=float, default=0.25,
+                        help='Student detections below this are ignored')
+    parser.add_argument('--audit-fraction', type=float, default=0.05,
+                        help='Share of accepted images also labeled by the teacher')
+    parser.add_argument('--min-audit-agreement', type=float, default=0.8)
+    parser.add_argument('--label-workers', type=int, default=1,
+                        help='Worker processes, each labeling one hash shard')
+    parser.add_argument('--num-shards', type=int, default=0,
+                        help='Total shards across instances (0 = from resourceconfig.json)')
+    parser.add_argument('--shard-index', type=int, default=0)
+    parser.add_argument('--checkpoint-dir', default=None,
+                        help='Per-image label checkpoints (default: <output-dir>/../checkpoints)')
+    parser.add_argument('--resume-dir', default=None,
+                        help='Checkpoints from a previous attempt to skip (ignored with --no-cache unless merging)')
+    parser.add_argument('--no-dedup', action='store_true',
+                        help='Label every image, even near-duplicate frames')
+    parser.add_argument('--dedup-threshold', type=int, default=6,
+                        help='Max Hamming distance (of 64 bits) between near-duplicates')
+    parser.add_argument('--dedup-hash', choices=HASH_METHODS, default='phash')
+    parser.add_argument('--dedup-index', choices=['auto', 'brute', 'multi-index'], default='auto')
+    parser.add_argument('--dedup-mode', choices=['inherit', 'drop'], default='inherit',
+                        help='Duplicates reuse the representative\'s labels, or are left out')
+    parser.add_argument('--mask-format', choices=MASK_FORMATS, default='polygon',
+                        help='rle/bits: box labels plus one indexed mask store per split instead of polygon labels')
+    parser.add_argument('--pack', action='store_true',
+                        help='Also write memory-mapped shards to <output-dir>/packed')
+    parser.add_argument('--shard-size-mb', type=int, default=256)
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--label-only', action='store_true',
+                      help='Label this shard into checkpoints without assembling the dataset')
+    mode.add_argument('--merge-only', action='store_true',
+                      help='Assemble the dataset from cache and checkpoints without labeling')
+    return parser.parse_args()
+
+def main():
+    startup = StartupTimer()
+    args = parse_args()
+    input_dir = args.input_dir
+    output_dir = args.output_dir
     
     print(f"📂 Input directory: {input_dir}")
     print(f"📂 Output directory: {output_dir}")
@@ -74,37 +197,207 @@ def main():
     if not os.path.exists(input_dir) or not os.listdir(input_dir):
         print("❌ No input files found!")
         sys.exit(1)
+    # Fail before converting and hashing, not after
+    if args.base_model == 'self-distill' and not args.student_weights:
+        print("❌ --base-model self-distill needs --student-weights")
+        sys.exit(1)
+    startup.mark('inputs checked')
     
     # Step 1: Convert PNG to JPG (exactly like your Colab)
-    convert_png_to_jpg(input_dir)
+    convert_png_to_jpg(
+        input_dir,
+        quality=args.jpeg_quality,
+        workers=args.convert_workers,
+        remove_png=not args.keep_png
+    )
     
     # Step 2: Define ontology for hail damage (matches your Colab)
     print("🏷️ Setting up ontology for hail damage detection")
-    ontology = CaptionOntology({
-        "damaged roof shingles": "damage",
-    })
-    
-    # Step 3: Load GroundedSAM model
-    print("🤖 Loading GroundedSAM model...")
-    try:
-        base_model = GroundedSAM(ontology=ontology)
-        print("✅ GroundedSAM model loaded successfully")
-    except Exception as e:
-        print(f"❌ Failed to load GroundedSAM: {e}")
+    class_names = ontology_classes(ONTOLOGY)
+    
+    # Step 3: Look up labels in the cache and in per-image checkpoints
+    image_paths = list_images(input_dir)
+    if not image_paths:
+        print("❌ No JPG images to label!")
         sys.exit(1)
+    print(f"🔑 Hashing {len(image_paths)} images...")
+    image_hashes = hash_images(image_paths)
+    
+    # Self-distillation: the trained detector labels, GroundedSAM handles the rest
+    model_options = None
+    fallback_versions = []
+    if args.base_model == 'self-distill':
+        model_options = {
+            'weights': find_student_weights(args.student_weights),
+            'accept_conf': args.accept_conf,
+            'min_conf': args.min_conf,
+            'audit_fraction': args.audit_fraction,
+            'teacher': args.teacher,
+        }
+        print(f"🎓 Student weights: {model_options['weights']} (teacher: {args.teacher})")
+        # Teacher labels from earlier runs are at least as good as the student's
+        fallback_versions = [base_model_version(args.teacher)]
     
-    # Step 4: Auto-label all images
-    print("🏷️ Starting auto-labeling process...")
-    try:
-        base_model.label(
-            input_folder=input_dir,
-            output_folder=output_dir
+    # Mask-store entries hold box lines plus RLE masks, so they never mix with polygon entries
+    model_version = base_model_version(args.base_model, model_options)
+    if args.mask_format != 'polygon':
+        model_version += '+masks'
+        fallback_versions = [version + '+masks' for version in fallback_versions]
+    cache = LabelCache(
+        ontology_fingerprint(ONTOLOGY),
+        model_version,
+        fallback_versions=fallback_versions
+    )
+    cache_path = os.path.join(output_dir, CACHE_MANIFEST)
+    loaded = 0
+    if args.cache_dir:
+        loaded += cache.load(os.path.join(args.cache_dir, CACHE_MANIFEST))
+    loaded += cache.load(cache_path)
+    print(f"🗃️ Label cache: {loaded} entries loaded (model {cache.model_version})")
+    
+    checkpoint_dir = args.checkpoint_dir or os.path.join(
+        os.path.dirname(os.path.abspath(output_dir)), 'checkpoints'
+    )
+    # --no-cache means relabel: checkpoints left by earlier runs are as stale as the cache.
+    # A merge still reads them, since they were written by this run's shard jobs.
+    use_checkpoints = args.merge_only or not args.no_cache
+    checkpoints = CheckpointStore(checkpoint_dir, resume_dirs=[args.resume_dir] if use_checkpoints else [])
+    
+    labels_by_path = {}
+    entries_by_path = {}
+    to_label = []
+    checkpoint_hits = 0
+    for image_path in image_paths:
+        key = cache.key(image_hashes[image_path])
+        entry = None
+        if not args.no_cache:
+            entry = cache.get(image_hashes[image_path])
+        if entry is None and use_checkpoints:
+            entry = checkpoints.get(key)
+            if entry is not None:
+                checkpoint_hits += 1
+                cache.add(key, entry)
+        if entry is None:
+            to_label.append(image_path)
+        else:
+            labels_by_path[image_path] = entry['labels']
+            entries_by_path[image_path] = entry
+    print(f"🗃️ Cache hits: {len(labels_by_path) - checkpoint_hits}, "
+          f"checkpoint hits: {checkpoint_hits}, images to label: {len(to_label)}")
+    
+    # Near-duplicate frames (bursts, retakes) share one labeling pass
+    clusters = {i: [p] for i, p in enumerate(image_paths)}
+    if not args.no_dedup:
+        print(f"🔍 Finding near-duplicates ({args.dedup_hash}, threshold {args.dedup_threshold})...")
+        clusters = find_clusters(
+            image_paths, args.dedup_threshold, args.dedup_hash, args.dedup_index,
+            workers=args.convert_workers
+        )
+        representatives = set(
+            choose_representative(members, image_hashes, labels_by_path)
+            for members in clusters.values()
+        )
+        skipped = [p for p in to_label if p not in representatives]
+        to_label = [p for p in to_label if p in representatives]
+        duplicates = len(image_paths) - len(clusters)
+        print(f"♻️ {len(clusters)} clusters, {duplicates} near-duplicate images; "
+              f"skipping {len(skipped)} labeling passes ({len(to_label)} left to label)")
+    
+    # Step 4: Auto-label only new or changed images in this instance's shard
+    num_shards, shard_index = resolve_shard(args.num_shards, args.shard_index)
+    label_only = args.label_only or (num_shards > 1 and not args.merge_only)
+    if args.merge_only:
+        mine = []
+    else:
+        mine = [p for p in to_label if shard_for(image_hashes[p], num_shards) == shard_index]
+        if num_shards > 1:
+            print(f"🧩 Shard {shard_index + 1}/{num_shards}: {len(mine)} of {len(to_label)} images")
+    
+    failed = []
+    if mine:
+        items = []
+        for image_path in mine:
+            image_hash = image_hashes[image_path]
+            entry_meta = cache.make_entry(image_hash, os.path.basename(image_path), [])
+            items.append((image_path, image_hash, cache.key(image_hash), entry_meta))
+        
+        print(f"🤖 Labeling with {args.base_model} using {args.label_workers} worker(s)...")
+        startup.mark('labeling started')
+        start = time.perf_counter()
+        labeled, failed = label_images(
+            args.base_model, ONTOLOGY, items, checkpoint_dir, workers=args.label_workers,
+            model_options=model_options, mask_format=args.mask_format
         )
-        print("✅ Auto-labeling completed successfully!")
-    except Exception as e:
-        print(f"❌ Auto-labeling failed: {e}")
+        elapsed = time.perf_counter() - start
+        print(f"✅ Labeled {labeled} images ({len(failed)} failed) in {elapsed:.1f}s")
+        if not args.no_dedup and skipped and labeled:
+            # Only this shard's share of the skipped passes was saved here
+            per_image = elapsed / labeled
+            share = sum(1 for p in skipped if shard_for(image_hashes[p], num_shards) == shard_index)
+            print(f"💰 Dedup saved ~{share * per_image / 60:.1f} min of {args.base_model} time "
+                  f"({share} images at {per_image:.2f}s each)")
+        
+        new_entries = []
+        for image_path, image_hash, key, _ in items:
+            entry = checkpoints.get(key)
+            if entry is not None:
+                cache.add(key, entry)
+                labels_by_path[image_path] = entry['labels']
+                entries_by_path[image_path] = entry
+                new_entries.append(entry)
+                if entry.get('route') in TEACHER_ROUTES:
+                    # Also usable by plain GroundedSAM runs and future students
+                    teacher_version = fallback_versions[0]
+                    teacher_entry = {k: v for k, v in entry.items() if k not in ('route', 'audit_f1')}
+                    cache.add(cache.key(image_hash, teacher_version),
+                              dict(teacher_entry, model_version=teacher_version))
+        if model_options:
+            summarize_routes(new_entries, args.min_audit_agreement)
+    elif not args.merge_only:
+        print(f"✅ All images already labeled, skipping {args.base_model}")
+    
+    if label_only:
+        print(f"📝 Label-only mode: checkpoints written to {checkpoint_dir}")
+        if failed:
+            print(f"❌ {len(failed)} images failed; rerun to retry them")
+            sys.exit(1)
+        print("🎉 Autodistill shard labeling completed successfully!")
+        return
+        
+    # Keep whatever was labeled so a rerun only pays for the rest
+    cache.save(cache_path)
+    
+    # Duplicates take their representative's labels and split, so a
+    # cluster never straddles train and valid
+    records = []
+    missing = []
+    dropped = 0
+    for members in clusters.values():
+        representative = choose_representative(members, image_hashes, labels_by_path)
+        if representative not in labels_by_path:
+            missing.extend(members)
+            continue
+        for image_path in members:
+            if image_path != representative and args.dedup_mode == 'drop':
+                dropped += 1
+                continue
+            source = image_path if image_path in labels_by_path else representative
+            records.append((image_path, image_hashes[representative], labels_by_path[source], entries_by_path[source]))
+    if missing:
+        print(f"❌ {len(missing)} images have no labels; rerun to resume from checkpoints")
+        for image_path in missing[:10]:
+            print(f"  {os.path.basename(image_path)}")
         sys.exit(1)
     
+    # Merge cached and fresh labels into the train/valid layout
+    order = {image_path: i for i, image_path in enumerate(image_paths)}
+    records.sort(key=lambda record: order[record[0]])
+    counts = write_yolo_dataset(records, output_dir, class_names, mask_format=args.mask_format)
+    print(f"📦 Wrote dataset: {counts['train']} train, {counts['valid']} valid images"
+          + (f" ({dropped} near-duplicates dropped)" if dropped else ""))
+    if args.mask_format != 'polygon':
+        print(f"🎭 Masks stored as {args.mask_format} in <split>/masks.bin (box-only label files)")
+    
     # Step 5: Verify outputs
     list_directory_contents(output_dir)
     
@@ -130,6 +423,19 @@ def main():
         print("❌ ERROR: data.yaml not generated!")
         sys.exit(1)
     
+    # Step 6: Pack into a few large shards so training skips the small-file copy
+    if args.pack:
+        from dataset_utils import pack_yolo_dataset
+        
+        packed_dir = os.path.join(output_dir, 'packed')
+        print(f"📦 Packing dataset into {packed_dir}...")
+        start = time.perf_counter()
+        summary = pack_yolo_dataset(data_yaml_path, packed_dir, shard_size_mb=args.shard_size_mb)
+        for split, manifest in summary.items():
+            size_mb = sum(s['bytes'] for s in manifest['shards']) / 1e6
+            print(f"📦 {split}: {manifest['count']} images in {len(manifest['shards'])} shard(s), {size_mb:.1f} MB")
+        print(f"✅ Packed in {time.perf_counter() - start:.1f}s")
+    
     print("🎉 Autodistill processing completed successfully!")
 
 if __name__ == "__main__":
@@ -0,0 +1,200 @@
+import os
+import glob
+
+import numpy as np
+
+# Label entry 'route' values
+STUDENT, UNCERTAIN, DISAGREE, AUDIT = 'student', 'uncertain', 'disagree', 'audit'
+# Routes whose labels came from the teacher (GroundedSAM)
+TEACHER_ROUTES = (UNCERTAIN, DISAGREE, AUDIT)
+
+def find_student_weights(path):
+    """Resolve trained weights from a .pt file, a model dir or a model.tar.gz
+    
+    Archives are extracted once, into student/<archive name> next to them.
+    """
+    from dataset_utils import extract_archive
+    
+    if os.path.isfile(path) and path.endswith('.pt'):
+        return path
+    if os.path.isfile(path) and path.endswith('.tar.gz'):
+        archives, path = [path], os.path.join(os.path.dirname(path), 'student')
+    else:
+        archives = sorted(glob.glob(os.path.join(path, '*.tar.gz'))) if os.path.isdir(path) else []
+    for archive in archives:
+        target = os.path.join(os.path.dirname(archive), 'student', os.path.basename(archive)[:-len('.tar.gz')])
+        if not os.path.isdir(target):
+            partial = f"{target}.{os.getpid()}.partial"
+            extract_archive(archive, partial)
+            os.rename(partial, target)
+    candidates = sorted(glob.glob(os.path.join(path, '**', 'best.pt'), recursive=True))
+    if not candidates:
+        raise FileNotFoundError(f"No best.pt found under {path}")
+    return candidates[0]
+
+def box_iou(a, b):
+    """(N, M) IoU between xyxy box arrays"""
+    a = np.asarray(a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float32).reshape(-1, 4)
+    top_left = np.maximum(a[:, None, :2], b[None, :, :2])
+    bottom_right = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.clip(bottom_right - top_left, 0, None).prod(axis=2)
+    area_a = (a[:, 2:] - a[:, :2]).prod(axis=1)
+    area_b = (b[:, 2:] - b[:, :2]).prod(axis=1)
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+def matched(boxes_a, classes_a, boxes_b, classes_b, iou_threshold):
+    """Greedy one-to-one matches between two same-image box sets"""
+    if not len(boxes_a) or not len(boxes_b):
+        return 0
+    iou = box_iou(boxes_a, boxes_b)
+    iou[np.asarray(classes_a)[:, None] != np.asarray(classes_b)[None, :]] = 0
+    count = 0
+    while iou.size and iou.max() >= iou_threshold:
+        i, j = np.unravel_index(iou.argmax(), iou.shape)
+        iou[i, :] = 0
+        iou[:, j] = 0
+        count += 1
+    return count
+
+def agreement_f1(boxes_a, classes_a, boxes_b, classes_b, iou_threshold=0.5):
+    """F1 of one box set against another (1.0 when both are empty)"""
+    if not len(boxes_a) and not len(boxes_b):
+        return 1.0
+    hits = matched(boxes_a, classes_a, boxes_b, classes_b, iou_threshold)
+    return 2 * hits / (len(boxes_a) + len(boxes_b))
+
+class SelfDistillLabeler:
+    """Trained hail-damage detector as the labeler, GroundedSAM as the teacher
+    
+    The student runs on each image and on its mirror image. An image is
+    accepted with the student's boxes when every detection is above
+    accept_conf and the mirrored pass finds the same boxes. Images with
+    detections between min_conf and accept_conf, or whose two passes
+    disagree, go to the teacher. A deterministic audit_fraction of
+    accepted images also goes to the teacher to measure agreement.
+    """
+    
+    def __init__(self, ontology_mapping, weights, accept_conf=0.6, min_conf=0.25,
+                 audit_fraction=0.05, teacher='grounded-sam', img_size=640, flip_iou=0.5):
+        from ultralytics import YOLO
+        
+        from labeling import ontology_classes
+        
+        self.ontology_mapping = ontology_mapping
+        self.model = YOLO(weights, task='detect')
+        self.accept_conf = accept_conf
+        self.min_conf = min_conf
+        self.audit_fraction = audit_fraction
+        self.teacher_name = teacher
+        self.teacher = None
+        self.img_size = img_size
+        self.flip_iou = flip_iou
+        
+        # Student class ids -> ontology class ids, matched by name
+        class_names = ontology_classes(ontology_mapping)
+        student_names = self.model.names
+        missing = [name for name in class_names if name not in student_names.values()]
+        if missing:
+            raise ValueError(f"Student model lacks ontology classes {missing}: {student_names}")
+        self.class_map = {
+            student_id: class_names.index(name)
+            for student_id, name in student_names.items() if name in class_names
+        }
+    
+    def _teacher(self):
+        if self.teacher is None:
+            from labeling import load_base_model
+            
+            self.teacher = load_base_model(self.teacher_name, self.ontology_mapping)
+        return self.teacher
+    
+    def _predict(self, image):
+        """Student boxes on the image and on its mirror (mapped back)"""
+        width = image.shape[1]
+        results = self.model.predict(
+            [image, np.ascontiguousarray(image[:, ::-1])], imgsz=self.img_size,
+            conf=self.min_conf, device='cpu', verbose=False
+        )
+        passes = []
+        for flipped, result in zip((False, True), results):
+            boxes = result.boxes.xyxy.cpu().numpy()
+            if flipped:
+                boxes = np.stack([width - boxes[:, 2], boxes[:, 1], width - boxes[:, 0], boxes[:, 3]], axis=1)
+            classes = [self.class_map.get(int(c), -1) for c in result.boxes.cls.cpu().numpy()]
+            keep = np.array([c >= 0 for c in classes], dtype=bool)
+            passes.append((boxes[keep], np.array(classes, dtype=np.int64)[keep],
+                           result.boxes.conf.cpu().numpy()[keep]))
+        return passes
+    
+    def route(self, passes):
+        (boxes, classes, confs), (flip_boxes, flip_classes, flip_confs) = passes
+        if ((confs < self.accept_conf).any()) or ((flip_confs < self.accept_conf).any()):
+            return UNCERTAIN
+        hits = matched(boxes, classes, flip_boxes, flip_classes, self.flip_iou)
+        if hits != len(boxes) or hits != len(flip_boxes):
+            return DISAGREE
+        return STUDENT
+    
+    def is_audited(self, image_hash):
+        # Hash tail: independent of the split ([:8]) and shard ([8:24]) digits
+        return int(image_hash[-8:], 16) / 0xFFFFFFFF < self.audit_fraction
+    
+    def label(self, image_path, image_hash, mask_format='polygon'):
+        """(YOLO label lines, entry metadata) for one image"""
+        import cv2
+        
+        from labeling import detections_to_labels
+        
+        image = cv2.imread(image_path)
+        if image is None:
+            raise ValueError(f"Could not read {image_path}")
+        height, width = image.shape[:2]
+        passes = self._predict(image)
+        route = self.route(passes)
+        boxes, classes, _ = passes[0]
+        
+        if route == STUDENT and not self.is_audited(image_hash):
+            lines = []
+            for (x1, y1, x2, y2), class_id in zip(boxes, classes):
+                lines.append(f"{int(class_id)} {(x1 + x2) / 2 / width:.6f} {(y1 + y2) / 2 / height:.6f} "
+                             f"{(x2 - x1) / width:.6f} {(y2 - y1) / height:.6f}")
+            return lines, {'route': STUDENT}
+        
+        detections = self._teacher().predict(image_path)
+        meta = {'route': route}
+        if route == STUDENT:
+            teacher_boxes = np.asarray(detections.xyxy, dtype=np.float32).reshape(-1, 4)
+            teacher_classes = np.asarray(detections.class_id, dtype=np.int64).reshape(-1)
+            meta = {
+                'route': AUDIT,
+                'audit_f1': round(agreement_f1(boxes, classes, teacher_boxes, teacher_classes), 4),
+            }
+        lines, mask_meta = detections_to_labels(detections, width, height, mask_format)
+        return lines, dict(meta, **mask_meta)
+
+def summarize_routes(entries, min_agreement=0.8):
+    """Print the share of images per labeling path and the audit agreement"""
+    routes = {}
+    for entry in entries:
+        route = entry.get('route', STUDENT)
+        routes[route] = routes.get(route, 0) + 1
+    total = sum(routes.values())
+    if not total:
+        return routes
+    
+    print("🧭 Self-distillation routing:")
+    for route in (STUDENT, UNCERTAIN, DISAGREE, AUDIT):
+        count = routes.get(route, 0)
+        print(f"  {route:<10} {count:>7} ({count / total:.1%})")
+    teacher = sum(routes.get(route, 0) for route in TEACHER_ROUTES)
+    print(f"  teacher share: {teacher / total:.1%} of {total} images")
+    
+    scores = [entry['audit_f1'] for entry in entries if 'audit_f1' in entry]
+    if scores:
+        mean = float(np.mean(scores))
+        status = "✅" if mean >= min_agreement else "⚠️"
+        print(f"{status} Audit agreement with teacher: F1 {mean:.3f} over {len(scores)} images")
+        if mean < min_agreement:
+            print(f"⚠️ Below {min_agreement}: raise --accept-conf or retrain the student")
+    return routes
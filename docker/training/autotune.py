@@ -0,0 +1,195 @@
+import os
+import copy
+import time
+import resource
+
+BATCH_LADDER = (4, 8, 16, 32, 64, 128)
+WORKER_LADDER = (0, 2, 4, 8, 16)
+# Fraction of device (GPU) or host (CPU) memory a setting may peak at
+SAFETY_MARGIN = 0.85
+# Settings this close to the best throughput count as ties; the cheaper one wins
+BATCH_TOLERANCE = 0.03
+WORKER_TOLERANCE = 0.05
+
+def total_memory(device):
+    import torch
+    
+    if device.type == 'cuda':
+        return torch.cuda.get_device_properties(device).total_memory
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+def peak_memory(device):
+    import torch
+    
+    if device.type == 'cuda':
+        return torch.cuda.max_memory_allocated(device)
+    # Linux reports ru_maxrss in KiB; it only grows, which suits an ascending ladder
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def _is_oom(error):
+    return 'out of memory' in str(error).lower()
+
+def build_train_dataset(data_yaml, img_size, batch, trainer=None):
+    """(train dataset, cfg) built the way trainer builds them
+    
+    trainer is a make_trainer class, or None for the stock
+    DetectionTrainer, so packed shards and the image cache are read (and
+    augmented) as training will read them. cfg carries the loss gains.
+    """
+    from ultralytics.cfg import get_cfg
+    from ultralytics.data import YOLODataset
+    from ultralytics.data.utils import check_det_dataset
+    
+    from packed_dataset import build_packed_dataset
+    
+    cfg = get_cfg(overrides={'data': data_yaml, 'imgsz': img_size, 'batch': batch})
+    data = check_det_dataset(data_yaml)
+    dataset = build_packed_dataset(cfg, data['train'], batch, data, mode='train',
+                                   dataset_class=getattr(trainer, 'dataset_class', YOLODataset),
+                                   **getattr(trainer, 'dataset_kwargs', {}))
+    return dataset, cfg
+
+def real_batch(dataset, batch, device):
+    """One augmented, collated training batch moved to device, preprocessed like the trainer does"""
+    from ultralytics.data import build_dataloader
+    
+    loader = build_dataloader(dataset, batch, 0, shuffle=True, rank=-1)
+    sample = next(iter(loader))
+    sample = {k: v.to(device) if hasattr(v, 'to') else v for k, v in sample.items()}
+    sample['img'] = sample['img'].float() / 255
+    return sample
+
+def probe_batch_sizes(detection_model, dataset, cfg, device, ladder=BATCH_LADDER, safety=SAFETY_MARGIN, steps=3):
+    """Time forward/loss/backward/step per batch size: [{batch, images_per_sec, peak_memory_gb, fits}]
+    
+    Runs on a copy of the model with real augmented training batches and
+    the model's own detection criterion (target assignment included),
+    under the same AMP setting as training. The ladder stops at the first
+    size that runs out of memory, peaks above safety * memory or exceeds
+    the dataset. On CPU there is no OOM error to catch (the kernel kills
+    the process), so the next size is skipped when a linear fit of the
+    previous peaks predicts it won't fit.
+    """
+    import torch
+    
+    # Checkpoints store FP16 weights; train-mode FP32 copy like the trainer makes
+    model = copy.deepcopy(detection_model).float().to(device).train()
+    for p in model.parameters():
+        p.requires_grad_(True)
+    # The trainer attaches its args (box/cls/dfl gains) before the criterion is built
+    model.args = cfg
+    model.criterion = model.init_criterion()
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.0, momentum=0.9)
+    cuda = device.type == 'cuda'
+    budget = total_memory(device) * safety
+    curve = []
+    
+    for batch in ladder:
+        if batch > len(dataset):
+            print(f"  batch {batch}: skipped, larger than the {len(dataset)}-image training set")
+            break
+        if not cuda and len(curve) >= 2:
+            (b0, m0), (b1, m1) = [(p['batch'], p['peak_memory_gb'] * 1e9) for p in curve[-2:]]
+            predicted = m1 + (m1 - m0) / (b1 - b0) * (batch - b1)
+            if predicted > budget:
+                print(f"  batch {batch}: skipped, predicted {predicted / 1e9:.1f} GB > {budget / 1e9:.1f} GB budget")
+                break
+        sample = real_batch(dataset, batch, device)
+        try:
+            if cuda:
+                torch.cuda.empty_cache()
+                torch.cuda.reset_peak_memory_stats(device)
+            times = []
+            for step in range(steps + 1):  # step 0 warms up kernels/allocator
+                start = time.perf_counter()
+                with torch.autocast('cuda', enabled=cuda):
+                    preds = model(sample['img'])
+                    loss, _ = model.criterion(preds, sample)
+                    loss = loss.sum()
+                loss.backward()
+                optimizer.step()
+                optimizer.zero_grad(set_to_none=True)
+                if cuda:
+                    torch.cuda.synchronize(device)
+                if step:
+                    times.append(time.perf_counter() - start)
+            peak = peak_memory(device)
+        except RuntimeError as e:
+            if not _is_oom(e):
+                raise
+            print(f"  batch {batch}: out of memory")
+            break
+        finally:
+            sample = preds = loss = None
+        point = {
+            'batch': batch,
+            'images_per_sec': round(batch / sorted(times)[len(times) // 2], 1),
+            'peak_memory_gb': round(peak / 1e9, 3),
+            'fits': peak <= budget,
+        }
+        curve.append(point)
+        print(f"  batch {batch}: {point['images_per_sec']:.1f} images/s, peak {point['peak_memory_gb']:.2f} GB"
+              f"{'' if point['fits'] else ' (over budget)'}")
+        if not point['fits']:
+            break
+    
+    del model, optimizer
+    if cuda:
+        torch.cuda.empty_cache()
+    return curve
+
+def probe_workers(dataset, batch, ladder=WORKER_LADDER, batches=20):
+    """Time the real augmented train loader per worker count: [{workers, images_per_sec}]"""
+    from ultralytics.data import build_dataloader
+    
+    curve = []
+    for workers in ladder:
+        if workers > (os.cpu_count() or 1):
+            break
+        loader = build_dataloader(dataset, batch, workers, shuffle=True, rank=-1)
+        timed = min(batches, len(loader) - 1)
+        if timed < 1:
+            print("  dataset too small to time the loader")
+            break
+        iterator = iter(loader)
+        next(iterator)  # worker start-up is a one-off cost
+        start = time.perf_counter()
+        for _ in range(timed):
+            next(iterator)
+        rate = timed * batch / (time.perf_counter() - start)
+        del iterator, loader
+        curve.append({'workers': workers, 'images_per_sec': round(rate, 1)})
+        print(f"  workers {workers}: {rate:.1f} images/s")
+    return curve
+
+def pick(curve, key, tolerance, rate='images_per_sec'):
+    """Cheapest (smallest key) setting within tolerance of the best rate"""
+    usable = [p for p in curve if p.get('fits', True)]
+    if not usable:
+        return None
+    best = max(p[rate] for p in usable)
+    return min(p[key] for p in usable if p[rate] >= best * (1 - tolerance))
+
+def autotune(detection_model, data_yaml, img_size, device, trainer=None, safety=SAFETY_MARGIN):
+    """Probe batch size, then loader workers at that batch size
+    
+    Returns {'batch', 'workers', 'batch_curve', 'worker_curve', 'seconds'}.
+    A value is None when every probe setting failed.
+    """
+    import torch
+    
+    device = torch.device(device if isinstance(device, str) else f"cuda:{device}")
+    start = time.perf_counter()
+    dataset, cfg = build_train_dataset(data_yaml, img_size, max(BATCH_LADDER), trainer)
+    print(f"🔬 Probing batch sizes on {device} (memory budget {safety:.0%})...")
+    batch_curve = probe_batch_sizes(detection_model, dataset, cfg, device, safety=safety)
+    batch = pick(batch_curve, 'batch', BATCH_TOLERANCE)
+    worker_curve, workers = [], None
+    if batch:
+        print(f"🔬 Probing dataloader workers at batch {batch}...")
+        worker_curve = probe_workers(dataset, batch)
+        workers = pick(worker_curve, 'workers', WORKER_TOLERANCE)
+    seconds = time.perf_counter() - start
+    print(f"🎯 Autotune: batch {batch}, workers {workers} ({seconds:.0f}s probe)")
+    return {'batch': batch, 'workers': workers, 'batch_curve': batch_curve,
+            'worker_curve': worker_curve, 'seconds': round(seconds, 1)}
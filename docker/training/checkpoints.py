@@ -0,0 +1,103 @@
+import os
+import sys
+import glob
+import shutil
+import signal
+
+# SageMaker syncs this directory to CheckpointConfig.S3Uri and restores it on restart
+CHECKPOINT_DIR = '/opt/ml/checkpoints'
+# Previous production model (model.tar.gz or weights) for warm starts
+WARM_START_DIR = '/opt/ml/input/data/warmstart'
+# Conventional exit code for a SIGTERM'd process
+SIGTERM_EXIT_CODE = 143
+
+def checkpoint_dir():
+    """Checkpoint directory if this job has one (CheckpointConfig set), else None"""
+    path = os.environ.get('SM_CHECKPOINT_DIR', CHECKPOINT_DIR)
+    return path if os.path.isdir(path) else None
+
+def checkpoint_state(weights):
+    """'resumable' (optimizer and epoch saved), 'finished' (stripped after training) or None"""
+    import torch
+    
+    try:
+        ckpt = torch.load(weights, map_location='cpu', weights_only=False)
+    except Exception as e:
+        print(f"⚠️ Ignoring unreadable checkpoint {weights}: {e}")
+        return None
+    if ckpt.get('optimizer') is not None and ckpt.get('epoch', -1) >= 0:
+        return 'resumable'
+    return 'finished'
+
+def find_resume_checkpoint(run_dir):
+    """(last.pt, state) of a previous attempt of this run, or (None, None)"""
+    last = os.path.join(run_dir, 'weights', 'last.pt')
+    if not os.path.exists(last):
+        return None, None
+    return last, checkpoint_state(last)
+
+def find_warm_start_weights(path=None):
+    """best.pt from a previous model's artifacts (a .pt file, a dir or a model.tar.gz), or None"""
+    from dataset_utils import extract_archive
+    
+    path = path or os.environ.get('SM_CHANNEL_WARMSTART', WARM_START_DIR)
+    if not path or not os.path.exists(path):
+        return None
+    if os.path.isfile(path) and path.endswith('.pt'):
+        return path
+    archives = [path] if os.path.isfile(path) else glob.glob(os.path.join(path, '*.tar.gz'))
+    extract_dir = os.path.join('/tmp', 'warmstart')
+    for archive in archives:
+        extract_archive(archive, extract_dir)
+    search_dirs = [extract_dir] if archives else [path]
+    for search_dir in search_dirs:
+        candidates = sorted(glob.glob(os.path.join(search_dir, '**', 'best.pt'), recursive=True))
+        if candidates:
+            return candidates[0]
+    return None
+
+def copy_run(run_dir, model_dir):
+    """Copy a run directory from the checkpoint dir into the model dir for upload"""
+    target = os.path.join(model_dir, os.path.basename(run_dir))
+    shutil.copytree(run_dir, target, dirs_exist_ok=True)
+    return target
+
+class PreemptionHandler:
+    """Saves last.pt mid-epoch when SageMaker sends SIGTERM, then exits
+    
+    Spot reclaims, StopTrainingJob and MaxRuntimeInSeconds all send
+    SIGTERM and allow about two minutes before a hard kill. The signal
+    handler only sets a flag. The checkpoint is written from the next
+    on_train_batch_end callback, so the model is never saved halfway
+    through an optimizer step. The saved epoch is the previous one, so
+    resuming replays the interrupted epoch on top of the newer weights.
+    Only rank 0 saves; the other DDP ranks just exit.
+    """
+    
+    def __init__(self, main_process=True):
+        self.main_process = main_process
+        self.requested = False
+        signal.signal(signal.SIGTERM, self._on_signal)
+    
+    def _on_signal(self, signum, frame):
+        print("🛑 SIGTERM received, checkpointing after the current batch...", flush=True)
+        self.requested = True
+    
+    def register(self, model):
+        model.add_callback('on_train_batch_end', self.on_train_batch_end)
+    
+    def on_train_batch_end(self, trainer):
+        if not self.requested:
+            return
+        if self.main_process and trainer.epoch > 0:
+            epoch, fitness = trainer.epoch, trainer.fitness
+            # Epoch N-1 so resume restarts epoch N; no fitness so best.pt is left alone
+            trainer.epoch, trainer.fitness = epoch - 1, None
+            try:
+                trainer.save_model()
+                print(f"💾 Preemption checkpoint saved: {trainer.last} (resumes at epoch {epoch + 1})", flush=True)
+            finally:
+                trainer.epoch, trainer.fitness = epoch, fitness
+        elif self.main_process:
+            print("🛑 Interrupted during the first epoch; nothing worth checkpointing yet", flush=True)
+        sys.exit(SIGTERM_EXIT_CODE)
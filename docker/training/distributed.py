@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import argparse
+import subprocess
+
+MASTER_PORT = 29500
+# Intra-op threads per worker when workers-per-host is auto
+THREADS_PER_WORKER = 4
+
+def read_resource_config(config_dir=None):
+    """(sorted hosts, current host) from SageMaker's resourceconfig.json
+    
+    Outside SageMaker this is a single-host job on this machine.
+    """
+    config_dir = config_dir or os.environ.get('SM_INPUT_CONFIG_DIR', '/opt/ml/input/config')
+    path = os.path.join(config_dir, 'resourceconfig.json')
+    if not os.path.exists(path):
+        return ['localhost'], 'localhost'
+    with open(path, 'r') as f:
+        config = json.load(f)
+    return sorted(config['hosts']), config['current_host']
+
+def default_workers_per_host():
+    return max(1, (os.cpu_count() or 1) // THREADS_PER_WORKER)
+
+def worker_env(rank, local_rank, world_size, local_world_size, master_addr, master_port, threads):
+    env = dict(os.environ)
+    env.update({
+        'RANK': str(rank),
+        'LOCAL_RANK': str(local_rank),
+        'WORLD_SIZE': str(world_size),
+        'LOCAL_WORLD_SIZE': str(local_world_size),
+        'MASTER_ADDR': master_addr,
+        'MASTER_PORT': str(master_port),
+        # Split the cores between workers instead of every worker using all of them
+        'OMP_NUM_THREADS': str(threads),
+        'MKL_NUM_THREADS': str(threads),
+    })
+    return env
+
+def launch_workers(command, workers_per_host=0, config_dir=None, master_port=MASTER_PORT):
+    """Run command once per local rank with torch.distributed env vars set
+    
+    Every host in the job runs this with the same host list, so global
+    ranks are node_rank * workers_per_host + local_rank and rank 0 (on the
+    first host) is the rendezvous point. If any worker fails the others
+    are stopped. Returns the first non-zero exit code, or 0.
+    """
+    hosts, current_host = read_resource_config(config_dir)
+    workers_per_host = workers_per_host or default_workers_per_host()
+    node_rank = hosts.index(current_host)
+    world_size = len(hosts) * workers_per_host
+    threads = max(1, (os.cpu_count() or 1) // workers_per_host)
+    master_addr = '127.0.0.1' if len(hosts) == 1 else hosts[0]
+    
+    print(f"🌐 CPU DDP (gloo): host {node_rank + 1}/{len(hosts)} ({current_host}), "
+          f"{workers_per_host} workers x {threads} threads, world size {world_size}, master {master_addr}:{master_port}")
+    processes = []
+    for local_rank in range(workers_per_host):
+        rank = node_rank * workers_per_host + local_rank
+        env = worker_env(rank, local_rank, world_size, workers_per_host, master_addr, master_port, threads)
+        processes.append(subprocess.Popen(command, env=env))
+    
+    # SageMaker signals only this process; workers checkpoint on their own SIGTERM
+    def forward(signum, frame):
+        for process in processes:
+            process.send_signal(signum)
+    signal.signal(signal.SIGTERM, forward)
+    
+    exit_code = 0
+    while processes:
+        for process in list(processes):
+            code = process.poll()
+            if code is None:
+                continue
+            processes.remove(process)
+            if code != 0 and not exit_code:
+                exit_code = code
+                print(f"❌ Worker {process.pid} exited with {code}, stopping the other workers")
+                for other in processes:
+                    other.terminate()
+        time.sleep(0.5)
+    return exit_code
+
+def is_main_process():
+    """True outside DDP and on global rank 0"""
+    return int(os.environ.get('RANK', -1)) in (-1, 0)
+
+class CpuDistributedMixin:
+    """DetectionTrainer mixin for DDP over gloo on CPU-only workers
+    
+    Ultralytics only goes distributed for multiple CUDA devices, and then
+    launches its own NCCL workers. Here the workers come from
+    launch_workers, so train() skips that launch. The process group is
+    gloo, and the model is wrapped in DDP without device_ids. Ultralytics
+    shards batches with a DistributedSampler on the global rank, and only
+    rank 0 validates, saves checkpoints and runs integration callbacks.
+    """
+    
+    def train(self):
+        self._do_train(int(os.environ.get('WORLD_SIZE', 1)))
+    
+    def _setup_ddp(self, world_size):
+        from datetime import timedelta
+        
+        import torch
+        import torch.distributed as dist
+        
+        # Ultralytics' rank-zero-first barriers pass device_ids, which only NCCL accepts
+        barrier = dist.barrier
+        
+        def gloo_barrier(*args, device_ids=None, **kwargs):
+            return barrier(*args, **kwargs)
+        
+        dist.barrier = gloo_barrier
+        dist.init_process_group('gloo', timeout=timedelta(hours=3),
+                                rank=int(os.environ['RANK']), world_size=world_size)
+        self.device = torch.device('cpu')
+    
+    def _setup_train(self, world_size):
+        import torch.nn.parallel as parallel
+        
+        ddp = parallel.DistributedDataParallel
+        
+        class CpuDistributedDataParallel(ddp):
+            def __init__(self, module, device_ids=None, **kwargs):
+                super().__init__(module, device_ids=None, **kwargs)
+        
+        # DDP on CPU modules must not get device_ids=[RANK]; swap the class only while wrapping
+        parallel.DistributedDataParallel = CpuDistributedDataParallel
+        try:
+            super()._setup_train(world_size)
+        finally:
+            parallel.DistributedDataParallel = ddp
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+# Synthetic images for the self-test's one-epoch training run
+SELF_TEST_IMAGES = 24
+SELF_TEST_HYPERPARAMETERS = {
+    'epochs': 1,
+    'batch-size': 4,
+    'img-size': 64,
+    'distributed': 'cpu',
+    'export-formats': 'none',
+    'image-cache': 'off',
+    'warm-start': 'off',
+    'autotune': 'off',
+    'profile-interval': 1,
+}
+WRITE_EVENTS = ('open', 'os.mkdir', 'os.rename', 'shutil.copyfile')
+
+def _record_writes(root):
+    """Set of paths under root this process creates or opens for writing (audit hook)"""
+    root = os.path.abspath(root) + os.sep
+    write_flags = os.O_WRONLY | os.O_RDWR | os.O_CREAT | os.O_APPEND
+    written = set()
+    
+    def hook(event, args):
+        if event not in WRITE_EVENTS:
+            return
+        if event == 'open':
+            path, mode, flags = args
+            if not (any(c in mode for c in 'wax+') if isinstance(mode, str) else flags & write_flags):
+                return
+        elif event == 'os.mkdir':
+            path = args[0]
+        else:
+            path = args[1]  # rename/replace and copyfile destination
+        if isinstance(path, int):
+            return
+        path = os.path.abspath(os.fsdecode(path))
+        # os.makedirs(exist_ok=True) still calls mkdir on directories that exist
+        if event == 'os.mkdir' and os.path.isdir(path):
+            return
+        if path.startswith(root):
+            written.add(path)
+    
+    sys.addaudithook(hook)
+    return written
+
+def _record_train_shards(shards):
+    """Append {epoch, indices, dataset_size} for every pass of a DistributedSampler over a training set"""
+    from torch.utils.data.distributed import DistributedSampler
+    
+    iterate = DistributedSampler.__iter__
+    
+    def recording_iter(self):
+        indices = list(iterate(self))
+        if getattr(self.dataset, 'augment', False):  # validation sets don't augment
+            shards.append({'epoch': self.epoch, 'indices': indices, 'dataset_size': len(self.dataset)})
+        return iter(indices)
+    
+    DistributedSampler.__iter__ = recording_iter
+
+def _self_test_worker(report_dir, train_script):
+    """One rank of the self-test: run train.py, then report its shards and writes"""
+    import runpy
+    
+    rank = int(os.environ['RANK'])
+    written = _record_writes(os.path.dirname(report_dir))
+    shards = []
+    _record_train_shards(shards)
+    
+    sys.path.insert(0, os.path.dirname(train_script))  # as when train.py runs as a script
+    sys.argv = [train_script]
+    exit_code = 0
+    try:
+        runpy.run_path(train_script, run_name='__main__')
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else int(e.code is not None)
+    finally:
+        report = {'rank': rank, 'exit_code': exit_code, 'shards': shards, 'written': sorted(written)}
+        with open(os.path.join(report_dir, f"rank{rank}.json"), 'w') as f:
+            json.dump(report, f)
+    sys.exit(exit_code)
+
+def _check_shards(reports, failures):
+    """First training pass per rank must split the dataset with no overlap beyond sampler padding"""
+    passes = {}
+    for report in reports:
+        first = [s for s in report['shards'] if s['epoch'] == 0][:1]
+        if not first:
+            failures.append(f"rank {report['rank']} never iterated a training sampler")
+            continue
+        passes[report['rank']] = first[0]
+    if failures:
+        return
+    
+    size = passes[0]['dataset_size']
+    world_size = len(passes)
+    # DistributedSampler pads the tail with repeats so every rank gets the same count
+    padding = -size % world_size
+    seen = [set(p['indices']) for p in passes.values()]
+    overlap = sum(len(seen[i] & seen[j]) for i in range(world_size) for j in range(i + 1, world_size))
+    if set().union(*seen) != set(range(size)):
+        failures.append(f"shards cover {len(set().union(*seen))} of {size} training images")
+    if overlap > padding:
+        failures.append(f"shards overlap on {overlap} images (sampler padding allows {padding})")
+    counts = [len(p['indices']) for p in passes.values()]
+    if len(set(counts)) != 1:
+        failures.append(f"uneven shards {counts}")
+    if not failures:
+        print(f"✅ {world_size} ranks: disjoint shards of {counts} from {size} training images")
+
+def _check_artifacts(reports, artifact_dirs, failures):
+    """Only rank 0 may write weights, checkpoints or MLflow runs"""
+    def under(paths, directory):
+        return [p for p in paths if p.startswith(directory + os.sep)]
+    
+    for report in reports:
+        if report['rank'] == 0:
+            continue
+        for name, directory in artifact_dirs.items():
+            stray = under(report['written'], directory)
+            if stray:
+                failures.append(f"rank {report['rank']} wrote {len(stray)} files to {name}, e.g. {stray[0]}")
+    
+    main_writes = next(r['written'] for r in reports if r['rank'] == 0)
+    if not [p for p in under(main_writes, artifact_dirs['checkpoints']) if p.endswith('.pt')]:
+        failures.append("rank 0 saved no .pt checkpoint")
+    if not under(main_writes, artifact_dirs['model']):
+        failures.append("rank 0 wrote nothing to the model dir")
+    if not under(main_writes, artifact_dirs['mlflow']):
+        failures.append("rank 0 logged no MLflow run")
+    if not failures:
+        print(f"✅ Only rank 0 wrote artifacts ({len(main_writes)} paths under model, checkpoint and MLflow dirs)")
+
+def self_test(workers=2):
+    """Train one epoch of train.py with CpuDistributedMixin across gloo ranks on a synthetic dataset
+    
+    Checks that the ranks train on non-overlapping shards and that only
+    rank 0 writes checkpoints, the model dir and the MLflow run. Needs
+    the training image's libraries and yolov8n.pt (weights registry or
+    download).
+    """
+    import shutil
+    import tempfile
+    
+    here = os.path.dirname(os.path.abspath(__file__))
+    for path in (here, os.path.join(here, '..', '..', 'src', 'data')):
+        sys.path.append(path)
+    from synthetic_generator import generate_dataset
+    
+    root = os.path.realpath(tempfile.mkdtemp(prefix='ddp-self-test-'))
+    dirs = {name: os.path.join(root, name) for name in ('data', 'config', 'model', 'checkpoints', 'mlflow', 'reports')}
+    for directory in dirs.values():
+        os.makedirs(directory)
+    generate_dataset(dirs['data'], SELF_TEST_IMAGES, img_size=SELF_TEST_HYPERPARAMETERS['img-size'], workers=1)
+    with open(os.path.join(dirs['config'], 'hyperparameters.json'), 'w') as f:
+        json.dump(SELF_TEST_HYPERPARAMETERS, f)
+    
+    os.environ.update({
+        'SM_CHANNEL_TRAINING': dirs['data'],
+        'SM_MODEL_DIR': dirs['model'],
+        'SM_CHECKPOINT_DIR': dirs['checkpoints'],
+        'SM_INPUT_CONFIG_DIR': dirs['config'],
+        'SM_CHANNEL_TUNED': os.path.join(root, 'no-tuned-config'),
+        'MLFLOW_TRACKING_URI': f"file:{dirs['mlflow']}",
+    })
+    command = [sys.executable, os.path.abspath(__file__), '--self-test-worker',
+               dirs['reports'], os.path.join(here, 'train.py')]
+    exit_code = launch_workers(command, workers, config_dir=dirs['config'], master_port=_free_port())
+    
+    failures = []
+    reports = []
+    for rank in range(workers):
+        path = os.path.join(dirs['reports'], f"rank{rank}.json")
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                reports.append(json.load(f))
+        else:
+            failures.append(f"rank {rank} wrote no report")
+    if exit_code:
+        failures.append(f"workers exited with {exit_code}")
+    if not failures:
+        _check_shards(reports, failures)
+    if not failures:
+        _check_artifacts(reports, {k: dirs[k] for k in ('model', 'checkpoints', 'mlflow')}, failures)
+    
+    if failures:
+        for failure in failures:
+            print(f"❌ {failure}")
+        print(f"❌ Self-test failed; files kept in {root}")
+        return 1
+    shutil.rmtree(root, ignore_errors=True)
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU DDP (gloo) launcher helpers")
+    parser.add_argument('--self-test', action='store_true',
+                        help='Train one synthetic epoch across local gloo ranks and check sharding and rank-0 artifacts')
+    parser.add_argument('--self-test-worker', nargs=2, metavar=('REPORT_DIR', 'TRAIN_SCRIPT'), help=argparse.SUPPRESS)
+    parser.add_argument('--workers', type=int, default=2)
+    args = parser.parse_args()
+    
+    if args.self_test_worker:
+        _self_test_worker(*args.self_test_worker)
+    elif args.self_test:
+        sys.exit(self_test(args.workers))
+    else:
+        parser.print_help()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+
+import numpy as np
+
+# Shared helpers live in src/data and src/inference in the repo and next to this script in the image
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src', 'data'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src', 'inference'))
+
+EXPORT_REPORT = 'export_report.json'
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+def calibration_loaders(data_yaml, limit):
+    """Zero-argument loaders returning BGR validation images
+    
+    Works for both image-directory datasets and packed shard datasets.
+    """
+    import cv2
+    import yaml
+    
+    with open(data_yaml, 'r') as f:
+        data = yaml.safe_load(f)
+    val = data.get('val', '')
+    if val.endswith('.json'):
+        from dataset_utils import PackedDataset
+        
+        packed = PackedDataset(os.path.join(os.path.dirname(os.path.abspath(data_yaml)), val))
+        return [lambda i=i: packed.decode(i) for i in range(min(limit, len(packed)))]
+    return [lambda p=p: cv2.imread(p) for p in resolve_val_images(data_yaml)[:limit]]
+
+def resolve_val_images(data_yaml):
+    """Validation image paths from a YOLO data.yaml"""
+    import yaml
+    
+    with open(data_yaml, 'r') as f:
+        data = yaml.safe_load(f)
+    base_dir = data.get('path') or os.path.dirname(os.path.abspath(data_yaml))
+    if not os.path.isabs(base_dir):
+        base_dir = os.path.join(os.path.dirname(os.path.abspath(data_yaml)), base_dir)
+    val_dir = data.get('val', 'valid/images')
+    if not os.path.isabs(val_dir):
+        val_dir = os.path.join(base_dir, val_dir)
+    return sorted(
+        path for path in glob.glob(os.path.join(val_dir, '*'))
+        if path.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+class ValidationCalibrationReader:
+    """Feeds validation images to ONNX Runtime static quantization"""
+    
+    def __init__(self, onnx_path, image_loaders, img_size):
+        import onnxruntime as ort
+        
+        session = ort.InferenceSession(onnx_path, providers=['CPUExecutionProvider'])
+        self.input_name = session.get_inputs()[0].name
+        self.image_loaders = list(image_loaders)
+        self.img_size = img_size
+        self._iter = iter(self.image_loaders)
+    
+    def get_next(self):
+        from onnx_backend import preprocess
+        
+        loader = next(self._iter, None)
+        if loader is None:
+            return None
+        # The serving preprocessing itself, so INT8 ranges are calibrated on what the endpoint feeds
+        batch, _ = preprocess([loader()], self.img_size)
+        return {self.input_name: batch}
+    
+    def rewind(self):
+        self._iter = iter(self.image_loaders)
+
+def quantize_onnx(onnx_path, mode, image_loaders, img_size):
+    """Write an INT8 copy of an ONNX model next to it"""
+    from onnxruntime.quantization import (
+        CalibrationMethod, QuantFormat, QuantType, quantize_dynamic, quantize_static
+    )
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+    
+    output_path = onnx_path.replace('.onnx', '.int8.onnx')
+    prepared_path = onnx_path.replace('.onnx', '.prep.onnx')
+    try:
+        quant_pre_process(onnx_path, prepared_path)
+        source_path = prepared_path
+    except Exception as e:
+        print(f"⚠️ Quantization pre-processing skipped: {e}")
+        source_path = onnx_path
+    
+    if mode == 'static':
+        if not image_loaders:
+            raise ValueError("Static quantization needs validation images for calibration")
+        reader = ValidationCalibrationReader(source_path, image_loaders, img_size)
+        quantize_static(
+            source_path, output_path, reader,
+            quant_format=QuantFormat.QDQ,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            per_channel=True,
+            calibrate_method=CalibrationMethod.MinMax
+        )
+    elif mode == 'dynamic':
+        quantize_dynamic(source_path, output_path, weight_type=QuantType.QUInt8)
+    else:
+        raise ValueError(f"Unknown quantization mode: {mode}")
+    
+    if os.path.exists(prepared_path):
+        os.remove(prepared_path)
+    return output_path
+
+def validate(weights, data_yaml, img_size, validator=None):
+    """mAP of a .pt/.onnx/.torchscript artifact on the validation split"""
+    from ultralytics import YOLO
+    
+    model = YOLO(weights, task='detect')
+    start = time.perf_counter()
+    metrics = model.val(validator=validator, data=data_yaml, imgsz=img_size, batch=1,
+                        device='cpu', plots=False, verbose=False)
+    elapsed = time.perf_counter() - start
+    return {
+        'mAP50': float(metrics.box.map50),
+        'mAP50-95': float(metrics.box.map),
+        'val_seconds': round(elapsed, 2),
+    }
+
+def export_model(weights, data_yaml, img_size, formats=('onnx',), quantize='static',
+                 max_map_drop=0.02, calibration_size=200, validator=None):
+    """Export trained weights and check each artifact's accuracy delta
+    
+    Artifacts whose mAP50-95 drops more than max_map_drop below the .pt
+    model are deleted so they can never be deployed.
+    """
+    from ultralytics import YOLO
+    
+    report = {'weights': weights, 'img_size': img_size, 'artifacts': {}}
+    print(f"📏 Validating reference model: {weights}")
+    baseline = validate(weights, data_yaml, img_size, validator)
+    report['baseline'] = baseline
+    print(f"📊 Reference mAP50-95: {baseline['mAP50-95']:.4f}")
+    
+    artifacts = []
+    for fmt in formats:
+        print(f"📦 Exporting {fmt}...")
+        kwargs = {'format': fmt, 'imgsz': img_size}
+        if fmt == 'onnx':
+            kwargs.update({'dynamic': True, 'simplify': True})
+        path = YOLO(weights).export(**kwargs)
+        artifacts.append((fmt, str(path)))
+    
+    onnx_paths = [path for fmt, path in artifacts if fmt == 'onnx']
+    if quantize and quantize != 'none' and onnx_paths:
+        loaders = calibration_loaders(data_yaml, calibration_size)
+        print(f"🧮 Quantizing to INT8 ({quantize}, {len(loaders)} calibration images)...")
+        artifacts.append((f"onnx-int8-{quantize}",
+                          quantize_onnx(onnx_paths[0], quantize, loaders, img_size)))
+    
+    for name, path in artifacts:
+        metrics = validate(path, data_yaml, img_size, validator)
+        delta = metrics['mAP50-95'] - baseline['mAP50-95']
+        accepted = delta >= -max_map_drop
+        metrics.update({
+            'path': os.path.basename(path),
+            'size_mb': round(os.path.getsize(path) / 1e6, 2) if os.path.isfile(path) else None,
+            'mAP50-95_delta': round(delta, 4),
+            'accepted': accepted,
+        })
+        report['artifacts'][name] = metrics
+        status = "✅" if accepted else "❌"
+        print(f"{status} {name}: mAP50-95 {metrics['mAP50-95']:.4f} (delta {delta:+.4f})")
+        if not accepted and os.path.isfile(path):
+            print(f"🗑️ Removing {os.path.basename(path)}: accuracy drop exceeds {max_map_drop}")
+            os.remove(path)
+    
+    report_path = os.path.join(os.path.dirname(weights), EXPORT_REPORT)
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"📄 Export report written: {report_path}")
+    return report, report_path
+
+def packed_validator(data_yaml):
+    """PackedDetectionValidator for packed datasets, else None"""
+    import yaml
+    
+    with open(data_yaml, 'r') as f:
+        data = yaml.safe_load(f) or {}
+    if not str(data.get('val', '')).endswith('.json'):
+        return None
+    from packed_dataset import PackedDetectionValidator
+    return PackedDetectionValidator
+
+def main():
+    parser = argparse.ArgumentParser(description="Export trained weights, or just validate them")
+    parser.add_argument('--weights', required=True)
+    parser.add_argument('--data', required=True, help='data.yaml (image directories or packed)')
+    parser.add_argument('--img-size', type=int, default=640)
+    parser.add_argument('--formats', default='onnx')
+    parser.add_argument('--quantize', default='static')
+    parser.add_argument('--max-map-drop', type=float, default=0.02)
+    parser.add_argument('--validate-only', action='store_true',
+                        help='Write validation metrics to --output instead of exporting')
+    parser.add_argument('--output', default=None, help='Metrics JSON path for --validate-only')
+    args = parser.parse_args()
+    
+    validator = packed_validator(args.data)
+    if args.validate_only:
+        metrics = validate(args.weights, args.data, args.img_size, validator)
+        print(f"📊 mAP50 {metrics['mAP50']:.4f}, mAP50-95 {metrics['mAP50-95']:.4f}")
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(metrics, f, indent=2)
+        return
+    
+    formats = [f.strip() for f in args.formats.split(',') if f.strip()]
+    export_model(args.weights, args.data, args.img_size, formats=formats, quantize=args.quantize,
+                 max_map_drop=args.max_map_drop, validator=validator)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+CACHE_FORMAT_VERSION = 1
+# SageMaker warm pools keep this directory between jobs
+WARM_POOL_CACHE_DIR = '/opt/ml/sagemaker/warmpoolcache'
+
+# Per-image columns in index.npy
+INDEX_COLUMNS = ('cached', 'h0', 'w0', 'h', 'w')
+
+def default_cache_dir():
+    if os.path.isdir(WARM_POOL_CACHE_DIR):
+        return os.path.join(WARM_POOL_CACHE_DIR, 'image-cache')
+    return os.path.join('/tmp', 'hail-image-cache')
+
+def dataset_fingerprint(entries):
+    """Hash of (name, byte size) pairs identifying a dataset split"""
+    digest = hashlib.sha256()
+    for name, size in entries:
+        digest.update(f"{os.path.basename(name)}:{size}\n".encode())
+    return digest.hexdigest()[:20]
+
+def resize_long_side(image, img_size):
+    """Resize so the long side is img_size (BaseDataset rect_mode behaviour)"""
+    import math
+    import cv2
+    
+    h0, w0 = image.shape[:2]
+    r = img_size / max(h0, w0)
+    if r != 1:
+        w, h = (min(math.ceil(w0 * r), img_size), min(math.ceil(h0 * r), img_size))
+        image = cv2.resize(image, (w, h), interpolation=cv2.INTER_LINEAR)
+    return image, (h0, w0)
+
+def _directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+def evict_lru(cache_root, bytes_needed, disk_budget, keep=None):
+    """Delete least-recently-used cache entries until bytes_needed fits"""
+    if not os.path.isdir(cache_root):
+        return []
+    entries = []
+    for key in os.listdir(cache_root):
+        path = os.path.join(cache_root, key)
+        if key == keep or not os.path.isdir(path):
+            continue
+        try:
+            with open(os.path.join(path, 'meta.json'), 'r') as f:
+                last_used = json.load(f).get('last_used', 0)
+        except (OSError, ValueError):
+            last_used = 0
+        entries.append((last_used, path, _directory_size(path)))
+    
+    used = sum(size for _, _, size in entries)
+    evicted = []
+    for _, path, size in sorted(entries):
+        if used + bytes_needed <= disk_budget:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        used -= size
+        evicted.append(os.path.basename(path))
+    return evicted
+
+class LetterboxCache:
+    """Pre-decoded uint8 image cache stored as one memory-mapped array
+    
+    Every image is resized so its long side is img_size and written into
+    the top-left corner of a fixed img_size x img_size x 3 slot. The
+    sidecar index records original and resized shapes, so a read is just
+    a slice copy.
+    
+    When the split doesn't fit the disk budget, a fixed prefix of the
+    dataset is cached and the rest is decoded on demand. Epochs visit
+    images in a new random order each time, so LRU replacement inside an
+    epoch would only thrash. Whole cache entries for other datasets and
+    image sizes are evicted least-recently-used first to make room.
+    """
+    
+    def __init__(self, path, key, img_size, count, capacity, ram_budget):
+        self.path = path
+        self.key = key
+        self.img_size = img_size
+        self.count = count
+        self.capacity = capacity
+        self.slot_shape = (img_size, img_size, 3)
+        self.index_path = os.path.join(path, 'index.npy')
+        self.images_path = os.path.join(path, 'images.u8')
+        self.meta_path = os.path.join(path, 'meta.json')
+        self.ram_budget = ram_budget
+        self.index = np.zeros((count, len(INDEX_COLUMNS)), dtype=np.int32)
+        self.images = None
+        self.in_ram = False
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(path, exist_ok=True)
+    
+    @classmethod
+    def open(cls, cache_root, fingerprint, img_size, count, disk_budget_gb=50.0, ram_budget_gb=0.0):
+        """Open (or create) the cache entry for a dataset split and image size"""
+        key = f"{fingerprint}-{img_size}-v{CACHE_FORMAT_VERSION}"
+        slot_bytes = img_size * img_size * 3
+        disk_budget = int(disk_budget_gb * 1e9)
+        path = os.path.join(cache_root, key)
+        os.makedirs(cache_root, exist_ok=True)
+        
+        if os.path.exists(os.path.join(path, 'meta.json')):
+            with open(os.path.join(path, 'meta.json'), 'r') as f:
+                capacity = json.load(f)['capacity']
+        else:
+            capacity = min(count, disk_budget // slot_bytes)
+            evicted = evict_lru(cache_root, capacity * slot_bytes, disk_budget, keep=key)
+            if evicted:
+                print(f"🧹 Evicted {len(evicted)} stale image cache(s): {', '.join(evicted)}")
+        return cls(path, key, img_size, count, capacity, int(ram_budget_gb * 1e9))
+    
+    @property
+    def nbytes(self):
+        return self.capacity * int(np.prod(self.slot_shape))
+    
+    def build(self, load_original, workers=8):
+        """Decode and resize every uncached image once, in parallel"""
+        import fcntl
+        
+        # Several ranks/jobs may share a cache directory; one builds, the rest wait
+        with open(os.path.join(self.path, 'build.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                # meta.json is written last, so without it any leftover files are partial
+                existing = os.path.exists(self.meta_path) and os.path.exists(self.index_path)
+                if existing:
+                    self.index = np.load(self.index_path)
+                self.images = np.memmap(self.images_path, dtype=np.uint8, mode='r+' if existing else 'w+',
+                                        shape=(max(self.capacity, 1),) + self.slot_shape)
+                self._fill_missing(load_original, workers)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        
+        if self.ram_budget and self.nbytes <= self.ram_budget:
+            # Fits the RAM budget: read it all once instead of paging per access
+            self.images = np.array(self.images)
+            self.in_ram = True
+        return self
+    
+    def _fill_missing(self, load_original, workers):
+        missing = np.flatnonzero(self.index[:self.capacity, 0] == 0)
+        if len(missing):
+            print(f"🧊 Building image cache {self.key}: {len(missing)} images "
+                  f"({self.capacity}/{self.count} fit, {self.nbytes / 1e9:.2f} GB)")
+            start = time.perf_counter()
+            
+            def fill(i):
+                image, (h0, w0) = resize_long_side(load_original(i), self.img_size)
+                h, w = image.shape[:2]
+                self.images[i, :h, :w] = image
+                self.index[i] = (1, h0, w0, h, w)
+            
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(fill, missing))
+            self.images.flush()
+            np.save(self.index_path, self.index)
+            elapsed = time.perf_counter() - start
+            print(f"✅ Image cache built in {elapsed:.1f}s ({len(missing) / max(elapsed, 1e-9):.0f} images/sec)")
+        else:
+            print(f"♻️ Reusing image cache {self.key} ({self.capacity}/{self.count} images)")
+        self.touch()
+    
+    def touch(self):
+        meta = {
+            'key': self.key,
+            'img_size': self.img_size,
+            'count': self.count,
+            'capacity': self.capacity,
+            'bytes': self.nbytes,
+            'last_used': time.time(),
+        }
+        with open(self.meta_path, 'w') as f:
+            json.dump(meta, f)
+    
+    def get(self, i):
+        """(image, (h0, w0), (h, w)) for a cached image, or None"""
+        if i >= self.capacity or not self.index[i, 0]:
+            self.misses += 1
+            return None
+        self.hits += 1
+        _, h0, w0, h, w = (int(v) for v in self.index[i])
+        # Copy: augmentations modify images in place
+        return np.array(self.images[i, :h, :w]), (h0, w0), (h, w)
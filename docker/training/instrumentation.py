@@ -0,0 +1,299 @@
+import os
+import json
+import time
+import queue
+import threading
+
+# MLflow's log_batch accepts at most 1000 metrics per call
+MAX_BATCH = 1000
+
+class AsyncMetricLogger:
+    """Queues metrics and sends them to MLflow in batches from a background thread
+    
+    log_metrics() never blocks the training loop: points go onto a bounded
+    queue and a daemon thread flushes them with one log_batch call every
+    flush_interval seconds (or sooner if MAX_BATCH points pile up). If the
+    tracking server stalls long enough to fill the queue, new points are
+    dropped and counted instead of slowing training down.
+    """
+    
+    def __init__(self, run_id, flush_interval=5.0, max_queue=20000):
+        from mlflow.tracking import MlflowClient
+        
+        self.client = MlflowClient()
+        self.run_id = run_id
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.sent = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='mlflow-logger', daemon=True)
+        self._thread.start()
+    
+    def log_metrics(self, metrics, step):
+        timestamp = int(time.time() * 1000)
+        for key, value in metrics.items():
+            if value is None:
+                continue
+            try:
+                self.queue.put_nowait((key, float(value), timestamp, step))
+            except queue.Full:
+                self.dropped += 1
+    
+    def _drain(self, limit):
+        points = []
+        while len(points) < limit:
+            try:
+                points.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return points
+    
+    def _send(self, points):
+        from mlflow.entities import Metric
+        
+        try:
+            self.client.log_batch(self.run_id, metrics=[Metric(*point) for point in points])
+            self.sent += len(points)
+        except Exception as e:
+            print(f"⚠️ MLflow batch logging warning ({len(points)} points lost): {e}")
+    
+    def _run(self):
+        while not self._stop.is_set():
+            self._stop.wait(self.flush_interval)
+            points = self._drain(MAX_BATCH)
+            while points:
+                self._send(points)
+                points = self._drain(MAX_BATCH)
+    
+    def close(self, timeout=30):
+        """Flush what's queued and stop the thread (bounded by timeout)"""
+        self._stop.set()
+        self._thread.join(timeout)
+        if self.dropped:
+            print(f"⚠️ {self.dropped} metric points dropped while the tracking server lagged")
+
+class ResourceSampler:
+    """Samples GPU utilization and host memory once a second in the background
+    
+    CPU utilization needs no sampling: psutil.cpu_percent() averages
+    since its previous call, so reading it at epoch end covers the epoch.
+    GPU utilization is instantaneous (through NVML), so it is averaged
+    over samples. It is None on CPU hosts or without pynvml.
+    """
+    
+    def __init__(self, interval=1.0):
+        import psutil
+        import torch
+        
+        self.psutil = psutil
+        self.process = psutil.Process()
+        self.interval = interval
+        self.gpu = torch.cuda.is_available() and self._gpu_utilization() is not None
+        self.lock = threading.Lock()
+        self._clear()
+        psutil.cpu_percent()  # start the first averaging window
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='resource-sampler', daemon=True)
+        self._thread.start()
+    
+    @staticmethod
+    def _gpu_utilization():
+        import torch
+        
+        try:
+            return torch.cuda.utilization()
+        except Exception:
+            return None
+    
+    def _clear(self):
+        self.gpu_samples = []
+        self.peak_host_memory = 0
+        self.peak_rss = 0
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            utilization = self._gpu_utilization() if self.gpu else None
+            used = self.psutil.virtual_memory().used
+            rss = self.process.memory_info().rss
+            with self.lock:
+                if utilization is not None:
+                    self.gpu_samples.append(utilization)
+                self.peak_host_memory = max(self.peak_host_memory, used)
+                self.peak_rss = max(self.peak_rss, rss)
+    
+    def read(self):
+        """Averages and peaks since the last read"""
+        with self.lock:
+            samples = self.gpu_samples
+            stats = {
+                'cpu_util_pct': self.psutil.cpu_percent(),
+                'gpu_util_pct': sum(samples) / len(samples) if samples else None,
+                'host_mem_gb': self.peak_host_memory / 1e9,
+                'process_rss_gb': self.peak_rss / 1e9,
+            }
+            self._clear()
+        return stats
+    
+    def close(self):
+        self._stop.set()
+        self._thread.join(self.interval * 2)
+
+class TrainingProfiler:
+    """Ultralytics callbacks that time where each epoch's wall clock goes
+    
+    Ultralytics' loop fetches a batch, fires on_train_batch_start, runs
+    forward/backward/optimizer and fires on_train_batch_end. So the gap
+    from one batch end to the next batch start is time spent waiting on
+    the dataloader (decode + augmentation), and start to end is the step.
+    The progress bar reads the loss every step, which synchronizes CUDA,
+    so GPU time is not shifted into the wait. Validation and checkpoint
+    writes are timed by wrapping trainer.validate and trainer.save_model,
+    and images are counted from the batches trainer.preprocess_batch sees.
+    
+    Every step_interval steps a per-step point goes out, and every epoch
+    an epoch summary. Both go through AsyncMetricLogger. close() writes
+    profile.json with the per-epoch breakdown and the dominant cost.
+    Attach to rank 0 only.
+    """
+    
+    def __init__(self, run_id, step_interval=50):
+        self.logger = AsyncMetricLogger(run_id)
+        self.sampler = ResourceSampler()
+        self.step_interval = step_interval
+        self.world_size = int(os.environ.get('WORLD_SIZE', 1))
+        self.epochs = []
+        self.started = time.perf_counter()
+        self._epoch = None
+        self._last = None
+        self._batch_images = 0
+    
+    def register(self, model):
+        model.add_callback('on_pretrain_routine_end', self.on_pretrain_routine_end)
+        model.add_callback('on_train_epoch_start', self.on_train_epoch_start)
+        model.add_callback('on_train_batch_start', self.on_train_batch_start)
+        model.add_callback('on_train_batch_end', self.on_train_batch_end)
+        model.add_callback('on_fit_epoch_end', self.on_fit_epoch_end)
+    
+    def _timed(self, trainer, name, key):
+        method = getattr(trainer, name)
+        
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                if self._epoch is not None:
+                    self._epoch[key] += time.perf_counter() - start
+        setattr(trainer, name, wrapper)
+    
+    def _count_images(self, trainer):
+        preprocess_batch = trainer.preprocess_batch
+        
+        def wrapper(batch):
+            self._batch_images = len(batch['img'])
+            return preprocess_batch(batch)
+        trainer.preprocess_batch = wrapper
+    
+    def on_pretrain_routine_end(self, trainer):
+        self.logger.log_metrics({'setup_sec': time.perf_counter() - self.started}, step=0)
+        self._timed(trainer, 'validate', 'validation_sec')
+        self._timed(trainer, 'save_model', 'checkpoint_sec')
+        self._count_images(trainer)
+    
+    def on_train_epoch_start(self, trainer):
+        self.sampler.read()  # discard setup/validation from the previous window
+        self._epoch = {
+            'epoch': trainer.epoch + 1,
+            'steps': 0,
+            'images': 0,
+            'data_wait_sec': 0.0,
+            'step_sec': 0.0,
+            'validation_sec': 0.0,
+            'checkpoint_sec': 0.0,
+            'start': time.perf_counter(),
+        }
+        self._last = self._epoch['start']
+    
+    def on_train_batch_start(self, trainer):
+        now = time.perf_counter()
+        self._wait = now - self._last
+        self._step_start = now
+    
+    def on_train_batch_end(self, trainer):
+        now = time.perf_counter()
+        step = now - self._step_start
+        # This rank's slice of the batch (short on the last one). DistributedSampler
+        # pads every rank to the same length, so all ranks ran as many images.
+        images = self._batch_images * self.world_size
+        epoch = self._epoch
+        epoch['steps'] += 1
+        epoch['images'] += images
+        epoch['data_wait_sec'] += self._wait
+        epoch['step_sec'] += step
+        self._last = now
+        
+        global_step = trainer.epoch * len(trainer.train_loader) + epoch['steps']
+        if self.step_interval and global_step % self.step_interval == 0:
+            self.logger.log_metrics({
+                'step_images_per_sec': images / (self._wait + step),
+                'step_data_wait_ms': self._wait * 1000,
+                'step_compute_ms': step * 1000,
+            }, step=global_step)
+    
+    def on_fit_epoch_end(self, trainer):
+        epoch = self._epoch
+        if epoch is None:
+            return
+        wall = time.perf_counter() - epoch.pop('start')
+        train_time = epoch['data_wait_sec'] + epoch['step_sec']
+        epoch.update({
+            'wall_sec': wall,
+            'images_per_sec': epoch['images'] / train_time if train_time else 0.0,
+            'data_wait_pct': 100 * epoch['data_wait_sec'] / train_time if train_time else 0.0,
+            **self.sampler.read()
+        })
+        self.epochs.append(epoch)
+        self._epoch = None
+        self.logger.log_metrics({
+            f"epoch_{key}": value for key, value in epoch.items() if key not in ('epoch', 'steps')
+        }, step=epoch['epoch'])
+    
+    def summary(self):
+        totals = {key: sum(e[key] for e in self.epochs)
+                  for key in ('data_wait_sec', 'step_sec', 'validation_sec', 'checkpoint_sec', 'wall_sec')}
+        costs = {
+            'dataloader': totals['data_wait_sec'],
+            'compute': totals['step_sec'],
+            'validation': totals['validation_sec'],
+            'checkpoint': totals['checkpoint_sec'],
+        }
+        train_time = totals['data_wait_sec'] + totals['step_sec']
+        gpu = [e['gpu_util_pct'] for e in self.epochs if e['gpu_util_pct'] is not None]
+        return {
+            'epochs': len(self.epochs),
+            'total_sec': time.perf_counter() - self.started,
+            **totals,
+            'images_per_sec': sum(e['images'] for e in self.epochs) / train_time if train_time else 0.0,
+            'data_wait_pct': 100 * totals['data_wait_sec'] / train_time if train_time else 0.0,
+            'mean_cpu_util_pct': sum(e['cpu_util_pct'] for e in self.epochs) / len(self.epochs) if self.epochs else None,
+            'mean_gpu_util_pct': sum(gpu) / len(gpu) if gpu else None,
+            'peak_host_mem_gb': max((e['host_mem_gb'] for e in self.epochs), default=None),
+            'bottleneck': max(costs, key=costs.get) if self.epochs else None,
+            'metric_points_dropped': self.logger.dropped,
+            'per_epoch': self.epochs,
+        }
+    
+    def close(self, output_dir):
+        """Flush metrics and write profile.json; returns its path"""
+        self.sampler.close()
+        self.logger.close()
+        summary = self.summary()
+        path = os.path.join(output_dir, 'profile.json')
+        with open(path, 'w') as f:
+            json.dump(summary, f, indent=2)
+        if self.epochs:
+            print(f"⏱️ Profile: {summary['images_per_sec']:.1f} images/s, "
+                  f"{summary['data_wait_pct']:.0f}% of train time waiting on data, "
+                  f"checkpoints {summary['checkpoint_sec']:.0f}s, bottleneck: {summary['bottleneck']}")
+        return path
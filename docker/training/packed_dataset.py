@@ -0,0 +1,184 @@
+import os
+import math
+
+import cv2
+import numpy as np
+from ultralytics.data import YOLODataset
+from ultralytics.models.yolo.detect import DetectionTrainer, DetectionValidator
+from ultralytics.utils import colorstr
+from ultralytics.utils.torch_utils import de_parallel
+
+from dataset_utils import PackedDataset
+from image_cache import LetterboxCache, dataset_fingerprint, default_cache_dir
+
+class PackedYOLODataset(YOLODataset):
+    """YOLODataset that reads images and boxes from packed, memory-mapped shards
+    
+    img_path is a packed split manifest (train.json / valid.json) instead
+    of an image directory. Labels come from the shard box arrays, so no
+    per-image .txt files or label cache are touched.
+    """
+    
+    def get_img_files(self, img_path):
+        self.packed = PackedDataset(img_path)
+        files = [f"{self.packed.root}/{self.packed.split}/{self.packed.file_name(i)}"
+                 for i in range(len(self.packed))]
+        if self.fraction < 1:
+            files = files[:round(len(files) * self.fraction)]
+        return files
+    
+    def get_labels(self):
+        labels = []
+        for i in range(len(self.im_files)):
+            rows = self.packed.labels(i)
+            labels.append({
+                'im_file': self.im_files[i],
+                'shape': self.packed.shape(i),
+                'cls': rows[:, :1].astype(np.float32),
+                'bboxes': rows[:, 1:5].astype(np.float32),
+                'segments': [],
+                'keypoints': None,
+                'normalized': True,
+                'bbox_format': 'xywh',
+            })
+        return labels
+    
+    def read_image(self, i):
+        """Original-resolution BGR image i"""
+        return self.packed.decode(i)
+    
+    def load_image(self, i, rect_mode=True):
+        """Same resize/buffer behaviour as BaseDataset.load_image, minus cv2.imread"""
+        im = self.ims[i]
+        if im is not None:
+            return im, self.im_hw0[i], self.im_hw[i]
+        
+        im = self.read_image(i)
+        h0, w0 = im.shape[:2]
+        if rect_mode:
+            r = self.imgsz / max(h0, w0)
+            if r != 1:
+                w, h = (min(math.ceil(w0 * r), self.imgsz), min(math.ceil(h0 * r), self.imgsz))
+                im = cv2.resize(im, (w, h), interpolation=cv2.INTER_LINEAR)
+        elif not (h0 == w0 == self.imgsz):
+            im = cv2.resize(im, (self.imgsz, self.imgsz), interpolation=cv2.INTER_LINEAR)
+        
+        if self.augment:
+            # Mosaic needs recently used images kept around
+            self.ims[i], self.im_hw0[i], self.im_hw[i] = im, (h0, w0), im.shape[:2]
+            self.buffer.append(i)
+            if 1 < len(self.buffer) >= self.max_buffer_length:
+                j = self.buffer.pop(0)
+                if getattr(self, 'cache', None) != 'ram':
+                    self.ims[j], self.im_hw0[j], self.im_hw[j] = None, None, None
+        return im, (h0, w0), im.shape[:2]
+
+class ImageCacheMixin:
+    """Serves load_image from a pre-decoded LetterboxCache when possible
+    
+    image_cache is a dict of LetterboxCache settings (cache_dir,
+    disk_budget_gb, ram_budget_gb, workers). Images outside the cache
+    fall back to the normal decode path.
+    """
+    
+    def __init__(self, *args, image_cache=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.image_cache = None
+        if image_cache:
+            cache = LetterboxCache.open(
+                image_cache.get('cache_dir') or default_cache_dir(),
+                dataset_fingerprint(self.image_entries()),
+                self.imgsz,
+                len(self.im_files),
+                disk_budget_gb=image_cache.get('disk_budget_gb', 50.0),
+                ram_budget_gb=image_cache.get('ram_budget_gb', 0.0),
+            )
+            self.image_cache = cache.build(self.read_image, workers=image_cache.get('workers', 8))
+    
+    def load_image(self, i, rect_mode=True):
+        if rect_mode and self.image_cache is not None:
+            cached = self.image_cache.get(i)
+            if cached is not None:
+                if self.augment:
+                    # Mosaic samples partner images from the buffer; keep indices only
+                    self.buffer.append(i)
+                    if len(self.buffer) > self.max_buffer_length:
+                        self.buffer.pop(0)
+                return cached
+        return super().load_image(i, rect_mode)
+
+class CachedYOLODataset(ImageCacheMixin, YOLODataset):
+    """Image-directory YOLODataset backed by the pre-decoded image cache"""
+    
+    def image_entries(self):
+        return [(f, os.path.getsize(f)) for f in self.im_files]
+    
+    def read_image(self, i):
+        im = cv2.imread(self.im_files[i])
+        if im is None:
+            raise FileNotFoundError(f"Image Not Found {self.im_files[i]}")
+        return im
+
+class CachedPackedYOLODataset(ImageCacheMixin, PackedYOLODataset):
+    """Packed-shard YOLODataset backed by the pre-decoded image cache"""
+    
+    def image_entries(self):
+        return [(self.packed.file_name(i), len(self.packed.image_bytes(i)))
+                for i in range(len(self.im_files))]
+
+def build_packed_dataset(cfg, img_path, batch, data, mode='train', rect=False, stride=32,
+                         dataset_class=PackedYOLODataset, **kwargs):
+    """Mirror of ultralytics.data.build_yolo_dataset for custom dataset classes"""
+    return dataset_class(
+        img_path=img_path,
+        imgsz=cfg.imgsz,
+        batch_size=batch,
+        augment=mode == 'train',
+        hyp=cfg,
+        rect=cfg.rect or rect,
+        cache=None,
+        single_cls=cfg.single_cls or False,
+        stride=int(stride),
+        pad=0.0 if mode == 'train' else 0.5,
+        prefix=colorstr(f"{mode}: "),
+        task=cfg.task,
+        classes=cfg.classes,
+        data=data,
+        fraction=cfg.fraction if mode == 'train' else 1.0,
+        **kwargs
+    )
+
+class PackedDetectionTrainer(DetectionTrainer):
+    """DetectionTrainer whose train/val datasets come from packed shards"""
+    
+    dataset_class = PackedYOLODataset
+    dataset_kwargs = {}
+    
+    def build_dataset(self, img_path, mode='train', batch=None):
+        stride = max(int(de_parallel(self.model).stride.max() if self.model else 0), 32)
+        return build_packed_dataset(
+            self.args, img_path, batch, self.data, mode=mode,
+            rect=mode == 'val', stride=stride, dataset_class=self.dataset_class,
+            **self.dataset_kwargs
+        )
+
+def make_trainer(packed=False, image_cache=None, distributed=False):
+    """Trainer class for a dataset layout, or None for the stock DetectionTrainer"""
+    if image_cache:
+        dataset_class = CachedPackedYOLODataset if packed else CachedYOLODataset
+        trainer = type('CachedDetectionTrainer', (PackedDetectionTrainer,), {
+            'dataset_class': dataset_class,
+            'dataset_kwargs': {'image_cache': image_cache},
+        })
+    else:
+        trainer = PackedDetectionTrainer if packed else DetectionTrainer
+    if distributed:
+        from distributed import CpuDistributedMixin
+        return type(f"CpuDistributed{trainer.__name__}", (CpuDistributedMixin, trainer), {})
+    return None if trainer is DetectionTrainer else trainer
+
+class PackedDetectionValidator(DetectionValidator):
+    """DetectionValidator for packed splits (used by standalone model.val)"""
+    
+    def build_dataset(self, img_path, mode='val', batch=None):
+        return build_packed_dataset(self.args, img_path, batch, self.data, mode=mode, stride=self.stride)
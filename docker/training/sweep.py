@@ -0,0 +1,292 @@
+import os
+import json
+import math
+import time
+import shutil
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+
+# Ultralytics train() arguments accepted as hyperparameters (and tunable here)
+TUNABLE_ARGS = {
+    'lr0': float, 'lrf': float, 'momentum': float, 'weight_decay': float, 'warmup_epochs': float,
+    'box': float, 'cls': float, 'dfl': float,
+    'hsv_h': float, 'hsv_s': float, 'hsv_v': float, 'degrees': float, 'translate': float,
+    'scale': float, 'fliplr': float, 'mosaic': float, 'mixup': float,
+    'close_mosaic': int, 'optimizer': str,
+}
+# train.py hyperparameter names that map to differently named train() arguments
+HYPERPARAMETER_ARGS = {'batch-size': ('batch', int), 'img-size': ('imgsz', int)}
+BEST_CONFIG_FILE = 'best_hyperparameters.json'
+METRIC = 'metrics/mAP50-95(B)'
+
+def load_space(spec):
+    """Search space from a YAML/JSON file path or an inline JSON string
+    
+    Each entry is one of
+      lr0: {loguniform: [1.0e-4, 1.0e-2]}
+      mosaic: {uniform: [0.5, 1.0]}
+      close_mosaic: {int: [0, 10]}
+      batch-size: {choice: [8, 16, 32]}
+    """
+    import yaml
+    
+    if os.path.exists(spec):
+        with open(spec, 'r') as f:
+            space = yaml.safe_load(f)
+    else:
+        space = yaml.safe_load(spec)
+    for name, dist in space.items():
+        if name not in TUNABLE_ARGS and name not in HYPERPARAMETER_ARGS:
+            raise ValueError(f"'{name}' is not tunable; choose from {sorted(TUNABLE_ARGS) + sorted(HYPERPARAMETER_ARGS)}")
+        if not isinstance(dist, dict) or len(dist) != 1:
+            raise ValueError(f"'{name}' needs exactly one of choice/uniform/loguniform/int: {dist}")
+        kind = next(iter(dist))
+        if kind not in ('choice', 'uniform', 'loguniform', 'int'):
+            raise ValueError(f"Unknown distribution '{kind}' for '{name}'")
+    return space
+
+def sample_config(space, rng):
+    config = {}
+    for name, dist in space.items():
+        kind, values = next(iter(dist.items()))
+        if kind == 'choice':
+            config[name] = values[rng.integers(len(values))]
+        elif kind == 'uniform':
+            config[name] = round(float(rng.uniform(float(values[0]), float(values[1]))), 6)
+        elif kind == 'loguniform':
+            # float(): YAML reads 1e-4 (no decimal point) as a string
+            low, high = math.log(float(values[0])), math.log(float(values[1]))
+            config[name] = float(f"{math.exp(rng.uniform(low, high)):.3g}")
+        else:
+            config[name] = int(rng.integers(values[0], values[1] + 1))
+    return config
+
+def train_args(config):
+    """Sweep config (hyperparameter names) -> ultralytics train() kwargs"""
+    kwargs = {}
+    for name, value in config.items():
+        if name in HYPERPARAMETER_ARGS:
+            arg, cast = HYPERPARAMETER_ARGS[name]
+            kwargs[arg] = cast(value)
+        else:
+            kwargs[name] = TUNABLE_ARGS[name](value)
+    return kwargs
+
+def rung_epochs(min_epochs, max_epochs, eta):
+    """Epoch budget per rung: min_epochs * eta**k, ending at max_epochs"""
+    rungs = []
+    epochs = min_epochs
+    while epochs < max_epochs:
+        rungs.append(epochs)
+        epochs *= eta
+    rungs.append(max_epochs)
+    return rungs
+
+class AshaScheduler:
+    """Asynchronous successive halving
+    
+    A free worker is first given a promotion: a trial in the top 1/eta of
+    the results reported so far at some rung, highest rung first, that
+    has not been promoted yet. Only when no promotion is available does it
+    start a new trial. Workers never wait for a rung to fill up, and weak
+    trials simply never get promoted.
+    """
+    
+    def __init__(self, rungs, eta, max_trials):
+        self.rungs = rungs
+        self.eta = eta
+        self.max_trials = max_trials
+        self.started = 0
+        self.results = [{} for _ in rungs]
+        self.promoted = [set() for _ in rungs]
+    
+    def next_job(self):
+        """(trial, rung) to run next, or None when there is nothing to do right now"""
+        for rung in reversed(range(len(self.rungs) - 1)):
+            results = self.results[rung]
+            top = sorted(results, key=results.get, reverse=True)[:len(results) // self.eta]
+            for trial in top:
+                if trial not in self.promoted[rung]:
+                    self.promoted[rung].add(trial)
+                    return trial, rung + 1
+        if self.started < self.max_trials:
+            self.started += 1
+            return self.started - 1, 0
+        return None
+    
+    def report(self, trial, rung, metric):
+        self.results[rung][trial] = metric
+    
+    def best(self):
+        """(trial, rung, metric) of the best trial at the highest rung reached"""
+        for rung in reversed(range(len(self.rungs))):
+            if self.results[rung]:
+                trial = max(self.results[rung], key=self.results[rung].get)
+                return trial, rung, self.results[rung][trial]
+        return None
+
+def train_segment(job):
+    """Train one trial up to its rung's epoch budget (runs in a pool process)
+    
+    Every trial trains on the full max_epochs schedule and is stopped at the
+    rung boundary, so a promoted trial resumes with its LR schedule,
+    optimizer and EMA intact. The rung boundary checkpoint is kept as
+    rung.pt, because ultralytics strips the optimizer from last.pt when a
+    run stops.
+    """
+    import torch
+    import mlflow
+    from ultralytics import YOLO
+    
+    from packed_dataset import make_trainer
+    
+    torch.set_num_threads(job['threads'])
+    weights_dir = os.path.join(job['trial_dir'], 'weights')
+    rung_ckpt = os.path.join(weights_dir, 'rung.pt')
+    result = {}
+    
+    def save_rung(trainer):
+        if trainer.epoch + 1 == job['target_epochs']:
+            shutil.copy2(trainer.last, rung_ckpt)
+    
+    def stop_at_rung(trainer):
+        result['epochs'] = trainer.epoch + 1
+        result['metric'] = float(trainer.metrics.get(METRIC, 0.0))
+        if trainer.epoch + 1 >= job['target_epochs']:
+            trainer.stop = True
+    
+    start = time.perf_counter()
+    # Ultralytics' MLflow callback logs epochs into the active run: this trial's nested run
+    mlflow.start_run(run_id=job['run_id'])
+    try:
+        if job['rung'] > 0:
+            last = os.path.join(weights_dir, 'last.pt')
+            shutil.copy2(rung_ckpt, last)
+            model = YOLO(last)
+            kwargs = {'resume': True}
+        else:
+            model = YOLO(job['weights'])
+            kwargs = dict(train_args(job['config']), data=job['data_yaml'], epochs=job['max_epochs'],
+                          project=os.path.dirname(job['trial_dir']), name=os.path.basename(job['trial_dir']),
+                          exist_ok=True, plots=False)
+        model.add_callback('on_model_save', save_rung)
+        model.add_callback('on_fit_epoch_end', stop_at_rung)
+        trainer = make_trainer(job['packed'], job['image_cache'])
+        if trainer:
+            kwargs['trainer'] = trainer
+        model.train(device=job['device'], verbose=False, **kwargs)
+    finally:
+        if mlflow.active_run():
+            mlflow.end_run()
+    result.update({'trial': job['trial'], 'rung': job['rung'], 'seconds': time.perf_counter() - start})
+    return result
+
+def run_sweep(space, data_yaml, output_dir, max_trials=16, workers=2, min_epochs=5, max_epochs=100, eta=3,
+              weights='yolov8n.pt', base_config=None, packed=False, image_cache=None, seed=0):
+    """ASHA search over space; writes best_hyperparameters.json and returns it
+    
+    base_config holds the fixed hyperparameters (e.g. batch-size) that a
+    sampled trial config overrides.
+    """
+    import mlflow
+    import torch
+    
+    rungs = rung_epochs(min_epochs, max_epochs, eta)
+    scheduler = AshaScheduler(rungs, eta, max_trials)
+    rng = np.random.default_rng(seed)
+    gpus = torch.cuda.device_count()
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    sweep_dir = os.path.join(output_dir, 'sweep')
+    os.makedirs(sweep_dir, exist_ok=True)
+    
+    # Trial processes (and ultralytics' MLflow callback in them) must log to this tracking store
+    os.environ.setdefault('MLFLOW_TRACKING_URI', mlflow.get_tracking_uri())
+    trials = {}
+    full_budget = max_trials * max_epochs
+    spent = 0
+    print(f"🔎 ASHA sweep: {max_trials} trials, rungs {rungs} epochs, eta {eta}, {workers} concurrent")
+    start = time.perf_counter()
+    with mlflow.start_run(run_name='asha-sweep') as parent:
+        mlflow.log_params({
+            'sweep_space': json.dumps(space)[:500],
+            'max_trials': max_trials,
+            'rungs': ','.join(str(r) for r in rungs),
+            'eta': eta,
+        })
+        client = mlflow.tracking.MlflowClient()
+        # spawn: forking a process that already imported torch is not safe
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            running = {}
+            while True:
+                while len(running) < workers:
+                    job = scheduler.next_job()
+                    if job is None:
+                        break
+                    trial, rung = job
+                    if rung == 0:
+                        config = dict(base_config or {}, **sample_config(space, rng))
+                        with mlflow.start_run(run_name=f"trial-{trial:03d}", nested=True) as run:
+                            mlflow.log_params({k.replace('-', '_'): v for k, v in config.items()})
+                        trials[trial] = {'config': config, 'run_id': run.info.run_id,
+                                         'dir': os.path.join(sweep_dir, f"trial-{trial:03d}")}
+                    info = trials[trial]
+                    print(f"  ▶️ trial {trial} rung {rung} (to epoch {rungs[rung]}): {info['config']}")
+                    future = pool.submit(train_segment, {
+                        'trial': trial, 'rung': rung, 'target_epochs': rungs[rung], 'max_epochs': max_epochs,
+                        'config': info['config'], 'trial_dir': info['dir'], 'run_id': info['run_id'],
+                        'data_yaml': data_yaml, 'weights': weights, 'packed': packed, 'image_cache': image_cache,
+                        'device': trial % gpus if gpus else 'cpu', 'threads': threads,
+                    })
+                    running[future] = (trial, rung)
+                if not running:
+                    break
+                
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    trial, rung = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        print(f"  ❌ trial {trial} rung {rung} failed: {e}")
+                        client.set_tag(trials[trial]['run_id'], 'asha_status', f"failed at rung {rung}")
+                        continue
+                    epochs_run = rungs[rung] - (rungs[rung - 1] if rung else 0)
+                    spent += epochs_run
+                    scheduler.report(trial, rung, result['metric'])
+                    client.log_metric(trials[trial]['run_id'], 'rung_mAP50-95', result['metric'], step=rungs[rung])
+                    client.set_tag(trials[trial]['run_id'], 'asha_rung', str(rung))
+                    print(f"  ✅ trial {trial} rung {rung}: mAP50-95 {result['metric']:.4f} "
+                          f"({result['seconds']:.0f}s, {spent}/{full_budget} epochs of the all-full-runs budget)")
+        
+        best = scheduler.best()
+        if best is None:
+            raise RuntimeError("Every sweep trial failed")
+        trial, rung, metric = best
+        best_config = dict(trials[trial]['config'])
+        summary = {
+            'trial': trial,
+            'rung': rung,
+            'epochs': rungs[rung],
+            'mAP50-95': metric,
+            'epochs_trained': spent,
+            'full_grid_epochs': full_budget,
+            'seconds': round(time.perf_counter() - start, 1),
+            'hyperparameters': best_config,
+        }
+        best_path = os.path.join(output_dir, BEST_CONFIG_FILE)
+        with open(best_path, 'w') as f:
+            json.dump(best_config, f, indent=2)
+        with open(os.path.join(sweep_dir, 'summary.json'), 'w') as f:
+            json.dump(summary, f, indent=2)
+        mlflow.log_metrics({'best_mAP50-95': metric, 'epochs_trained': spent,
+                            'compute_vs_full_runs': spent / max(full_budget, 1)})
+        mlflow.log_params({f"best_{k.replace('-', '_')}": v for k, v in best_config.items()})
+        mlflow.log_artifact(best_path, 'sweep')
+        client.set_tag(trials[trial]['run_id'], 'asha_status', 'best')
+        print(f"🏆 Best: trial {trial} (mAP50-95 {metric:.4f} at {rungs[rung]} epochs) -> {best_path}")
+        print(f"💰 Trained {spent} epochs vs {full_budget} for {max_trials} full runs "
+              f"({spent / max(full_budget, 1):.0%}); parent MLflow run {parent.info.run_id}")
+    return best_config, summary
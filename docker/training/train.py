@@ -3,57 +3,118 @@ import os
 import argparse
 import json
 import sys
+from contextlib import nullcontext
 from pathlib import Path
 
+# Shared helpers live in src/data in the repo and next to this script in the image
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src', 'data'))
+
+from sweep import BEST_CONFIG_FILE, TUNABLE_ARGS
+from weights_registry import StartupTimer, link_weights, resolve_weights
+
+# Best config promoted from a sweep (run_training.py --tuned-config)
+TUNED_DIR = '/opt/ml/input/data/tuned'
+
 print("🚀 Starting YOLOv8 Training Container")
 print(f"Python version: {sys.version}")
 print(f"Working directory: {os.getcwd()}")
 
-# Import training dependencies
-try:
-    from ultralytics import YOLO
-    import mlflow
-    import mlflow.pytorch
-    import torch
-    print("✅ Training imports successful")
-    print(f"🔥 CUDA available: {torch.cuda.is_available()}")
-    if torch.cuda.is_available():
-        print(f"🎮 GPU device: {torch.cuda.get_device_name(0)}")
-except ImportError as e:
-    print(f"❌ Import error: {e}")
-    sys.exit(1)
+def import_training_libraries():
+    """Import ultralytics, MLflow and torch once the job's inputs check out
+    
+    They take seconds to import, so a job with a missing dataset fails
+    before paying for them.
+    """
+    try:
+        from ultralytics import YOLO
+        from ultralytics.utils import USER_CONFIG_DIR
+        import mlflow
+        import mlflow.pytorch
+        import torch
+        print("✅ Training imports successful")
+        print(f"🔥 CUDA available: {torch.cuda.is_available()}")
+        if torch.cuda.is_available():
+            print(f"🎮 GPU device: {torch.cuda.get_device_name(0)}")
+    except ImportError as e:
+        print(f"❌ Import error: {e}")
+        sys.exit(1)
+    # Ultralytics fetches its plotting font on first use; serve it from the registry
+    link_weights('Arial.ttf', os.path.join(USER_CONFIG_DIR, 'Arial.ttf'))
+    return YOLO, mlflow, torch
 
 def parse_hyperparameters():
     """Parse SageMaker hyperparameters"""
-    hyperparams_path = '/opt/ml/input/config/hyperparameters.json'
+    config_dir = os.environ.get('SM_INPUT_CONFIG_DIR', '/opt/ml/input/config')
+    hyperparams_path = os.path.join(config_dir, 'hyperparameters.json')
     
     # Default hyperparameters (matching your Colab)
     defaults = {
         'epochs': 100,
         'batch-size': 8,
         'img-size': 640,
-        'model-name': 'hail-damage-detector'
+        'model-name': 'hail-damage-detector',
+        'export-formats': 'onnx',  # comma-separated, e.g. "onnx,torchscript"; "none" to skip
+        'quantize': 'static',  # INT8 ONNX variant: static (calibrated on valid), dynamic or none
+        'max-map-drop': 0.02,  # Reject exports losing more mAP50-95 than this
+        'image-cache': 'on',  # Pre-decoded, resized image cache reused across epochs/runs: on or off
+        'cache-dir': '',  # Defaults to the warm pool cache dir when available, else /tmp
+        'cache-disk-gb': 50.0,  # Disk budget for all cached datasets; LRU entries are evicted past it
+        'cache-ram-gb': 8.0,  # Load a cache into RAM when it fits, otherwise page it from disk
+        'warm-start': 'auto',  # auto = fine-tune from the warmstart channel's model when one is attached; off = COCO weights
+        'distributed': 'off',  # cpu = DDP over gloo across workers-per-host processes on every instance
+        'workers-per-host': 0,  # DDP workers per instance; 0 = one per 4 cores
+        'profile-interval': 50,  # Steps between per-step throughput points; 0 = epoch metrics only
+        'autotune': 'off',  # on = probe batch size and dataloader workers before a fresh run (replaces batch-size)
+        'sweep-space': '',  # YAML/JSON search space (see sweep.load_space); set to run an ASHA sweep instead
+        'sweep-trials': 16,
+        'sweep-workers': 2,  # Trials trained concurrently
+        'sweep-min-epochs': 5,  # First rung; survivors get eta times more epochs per rung up to epochs
+        'sweep-eta': 3,
+        'train-args': {}  # Extra ultralytics train() args (lr0, mosaic, ...; see sweep.TUNABLE_ARGS)
     }
     
+    # A promoted sweep result sits between the defaults and explicit hyperparameters
+    hyperparams = {}
+    tuned_path = os.path.join(os.environ.get('SM_CHANNEL_TUNED', TUNED_DIR), BEST_CONFIG_FILE)
+    if os.path.exists(tuned_path):
+        with open(tuned_path, 'r') as f:
+            hyperparams.update(json.load(f))
+        print(f"🏆 Loaded tuned hyperparameters: {tuned_path}")
+    
     if os.path.exists(hyperparams_path):
         with open(hyperparams_path, 'r') as f:
-            hyperparams = json.load(f)
+            explicit = json.load(f)
             print("📋 Loaded hyperparameters from SageMaker:")
-            for key, value in hyperparams.items():
+            for key, value in explicit.items():
                 print(f"  {key}: {value}")
-        
-        # Update defaults with SageMaker hyperparams
-        for key in defaults:
-            if key in hyperparams:
-                if key in ['epochs', 'batch-size', 'img-size']:
-                    defaults[key] = int(hyperparams[key])
-                else:
-                    defaults[key] = hyperparams[key]
-    else:
+        hyperparams.update(explicit)
+    elif not hyperparams:
         print("📋 Using default hyperparameters")
     
+    # Update defaults with SageMaker hyperparams
+    for key in defaults:
+        if key in hyperparams:
+            if key in ['epochs', 'batch-size', 'img-size', 'workers-per-host', 'profile-interval', 'sweep-trials',
+                       'sweep-workers', 'sweep-min-epochs', 'sweep-eta']:
+                defaults[key] = int(hyperparams[key])
+            elif key in ['max-map-drop', 'cache-disk-gb', 'cache-ram-gb']:
+                defaults[key] = float(hyperparams[key])
+            else:
+                defaults[key] = hyperparams[key]
+    for key, cast in TUNABLE_ARGS.items():
+        if key in hyperparams:
+            defaults['train-args'][key] = cast(hyperparams[key])
+    
     return defaults
 
+def is_packed_dataset(data_yaml):
+    """Packed shard datasets point train/val at JSON manifests, not image dirs"""
+    import yaml
+    
+    with open(data_yaml, 'r') as f:
+        data = yaml.safe_load(f) or {}
+    return str(data.get('train', '')).endswith('.json')
+
 def list_directory_contents(directory):
     """List directory contents for debugging"""
     print(f"📁 Contents of {directory}:")
@@ -73,12 +134,27 @@ def list_directory_contents(directory):
         print(f"❌ Directory {directory} does not exist")
 
 def main():
+    startup = StartupTimer()
+    
     # Parse hyperparameters
     hyperparams = parse_hyperparameters()
     
-    # SageMaker paths
-    input_dir = '/opt/ml/input/data/training'
-    model_dir = '/opt/ml/model'
+    # A sweep trains its trials side by side in this one process; per-rank
+    # workers would each run the whole sweep into the same model dir
+    if hyperparams['sweep-space'] and hyperparams['distributed'] != 'off':
+        print(f"⚠️ Ignoring distributed={hyperparams['distributed']} for the sweep")
+        hyperparams['distributed'] = 'off'
+    
+    # CPU DDP: this process only launches the per-rank workers, which rerun this script
+    from distributed import is_main_process, launch_workers
+    if hyperparams['distributed'] == 'cpu' and 'RANK' not in os.environ:
+        sys.exit(launch_workers([sys.executable, os.path.abspath(__file__)], hyperparams['workers-per-host']))
+    distributed = hyperparams['distributed'] == 'cpu'
+    main_process = is_main_process()
+    
+    # SageMaker paths (overridable to run the container entry point on a host)
+    input_dir = os.environ.get('SM_CHANNEL_TRAINING', '/opt/ml/input/data/training')
+    model_dir = os.environ.get('SM_MODEL_DIR', '/opt/ml/model')
     
     print(f"📂 Input directory: {input_dir}")
     print(f"📂 Model output directory: {model_dir}")
@@ -108,6 +184,29 @@ def main():
         sys.exit(1)
     
     print(f"📄 Using dataset config: {data_yaml}")
+    startup.mark('inputs checked')
+    YOLO, mlflow, torch = import_training_libraries()
+    startup.mark('imports loaded')
+    
+    # Packed shards and the pre-decoded image cache plug in through custom trainer classes
+    trainer_kwargs = {}
+    validator = None
+    packed = is_packed_dataset(data_yaml)
+    image_cache = None
+    if hyperparams['image-cache'] != 'off':
+        image_cache = {
+            'cache_dir': hyperparams['cache-dir'],
+            'disk_budget_gb': hyperparams['cache-disk-gb'],
+            'ram_budget_gb': hyperparams['cache-ram-gb'],
+            'workers': os.cpu_count() or 8,
+        }
+        print(f"🧊 Image cache enabled (disk {hyperparams['cache-disk-gb']} GB, RAM {hyperparams['cache-ram-gb']} GB)")
+    if packed or image_cache or distributed:
+        from packed_dataset import PackedDetectionValidator, make_trainer
+        trainer_kwargs['trainer'] = make_trainer(packed, image_cache, distributed)
+    if packed:
+        validator = PackedDetectionValidator
+        print("📦 Packed dataset detected: reading memory-mapped shards")
     
     # Display data.yaml content (exactly like your Colab)
     with open(data_yaml, 'r') as f:
@@ -115,52 +214,184 @@ def main():
         print("📄 Training with data.yaml:")
         print(yaml_content)
     
-    # Start MLflow experiment tracking
-    print("📊 Setting up MLflow tracking...")
-    try:
-        mlflow.set_experiment("hail-damage-detection")
-        print("✅ MLflow experiment set")
-    except Exception as e:
-        print(f"⚠️ MLflow setup warning: {e}")
+    # Start MLflow experiment tracking (rank 0 only under DDP)
+    if main_process:
+        print("📊 Setting up MLflow tracking...")
+        try:
+            mlflow.set_experiment("hail-damage-detection")
+            print("✅ MLflow experiment set")
+        except Exception as e:
+            print(f"⚠️ MLflow setup warning: {e}")
     
-    # Start MLflow run
-    with mlflow.start_run():
-        # Log hyperparameters
-        mlflow.log_params({
-            'epochs': hyperparams['epochs'],
-            'batch_size': hyperparams['batch-size'],
-            'img_size': hyperparams['img-size'],
-            'model_name': hyperparams['model-name'],
-            'data_yaml_path': data_yaml
+    # Hyperparameter sweep: ASHA trials instead of one training run
+    if hyperparams['sweep-space']:
+        from sweep import load_space, run_sweep
+        base_config = dict(hyperparams['train-args'], **{
+            'batch-size': hyperparams['batch-size'],
+            'img-size': hyperparams['img-size'],
         })
+        best_config, summary = run_sweep(
+            load_space(hyperparams['sweep-space']), data_yaml, model_dir,
+            weights=resolve_weights('yolov8n.pt') or 'yolov8n.pt',
+            max_trials=hyperparams['sweep-trials'],
+            workers=hyperparams['sweep-workers'],
+            min_epochs=hyperparams['sweep-min-epochs'],
+            max_epochs=hyperparams['epochs'],
+            eta=hyperparams['sweep-eta'],
+            base_config=base_config,
+            packed=packed,
+            image_cache=image_cache
+        )
+        print(f"🎉 Sweep completed; promote with run_training.py --tuned-config <model.tar.gz>/{BEST_CONFIG_FILE}")
+        return
+    
+    # Start MLflow run
+    with mlflow.start_run() if main_process else nullcontext():
+        # Runs live in the checkpoint dir when the job has one, so SageMaker
+        # syncs last.pt to S3 every epoch and restores it after a restart
+        from checkpoints import (PreemptionHandler, checkpoint_dir, copy_run,
+                                 find_resume_checkpoint, find_warm_start_weights)
+        checkpoint_root = checkpoint_dir()
+        project_dir = checkpoint_root or model_dir
+        run_dir = os.path.join(project_dir, hyperparams['model-name'])
+        resume_weights, resume_state = find_resume_checkpoint(run_dir)
         
-        # Load YOLOv8 model (exactly like your Colab)
+        # Load YOLOv8 model: resume > warm start from the last production model > COCO weights
         print("🤖 Loading YOLOv8 model...")
+        warm_start = None
+        if not resume_weights and hyperparams['warm-start'] != 'off':
+            warm_start = find_warm_start_weights()
         try:
-            model = YOLO("yolov8n.pt")  # Download pretrained model
+            if resume_weights:
+                print(f"♻️ Found {resume_state} checkpoint from a previous attempt: {resume_weights}")
+                model = YOLO(resume_weights)
+            elif warm_start:
+                print(f"🔥 Warm start from previous model: {warm_start}")
+                model = YOLO(warm_start)
+            else:
+                # COCO weights from the local registry; downloaded only if it lacks them
+                model = YOLO(resolve_weights('yolov8n.pt') or 'yolov8n.pt')
             print("✅ YOLOv8 model loaded successfully")
+            startup.mark('model loaded')
         except Exception as e:
             print(f"❌ Failed to load YOLOv8: {e}")
             sys.exit(1)
         
+        # Probe the largest fast batch size and loader worker count for this
+        # instance (fresh runs only; a resume must keep its original batch)
+        device = 'cpu' if distributed else (0 if torch.cuda.is_available() else 'cpu')
+        workers = {}
+        tuned = None
+        configured_batch = hyperparams['batch-size']
+        if hyperparams['autotune'] == 'on' and not distributed and not resume_weights:
+            from autotune import autotune
+            try:
+                tuned = autotune(model.model, data_yaml, hyperparams['img-size'], device,
+                                 trainer=trainer_kwargs.get('trainer'))
+            except Exception as e:
+                print(f"⚠️ Autotune warning, keeping configured settings: {e}")
+            if tuned and tuned['batch']:
+                hyperparams['batch-size'] = tuned['batch']
+                if tuned['batch'] != configured_batch:
+                    # The batch size also scales the effective LR and warmup; make the swap visible
+                    print(f"⚠️ Autotune replaced batch-size {configured_batch} with {tuned['batch']}")
+            if tuned and tuned['workers'] is not None:
+                workers['workers'] = tuned['workers']
+        
+        # Log hyperparameters
+        if main_process:
+            mlflow.log_params({
+                'epochs': hyperparams['epochs'],
+                'batch_size': hyperparams['batch-size'],
+                'img_size': hyperparams['img-size'],
+                'model_name': hyperparams['model-name'],
+                'data_yaml_path': data_yaml,
+                'packed_dataset': packed,
+                'image_cache': hyperparams['image-cache'],
+                'distributed': hyperparams['distributed'],
+                'world_size': int(os.environ.get('WORLD_SIZE', 1)),
+                'autotune': tuned is not None,
+                'resumed': resume_weights is not None,
+                'init_weights': os.path.basename(warm_start) if warm_start else 'yolov8n.pt',
+                **hyperparams['train-args']
+            })
+            if tuned:
+                mlflow.log_params({
+                    'autotune_batch': tuned['batch'],
+                    'autotune_workers': tuned['workers'],
+                    'configured_batch_size': configured_batch,
+                })
+                if hyperparams['batch-size'] != configured_batch:
+                    mlflow.set_tag('autotune_batch_change', f"{configured_batch} -> {hyperparams['batch-size']}")
+                for point in tuned['batch_curve']:
+                    mlflow.log_metric('probe_images_per_sec', point['images_per_sec'], step=point['batch'])
+                    mlflow.log_metric('probe_peak_mem_gb', point['peak_memory_gb'], step=point['batch'])
+                for point in tuned['worker_curve']:
+                    mlflow.log_metric('probe_loader_images_per_sec', point['images_per_sec'], step=point['workers'])
+                mlflow.log_dict(tuned, 'autotune/autotune.json')
+        
+        preemption = PreemptionHandler(main_process)
+        preemption.register(model)
+        
+        # Throughput/stall metrics stream to MLflow from a background thread during training
+        profiler = None
+        if main_process:
+            from instrumentation import TrainingProfiler
+            profiler = TrainingProfiler(mlflow.active_run().info.run_id, hyperparams['profile-interval'])
+            profiler.register(model)
+        
+        def on_train_start(trainer):
+            startup.mark('training started')
+            if main_process:
+                try:
+                    mlflow.log_metrics(startup.metrics())
+                except Exception as e:
+                    print(f"⚠️ MLflow metrics logging warning: {e}")
+        model.add_callback('on_train_start', on_train_start)
+        
         # Train the model (matching your Colab exactly)
-        print("🚀 Starting training...")
-        try:
-            results = model.train(
-                data=data_yaml,
-                epochs=hyperparams['epochs'],
-                imgsz=hyperparams['img-size'],
-                batch=hyperparams['batch-size'],
-                name=hyperparams['model-name'],
-                project=model_dir,
-                save=True,
-                save_period=10,  # Save checkpoint every 10 epochs
-                device=0 if torch.cuda.is_available() else 'cpu'
-            )
-            print("✅ Training completed successfully!")
-        except Exception as e:
-            print(f"❌ Training failed: {e}")
-            sys.exit(1)
+        results = None
+        if resume_state == 'finished':
+            # Restarted after training completed (e.g. preempted during export)
+            print("⏭️ Training already finished in a previous attempt, skipping to artifacts")
+        else:
+            print("🚀 Resuming training..." if resume_weights else "🚀 Starting training...")
+            try:
+                results = model.train(
+                    data=data_yaml,
+                    epochs=hyperparams['epochs'],
+                    imgsz=hyperparams['img-size'],
+                    batch=hyperparams['batch-size'],
+                    name=hyperparams['model-name'],
+                    project=project_dir,
+                    exist_ok=True,  # Keep one run dir so a restart finds its last.pt
+                    resume=resume_weights is not None,
+                    save=True,
+                    save_period=10,  # Save checkpoint every 10 epochs
+                    device=device,
+                    **workers,
+                    **hyperparams['train-args'],
+                    **trainer_kwargs
+                )
+                print("✅ Training completed successfully!")
+            except Exception as e:
+                print(f"❌ Training failed: {e}")
+                sys.exit(1)
+            finally:
+                # Also on failure/preemption: the profile shows where the time went
+                if profiler:
+                    profile_path = profiler.close(model_dir)
+                    try:
+                        mlflow.log_artifact(profile_path, "profile")
+                    except Exception as e:
+                        print(f"⚠️ MLflow artifact logging warning: {e}")
+        
+        # Only rank 0 holds the checkpoints; the other ranks are done
+        if not main_process:
+            return
+        if checkpoint_root:
+            print(f"📦 Copying {run_dir} into {model_dir}")
+            copy_run(run_dir, model_dir)
         
         # Log metrics to MLflow
         try:
@@ -190,6 +421,27 @@ def main():
         if os.path.exists(last_model_path):
             print(f"✅ Last model saved: {last_model_path}")
         
+        # Export ONNX/TorchScript (+ INT8) artifacts for CPU serving
+        formats = [f.strip() for f in hyperparams['export-formats'].split(',') if f.strip()]
+        if os.path.exists(best_model_path) and formats and formats != ['none']:
+            print("📦 Exporting deployment artifacts...")
+            try:
+                from export import export_model
+                report, report_path = export_model(
+                    best_model_path,
+                    data_yaml,
+                    hyperparams['img-size'],
+                    formats=formats,
+                    quantize=hyperparams['quantize'],
+                    max_map_drop=hyperparams['max-map-drop'],
+                    validator=validator
+                )
+                mlflow.log_artifact(report_path, "export")
+                for name, artifact in report['artifacts'].items():
+                    mlflow.log_metric(f"export_{name}_mAP50-95_delta", artifact['mAP50-95_delta'])
+            except Exception as e:
+                print(f"⚠️ Export warning: {e}")
+        
         # List final model directory
         list_directory_contents(model_dir)
         
@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import socket
+import argparse
+import platform
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+AUTODISTILL_DIR = os.path.join(REPO_ROOT, 'docker', 'autodistill')
+TRAINING_DIR = os.path.join(REPO_ROOT, 'docker', 'training')
+INFERENCE_DIR = os.path.join(REPO_ROOT, 'src', 'inference')
+DATA_DIR = os.path.join(REPO_ROOT, 'src', 'data')
+DEFAULT_HISTORY = os.path.join(REPO_ROOT, 'benchmarks', 'history.json')
+
+# Stages in run order, with the stage whose output each one needs
+STAGES = {
+    'convert': None,     # process.py PNG -> JPG conversion
+    'label': 'convert',  # process.py end to end with the stub labeler: hashing, labeling, dataset writing
+    'pack': None,        # dataset_utils.pack_yolo_dataset on the fixture dataset
+    'train_epoch': None,  # train.py for one epoch on CPU (includes validation)
+    'inference': None,   # src/inference micro-batched predictions from concurrent clients
+}
+
+def run_convert(config):
+    shutil.rmtree(config['raw_dir'], ignore_errors=True)
+    shutil.copytree(config['png_dir'], config['raw_dir'])
+    sys.path.insert(0, AUTODISTILL_DIR)
+    from process import convert_png_to_jpg
+
+    start = time.perf_counter()
+    converted = convert_png_to_jpg(config['raw_dir'])
+    return {'items': converted, 'sec': time.perf_counter() - start}
+
+def run_label(config):
+    output_dir = os.path.join(config['stage_dir'], 'labeled')
+    shutil.rmtree(output_dir, ignore_errors=True)
+    shutil.rmtree(os.path.join(config['stage_dir'], 'checkpoints'), ignore_errors=True)
+    sys.path.insert(0, AUTODISTILL_DIR)
+    import process
+
+    sys.argv = ['process.py', '--input-dir', config['raw_dir'], '--output-dir', output_dir,
+                '--base-model', 'stub', '--no-cache', '--label-workers', str(config['workers'])]
+    start = time.perf_counter()
+    process.main()
+    return {'items': len(glob.glob(os.path.join(config['raw_dir'], '*.jpg'))), 'sec': time.perf_counter() - start}
+
+def run_pack(config):
+    output_dir = os.path.join(config['stage_dir'], 'packed')
+    shutil.rmtree(output_dir, ignore_errors=True)
+    sys.path.insert(0, DATA_DIR)
+    from dataset_utils import pack_yolo_dataset
+
+    start = time.perf_counter()
+    pack_yolo_dataset(config['data_yaml'], output_dir, workers=config['workers'])
+    return {'items': config['size'], 'sec': time.perf_counter() - start}
+
+def run_train_epoch(config):
+    model_dir = os.path.join(config['stage_dir'], 'model')
+    config_dir = os.path.join(config['stage_dir'], 'config')
+    # A leftover run dir would be resumed instead of trained
+    shutil.rmtree(model_dir, ignore_errors=True)
+    os.makedirs(config_dir, exist_ok=True)
+    with open(os.path.join(config_dir, 'hyperparameters.json'), 'w') as f:
+        json.dump({
+            'epochs': 1,
+            'batch-size': config['batch_size'],
+            'img-size': config['img_size'],
+            'export-formats': 'none',
+            'image-cache': 'off',
+            'warm-start': 'off',
+            'autotune': 'off',
+        }, f)
+    os.environ.update({
+        'SM_CHANNEL_TRAINING': config['dataset_dir'],
+        'SM_MODEL_DIR': model_dir,
+        'SM_INPUT_CONFIG_DIR': config_dir,
+        'MLFLOW_TRACKING_URI': 'file:' + os.path.join(config['stage_dir'], 'mlruns'),
+    })
+    # train.py exits when these are missing; report that as skipped instead of failed
+    import mlflow
+    import ultralytics
+    sys.path.insert(0, TRAINING_DIR)
+    import train
+
+    start = time.perf_counter()
+    train.main()
+    sec = time.perf_counter() - start
+    with open(os.path.join(model_dir, 'profile.json'), 'r') as f:
+        profile = json.load(f)
+    epoch = profile['per_epoch'][0]
+    # The epoch itself; model load and artifact copying are in wall_sec
+    return {
+        'items': epoch['images'],
+        'sec': epoch['wall_sec'],
+        'job_sec': sec,
+        'data_wait_pct': epoch['data_wait_pct'],
+    }
+
+def run_inference(config):
+    sys.path.insert(0, INFERENCE_DIR)
+    from inference import InferenceModel, YoloDetector
+
+    paths = sorted(glob.glob(os.path.join(config['dataset_dir'], '*', 'images', '*.jpg')))
+    payloads = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            payloads.append(f.read())
+    model = InferenceModel(YoloDetector(config['weights'], config['img_size']))
+    model.predict_payloads(payloads[:1])  # warm-up
+
+    def timed(payload):
+        start = time.perf_counter()
+        model.predict_payloads([payload])
+        return (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=config['clients']) as pool:
+        latencies = list(pool.map(timed, payloads))
+    sec = time.perf_counter() - start
+    model.batcher.close()
+    return {
+        'items': len(payloads),
+        'sec': sec,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'mean_batch_size': model.stats()['mean_batch_size'],
+    }
+
+STAGE_RUNNERS = {
+    'convert': run_convert,
+    'label': run_label,
+    'pack': run_pack,
+    'train_epoch': run_train_epoch,
+    'inference': run_inference,
+}
+
+def run_stage_child(name, config_path, result_path):
+    """Entry point of the per-stage child process; writes its result JSON"""
+    with open(config_path, 'r') as f:
+        config = json.load(f)
+    try:
+        result = dict(STAGE_RUNNERS[name](config), status='ok')
+    except ImportError as e:
+        result = {'status': 'skipped', 'reason': f"missing dependency: {e}"}
+    except SystemExit as e:
+        # Entry points report failure through sys.exit
+        result = {'status': 'failed', 'reason': f"exited with {e.code}"}
+    with open(result_path, 'w') as f:
+        json.dump(result, f)
+
+def ensure_fixture(fixtures_dir, size, img_size, seed):
+    """Synthetic labeled dataset plus PNG copies of its images, built once per size"""
+    root = os.path.join(fixtures_dir, f"n{size}_px{img_size}_seed{seed}")
+    dataset_dir = os.path.join(root, 'dataset')
+    png_dir = os.path.join(root, 'png')
+    if os.path.exists(os.path.join(root, '.complete')):
+        return dataset_dir, png_dir
+    shutil.rmtree(root, ignore_errors=True)
+    sys.path.insert(0, DATA_DIR)
+    from PIL import Image
+    from synthetic_generator import generate_dataset
+
+    generate_dataset(dataset_dir, size, img_size, seed=seed)
+    os.makedirs(png_dir)
+    for path in glob.glob(os.path.join(dataset_dir, '*', 'images', '*.jpg')):
+        with Image.open(path) as image:
+            image.save(os.path.join(png_dir, os.path.splitext(os.path.basename(path))[0] + '.png'))
+    open(os.path.join(root, '.complete'), 'w').close()
+    return dataset_dir, png_dir
+
+def run_stage(name, config, work_dir):
+    """Run one stage in a fresh child process; wall time and peak RSS come from the parent"""
+    config_path = os.path.join(work_dir, f"{name}.config.json")
+    result_path = os.path.join(work_dir, f"{name}.result.json")
+    log_path = os.path.join(work_dir, f"{name}.log")
+    with open(config_path, 'w') as f:
+        json.dump(config, f)
+    if os.path.exists(result_path):
+        os.remove(result_path)
+
+    start = time.perf_counter()
+    with open(log_path, 'w') as log:
+        process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--run-stage', name, config_path, result_path],
+            stdout=log, stderr=subprocess.STDOUT
+        )
+        # wait4 gives this child's own rusage (ru_maxrss covers its waited-for workers too)
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    wall = time.perf_counter() - start
+
+    if os.path.exists(result_path):
+        with open(result_path, 'r') as f:
+            result = json.load(f)
+    else:
+        with open(log_path, 'r') as f:
+            tail = f.read().strip().splitlines()[-1:] or ['']
+        result = {'status': 'failed', 'reason': f"exit code {process.returncode}: {tail[0]}"}
+    result['wall_sec'] = round(wall, 3)
+    result['peak_rss_mb'] = round(usage.ru_maxrss / 1024, 1)  # KiB on Linux
+    if result['status'] == 'ok':
+        result['sec'] = round(result['sec'], 3)
+        result['items_per_sec'] = round(result['items'] / result['sec'], 3) if result['sec'] else 0.0
+    result['log'] = log_path
+    return result
+
+def host_key():
+    """Runs are only compared against runs on the same kind of machine"""
+    return f"{platform.machine()}-{os.cpu_count()}cpu-py{platform.python_version_tuple()[0]}.{platform.python_version_tuple()[1]}"
+
+def run_settings(args):
+    """Options that change what a stage measures; only runs with the same settings are compared"""
+    return {
+        'img_size': args.img_size,
+        'workers': args.workers,
+        'train_batch_size': args.train_batch_size,
+        'inference_clients': args.inference_clients,
+        'weights': args.weights,
+        'seed': args.seed,
+    }
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r') as f:
+        return json.load(f)['runs']
+
+def save_history(path, runs):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'runs': runs}, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+def find_regressions(results, history, host, settings, baseline_runs, threshold, rss_threshold):
+    """Stages slower or bigger than the median of the last baseline_runs comparable runs
+
+    Comparable means the same host key and the same run_settings.
+    """
+    regressions = []
+    for key, result in results.items():
+        if result['status'] != 'ok':
+            continue
+        previous = [run['results'][key] for run in history
+                    if run['host'] == host and run.get('settings') == settings
+                    and run['results'].get(key, {}).get('status') == 'ok'][-baseline_runs:]
+        if not previous:
+            continue
+        speed = float(np.median([p['items_per_sec'] for p in previous]))
+        rss = float(np.median([p['peak_rss_mb'] for p in previous]))
+        result['baseline_items_per_sec'] = round(speed, 3)
+        result['baseline_peak_rss_mb'] = round(rss, 1)
+        if result['items_per_sec'] < speed * (1 - threshold):
+            regressions.append(f"{key}: {result['items_per_sec']:.1f} items/s vs baseline {speed:.1f} "
+                               f"({result['items_per_sec'] / speed - 1:+.0%})")
+        if result['peak_rss_mb'] > rss * (1 + rss_threshold):
+            regressions.append(f"{key}: peak RSS {result['peak_rss_mb']:.0f} MB vs baseline {rss:.0f} MB "
+                               f"({result['peak_rss_mb'] / rss - 1:+.0%})")
+    return regressions
+
+def main():
+    if len(sys.argv) == 5 and sys.argv[1] == '--run-stage':
+        run_stage_child(*sys.argv[2:])
+        return
+
+    parser = argparse.ArgumentParser(
+        description="Time each pipeline stage on synthetic fixtures (CPU-only) and flag regressions"
+    )
+    parser.add_argument('--sizes', default='64,256', help='Comma-separated dataset sizes (images)')
+    parser.add_argument('--stages', default=','.join(STAGES), help=f"Subset of {', '.join(STAGES)}")
+    parser.add_argument('--img-size', type=int, default=640)
+    parser.add_argument('--train-batch-size', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes for packing/labeling')
+    parser.add_argument('--inference-clients', type=int, default=8, help='Concurrent clients for the inference stage')
+    parser.add_argument('--repeats', type=int, default=1, help='Run each stage this many times and keep the fastest')
+    parser.add_argument('--weights', default='yolov8n.pt',
+                        help='Inference weights when the train_epoch stage is not run')
+    parser.add_argument('--work-dir', default=os.path.join(REPO_ROOT, 'benchmarks', 'work'))
+    parser.add_argument('--history', default=DEFAULT_HISTORY, help='JSON history of benchmark runs')
+    parser.add_argument('--baseline-runs', type=int, default=5, help='Compare against the median of this many runs')
+    parser.add_argument('--threshold', type=float, default=0.15, help='Fail when throughput drops by more than this')
+    parser.add_argument('--rss-threshold', type=float, default=0.25, help='Fail when peak RSS grows by more than this')
+    parser.add_argument('--no-record', action='store_true', help='Compare only; do not append this run to the history')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    stages = [s.strip() for s in args.stages.split(',') if s.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+    stages = [s for s in STAGES if s in stages]
+    host = host_key()
+    settings = run_settings(args)
+    print(f"🏁 Benchmarking {', '.join(stages)} at sizes {sizes} on {host}")
+
+    results = {}
+    for size in sizes:
+        dataset_dir, png_dir = ensure_fixture(os.path.join(args.work_dir, 'fixtures'), size, args.img_size, args.seed)
+        stage_dir = os.path.join(args.work_dir, f"n{size}")
+        os.makedirs(stage_dir, exist_ok=True)
+        config = {
+            'size': size,
+            'img_size': args.img_size,
+            'batch_size': args.train_batch_size,
+            'workers': args.workers,
+            'clients': args.inference_clients,
+            'weights': args.weights,
+            'dataset_dir': dataset_dir,
+            'data_yaml': os.path.join(dataset_dir, 'data.yaml'),
+            'png_dir': png_dir,
+            'raw_dir': os.path.join(stage_dir, 'raw'),
+            'stage_dir': stage_dir,
+        }
+        for name in stages:
+            needs = STAGES[name]
+            if needs and results.get(f"{needs}@{size}", {}).get('status', 'ok') != 'ok':
+                result = {'status': 'skipped', 'reason': f"needs {needs}"}
+            else:
+                runs = [run_stage(name, config, stage_dir) for _ in range(args.repeats)]
+                ok = [run for run in runs if run['status'] == 'ok']
+                # Best of the repeats filters out noise from other load on the box
+                result = max(ok, key=lambda run: run['items_per_sec']) if ok else runs[-1]
+                result['peak_rss_mb'] = max(run['peak_rss_mb'] for run in runs)
+            if name == 'train_epoch' and result['status'] == 'ok':
+                weights = glob.glob(os.path.join(stage_dir, 'model', '**', 'best.pt'), recursive=True)
+                config['weights'] = weights[0] if weights else config['weights']
+            results[f"{name}@{size}"] = result
+            if result['status'] == 'ok':
+                print(f"  ⏱️ {name}@{size}: {result['items_per_sec']:.1f} items/s ({result['sec']:.2f}s, "
+                      f"wall {result['wall_sec']:.1f}s), peak RSS {result['peak_rss_mb']:.0f} MB")
+            else:
+                print(f"  {'⏭️' if result['status'] == 'skipped' else '❌'} {name}@{size}: "
+                      f"{result['status']} ({result['reason']})")
+
+    history = load_history(args.history)
+    regressions = find_regressions(results, history, host, settings, args.baseline_runs, args.threshold,
+                                   args.rss_threshold)
+    failed = [key for key, result in results.items() if result['status'] == 'failed']
+    if not args.no_record:
+        history.append({
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'commit': git_commit(),
+            'host': host,
+            'hostname': socket.gethostname(),
+            'settings': settings,
+            'results': results,
+        })
+        save_history(args.history, history)
+        print(f"📄 Recorded run {len(history)} in {args.history}")
+
+    if failed:
+        print(f"❌ Failed stages: {', '.join(failed)} (see the .log files in {args.work_dir})")
+    if regressions:
+        print(f"📉 {len(regressions)} regression(s) against the last {args.baseline_runs} runs on {host} "
+              f"with the same settings:")
+        for regression in regressions:
+            print(f"  {regression}")
+    if failed or regressions:
+        sys.exit(1)
+    print("✅ No regressions")
+
+if __name__ == "__main__":
+    main()
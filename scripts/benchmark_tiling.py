@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+import os
+import sys
+import glob
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'inference'))
+
+from boxes import box_iou, xywh_to_xyxy
+from inference import load_detector
+from tiling import TiledDetector, detections_to_arrays
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+def load_ground_truth(label_path, width, height):
+    """YOLO label file -> (boxes xyxy in pixels, class ids); polygons use their extent"""
+    boxes, class_ids = [], []
+    if os.path.exists(label_path):
+        with open(label_path, 'r') as f:
+            for line in f:
+                values = line.split()
+                if len(values) < 5:
+                    continue
+                coords = np.array(values[1:], dtype=np.float32)
+                if len(coords) == 4:
+                    box = xywh_to_xyxy(coords[None])[0]
+                else:
+                    xs, ys = coords[0::2], coords[1::2]
+                    box = np.array([xs.min(), ys.min(), xs.max(), ys.max()])
+                boxes.append(box * [width, height, width, height])
+                class_ids.append(int(values[0]))
+    return np.array(boxes, dtype=np.float32).reshape(-1, 4), np.array(class_ids, dtype=np.int64)
+
+def matched_ground_truth(pred_boxes, pred_classes, gt_boxes, gt_classes, iou_threshold):
+    """Number of ground-truth boxes hit by a same-class prediction"""
+    if not len(gt_boxes) or not len(pred_boxes):
+        return 0
+    iou = box_iou(gt_boxes, pred_boxes)
+    iou[gt_classes[:, None] != pred_classes[None, :]] = 0
+    return int((iou.max(axis=1) >= iou_threshold).sum())
+
+def run(detector, images, ground_truth, iou_threshold):
+    """Latency per image and recall over a labeled image set"""
+    latencies = []
+    matched = total = 0
+    for image, (gt_boxes, gt_classes) in zip(images, ground_truth):
+        start = time.perf_counter()
+        result = detector.predict_batch([image])[0]
+        latencies.append(time.perf_counter() - start)
+        boxes, _, class_ids = detections_to_arrays(result)
+        matched += matched_ground_truth(boxes, class_ids, gt_boxes, gt_classes, iou_threshold)
+        total += len(gt_boxes)
+    latencies = np.array(latencies) * 1000
+    return {
+        'recall': matched / total if total else 0.0,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'mean_ms': float(latencies.mean()),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare tiled vs whole-image inference")
+    parser.add_argument('--model-dir', required=True, help='Directory with best.pt and/or best.onnx')
+    parser.add_argument('--dataset', required=True, help='YOLO split directory with images/ and labels/')
+    parser.add_argument('--backend', choices=['auto', 'torch', 'onnx'], default='auto')
+    parser.add_argument('--tile-size', type=int, default=640)
+    parser.add_argument('--overlap', type=float, default=0.2)
+    parser.add_argument('--merge', choices=['nms', 'wbf'], default='wbf')
+    parser.add_argument('--iou', type=float, default=0.5, help='IoU for a ground-truth hit')
+    parser.add_argument('--limit', type=int, default=0)
+    args = parser.parse_args()
+
+    import cv2
+
+    image_paths = sorted(
+        path for path in glob.glob(os.path.join(args.dataset, 'images', '*'))
+        if path.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    if args.limit:
+        image_paths = image_paths[:args.limit]
+    if not image_paths:
+        print(f"❌ No images found in {args.dataset}/images")
+        sys.exit(1)
+
+    print(f"📂 Loading {len(image_paths)} images from {args.dataset}")
+    images, ground_truth = [], []
+    for path in image_paths:
+        image = cv2.imread(path)
+        height, width = image.shape[:2]
+        stem = os.path.splitext(os.path.basename(path))[0]
+        label_path = os.path.join(args.dataset, 'labels', f"{stem}.txt")
+        images.append(image)
+        ground_truth.append(load_ground_truth(label_path, width, height))
+
+    detector = load_detector(args.model_dir, args.backend)
+    tiled = TiledDetector(detector, args.tile_size, args.overlap, merge=args.merge)
+
+    # Warm up both paths so one-time setup doesn't skew latency
+    detector.predict_batch(images[:1])
+    tiled.predict_batch(images[:1])
+
+    results = {
+        'whole-image': run(detector, images, ground_truth, args.iou),
+        f"tiled-{args.tile_size}": run(tiled, images, ground_truth, args.iou),
+    }
+
+    print(f"\n📊 Recall@IoU{args.iou} and latency over {len(images)} images")
+    print(f"{'mode':<16}{'recall':>10}{'p50 ms':>12}{'p95 ms':>12}{'mean ms':>12}")
+    for mode, metrics in results.items():
+        print(f"{mode:<16}{metrics['recall']:>10.3f}{metrics['p50_ms']:>12.1f}"
+              f"{metrics['p95_ms']:>12.1f}{metrics['mean_ms']:>12.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 #!/usr/bin/env python3
+import os
 import subprocess
 import sys
 import boto3
@@ -10,6 +11,9 @@ ECR_INFERENCE_REPO = "564230509626.dkr.ecr.us-east-2.amazonaws.com/hail-damage-5
 AWS_REGION = "us-east-2"
 AWS_ACCOUNT_ID = "564230509626"
 
+# Dockerfiles COPY shared code from src/, so builds use the repo root as context
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
 def run_command(command, description):
     """Run shell command with error handling"""
     print(f"🔧 {description}")
@@ -56,7 +60,10 @@ def build_and_push_container(dockerfile_path, repo_url, container_name):
     
     # Build
     if not run_command([
-        'docker', 'build', '-t', f"{repo_url}:latest", dockerfile_path
+        'docker', 'build',
+        '-f', os.path.join(REPO_ROOT, dockerfile_path, 'Dockerfile'),
+        '-t', f"{repo_url}:latest",
+        REPO_ROOT
     ], f"Building {container_name}"):
         return False
     
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+import os
+import sys
+import glob
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'data'))
+# Labeling writes the mask stores; the self-test runs its output through both conversions
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'docker', 'autodistill'))
+
+from dataset_utils import (MASK_ENCODINGS, MaskStore, masks_to_polygon_labels, polygon_labels_to_masks,
+                           read_yolo_labels)
+
+def time_label_load(dataset_dir):
+    """Seconds to parse every label file in the dataset"""
+    paths = glob.glob(os.path.join(dataset_dir, '*', 'labels', '*.txt'))
+    start = time.perf_counter()
+    for path in paths:
+        read_yolo_labels(path)
+    return time.perf_counter() - start
+
+def _label_rows(dataset_dir):
+    rows = []
+    for path in glob.glob(os.path.join(dataset_dir, '*', 'labels', '*.txt')):
+        with open(path, 'r') as f:
+            rows.extend(line.split() for line in f if line.strip())
+    return rows
+
+def self_test():
+    """Labeled two-contour mask -> polygons -> masks keeps rows and instances 1:1 and the pixels intact"""
+    import shutil
+    import tempfile
+    from types import SimpleNamespace
+
+    import numpy as np
+    from PIL import Image
+
+    from labeling import detections_to_mask_labels, write_yolo_dataset
+
+    height, width = 48, 64
+    mask = np.zeros((height, width), dtype=bool)
+    mask[5:15, 5:20] = True  # one instance, two separate regions
+    mask[30:42, 35:60] = True
+    detections = SimpleNamespace(xyxy=np.array([[5, 5, 60, 42]], np.float32), class_id=np.array([0]),
+                                 mask=mask[None])
+
+    root = tempfile.mkdtemp(prefix='mask-round-trip-')
+    failures = []
+    try:
+        image_path = os.path.join(root, 'roof.jpg')
+        Image.new('RGB', (width, height)).save(image_path)
+        lines, entry = detections_to_mask_labels(detections, width, height)
+        if len(lines) != 1 or len(entry['masks']) != 1:
+            failures.append(f"labeling wrote {len(lines)} box rows for {len(entry['masks'])} stored masks")
+        dataset_dir = os.path.join(root, 'dataset')
+        write_yolo_dataset([(image_path, '0' * 64, lines, entry)], dataset_dir, ['damage'], mask_format='rle')
+
+        masks_to_polygon_labels(dataset_dir)
+        rows = _label_rows(dataset_dir)
+        boxes = [row for row in rows if len(row) <= 5]
+        if boxes or len(rows) != 2:
+            failures.append(f"to-polygons left {len(boxes)} box rows beside {len(rows) - len(boxes)} polygons "
+                            f"(expected 2 polygons only)")
+
+        polygon_labels_to_masks(dataset_dir)
+        rows = _label_rows(dataset_dir)
+        stores = [MaskStore(os.path.dirname(os.path.dirname(path)))
+                  for path in glob.glob(os.path.join(dataset_dir, '*', 'labels', '*.txt'))]
+        instances = [m for store in stores for name in store.names for m in store.masks(name)[1]]
+        if len(rows) != len(instances):
+            failures.append(f"to-masks wrote {len(rows)} box rows for {len(instances)} mask instances")
+        union = np.logical_or.reduce(instances) if instances else np.zeros_like(mask)
+        iou = (union & mask).sum() / max((union | mask).sum(), 1)
+        if iou < 0.95:
+            failures.append(f"round-tripped mask IoU {iou:.3f} < 0.95")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    for failure in failures:
+        print(f"❌ {failure}")
+    if failures:
+        return 1
+    print("✅ Two-contour mask round-tripped through polygons with box rows matching mask instances")
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert Autodistill polygon labels to and from mask stores")
+    parser.add_argument('direction', choices=['to-masks', 'to-polygons', 'self-test'])
+    parser.add_argument('dataset_dir', nargs='?', help='Dataset with train/ and valid/ splits (rewritten in place)')
+    parser.add_argument('--encoding', choices=MASK_ENCODINGS, default='rle')
+    parser.add_argument('--min-area', type=float, default=0, help='to-polygons: drop contours smaller than this (px)')
+    args = parser.parse_args()
+
+    if args.direction == 'self-test':
+        sys.exit(self_test())
+    if not args.dataset_dir:
+        parser.error(f"{args.direction} needs a dataset_dir")
+    before = time_label_load(args.dataset_dir)
+    start = time.perf_counter()
+    if args.direction == 'to-masks':
+        summary = polygon_labels_to_masks(args.dataset_dir, args.encoding)
+        for split, (instances, old_bytes, new_bytes) in summary.items():
+            print(f"🎭 {split}: {instances} masks, labels {old_bytes / 1e6:.1f} MB -> "
+                  f"{new_bytes / 1e6:.1f} MB with the {args.encoding} store ({old_bytes / max(new_bytes, 1):.1f}x)")
+    else:
+        summary = masks_to_polygon_labels(args.dataset_dir, args.min_area)
+        for split, instances in summary.items():
+            print(f"✏️ {split}: {instances} masks traced back to polygon labels")
+    after = time_label_load(args.dataset_dir)
+    print(f"✅ Converted in {time.perf_counter() - start:.1f}s; label parse {before:.2f}s -> {after:.2f}s")
+
+if __name__ == "__main__":
+    main()
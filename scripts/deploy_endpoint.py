@@ -1,13 +1,46 @@
 #!/usr/bin/env python3
+import os
 import argparse
+import tarfile
+import tempfile
 import boto3
 import time
 
+PYTORCH_INFERENCE_IMAGE = '763104351884.dkr.ecr.us-east-2.amazonaws.com/pytorch-inference:2.0.1-gpu-py310'
+PYTORCH_CPU_INFERENCE_IMAGE = '763104351884.dkr.ecr.us-east-2.amazonaws.com/pytorch-inference:2.0.1-cpu-py310'
+INFERENCE_SOURCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'inference')
+
+def upload_inference_code(bucket, prefix):
+    """Package src/inference as sourcedir.tar.gz and upload it to S3"""
+    key = f"{prefix}/code/sourcedir.tar.gz"
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        archive = os.path.join(tmp_dir, 'sourcedir.tar.gz')
+        with tarfile.open(archive, 'w:gz') as tar:
+            for name in sorted(os.listdir(INFERENCE_SOURCE_DIR)):
+                if name.endswith('.py') or name == 'requirements.txt':
+                    tar.add(os.path.join(INFERENCE_SOURCE_DIR, name), arcname=name)
+        boto3.client('s3').upload_file(archive, bucket, key)
+    return f"s3://{bucket}/{key}"
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--role', required=True)
     parser.add_argument('--bucket', required=True)
     parser.add_argument('--model-prefix', required=True)
+    parser.add_argument('--image-uri', default=None,
+                        help='Serving image built from src/inference (default: stock PyTorch container)')
+    parser.add_argument('--instance-type', default='ml.g4dn.xlarge',
+                        help='e.g. ml.c5.xlarge to serve the INT8 ONNX model on CPU')
+    parser.add_argument('--backend', choices=['auto', 'torch', 'onnx'], default='auto',
+                        help='auto = PyTorch on GPU instances, ONNX Runtime on CPU')
+    parser.add_argument('--tile-size', type=int, default=0,
+                        help='Tiled full-resolution inference tile size (0 = whole image)')
+    parser.add_argument('--max-batch-size', type=int, default=8)
+    parser.add_argument('--max-batch-wait-ms', type=float, default=10)
+    parser.add_argument('--cache', choices=['memory', 'redis', 'off'], default='memory',
+                        help='Response cache for resubmitted photos (redis = shared via CACHE_REDIS_URL)')
+    parser.add_argument('--cache-phash-threshold', type=int, default=0,
+                        help='Also reuse results for near-duplicate photos within this many pHash bits (0 = off)')
     args = parser.parse_args()
     
     print("🏗️ Setting up model deployment...")
@@ -21,14 +54,36 @@ def main():
     endpoint_config_name = f"hail-damage-config-{timestamp}"
     endpoint_name = f"hail-damage-endpoint-{timestamp}"
     
+    environment = {
+        'MAX_BATCH_SIZE': str(args.max_batch_size),
+        'MAX_BATCH_WAIT_MS': str(args.max_batch_wait_ms),
+        'INFERENCE_BACKEND': args.backend,
+        'TILE_SIZE': str(args.tile_size),
+        'CACHE_BACKEND': args.cache,
+        'CACHE_PHASH_THRESHOLD': str(args.cache_phash_threshold),
+    }
+    gpu_instance = args.instance_type.split('.')[1].startswith(('g', 'p'))
+    if args.image_uri:
+        image = args.image_uri
+    else:
+        # The stock container loads our model_fn/input_fn/predict_fn/output_fn
+        image = PYTORCH_INFERENCE_IMAGE if gpu_instance else PYTORCH_CPU_INFERENCE_IMAGE
+        code_uri = upload_inference_code(args.bucket, args.model_prefix)
+        print(f"📤 Uploaded inference code: {code_uri}")
+        environment.update({
+            'SAGEMAKER_PROGRAM': 'inference.py',
+            'SAGEMAKER_SUBMIT_DIRECTORY': code_uri,
+        })
+    
     # Create model
     print(f"📦 Creating model: {model_name}")
     sm.create_model(
         ModelName=model_name,
         ExecutionRoleArn=args.role,
         PrimaryContainer={
-            'Image': '763104351884.dkr.ecr.us-east-2.amazonaws.com/pytorch-inference:2.0.1-gpu-py310',
-            'ModelDataUrl': f's3://{args.bucket}/{args.model_prefix}/output/model.tar.gz'
+            'Image': image,
+            'ModelDataUrl': f's3://{args.bucket}/{args.model_prefix}/output/model.tar.gz',
+            'Environment': environment
         }
     )
     
@@ -40,7 +95,7 @@ def main():
             'VariantName': 'AllTraffic',
             'ModelName': model_name,
             'InitialInstanceCount': 1,
-            'InstanceType': 'ml.g4dn.xlarge'
+            'InstanceType': args.instance_type
         }]
     )
     
@@ -57,6 +112,7 @@ def main():
     
     print(f"✅ Endpoint deployed successfully: {endpoint_name}")
     print(f"🔗 Use this endpoint name for inference: {endpoint_name}")
+    print(f"📈 Size it with: python scripts/load_test.py --endpoint-name {endpoint_name} --images <dir> --pattern ramp")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'data'))
+
+from dataset_utils import (evaluate_detections, load_data_yaml, load_prediction_jsonl,
+                           load_yolo_detections)
+
+def load_predictions(path, images, workers):
+    """A YOLO predict labels/ dir (save_conf) or a batch_inference.py JSONL file"""
+    if os.path.isdir(path):
+        return load_yolo_detections(path, images, predictions=True, workers=workers)
+    return load_prediction_jsonl(path)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Score predictions or auto-labels against a hand-labeled YOLO set (mAP50, mAP50-95)"
+    )
+    parser.add_argument('--gt', required=True, help='Ground-truth YOLO labels directory (the audit set)')
+    parser.add_argument('--pred', required=True, action='append',
+                        help='Predictions: YOLO labels dir (conf column optional) or batch_inference JSONL; repeat to compare')
+    parser.add_argument('--data', default=None, help='data.yaml for class names')
+    parser.add_argument('--conf', type=float, default=0.25, help='Score threshold for precision/recall and per-image counts')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Processes for matching')
+    parser.add_argument('--worst', type=int, default=10, help='Print the images with the most errors')
+    parser.add_argument('--output', default=None, help='Write the full report(s) as JSON')
+    args = parser.parse_args()
+
+    names = load_data_yaml(args.data)[0]['names'] if args.data else None
+    start = time.perf_counter()
+    gt = load_yolo_detections(args.gt, workers=args.workers)
+    print(f"📂 Ground truth: {len(gt['images'])} images, {len(gt['class'])} boxes ({time.perf_counter() - start:.1f}s)")
+
+    reports = {}
+    for path in args.pred:
+        start = time.perf_counter()
+        pred = load_predictions(path, gt['images'], args.workers)
+        report = evaluate_detections(gt, pred, names=names, conf=args.conf, workers=args.workers)
+        reports[path] = report
+        print(f"\n📊 {path} ({time.perf_counter() - start:.1f}s)")
+        print(f"  mAP50 {report['mAP50']:.4f}  mAP50-95 {report['mAP50-95']:.4f}  "
+              f"P {report['precision']:.3f}  R {report['recall']:.3f}  ({report['predictions']} predictions)")
+        for c in report['per_class']:
+            if c['instances']:
+                print(f"  {c['name']:>20}: {c['instances']:6d} boxes  AP50 {c['AP50']:.4f}  AP50-95 {c['AP50-95']:.4f}  "
+                      f"P {c['precision']:.3f}  R {c['recall']:.3f}")
+        worst = sorted(report['per_image'], key=lambda r: r['fp'] + r['fn'], reverse=True)[:args.worst]
+        worst = [r for r in worst if r['fp'] + r['fn']]
+        if worst:
+            print(f"  Most errors @ conf {args.conf}:")
+            for r in worst:
+                print(f"    {r['image']}: {r['fn']} missed, {r['fp']} false positives ({r['instances']} boxes)")
+
+    if len(reports) > 1:
+        print("\n⚖️ Comparison:")
+        for path, report in reports.items():
+            print(f"  {report['mAP50-95']:.4f} mAP50-95  {report['mAP50']:.4f} mAP50  {path}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(reports, f, indent=2)
+        print(f"📄 Report: {args.output}")
+
+if __name__ == "__main__":
+    main()
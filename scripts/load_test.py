@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import base64
+import asyncio
+import argparse
+import subprocess
+import urllib.parse
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'inference'))
+
+from batch_inference import list_images
+from inference import TIMING_HEADER, TIMING_STAGES, parse_timing
+
+INFERENCE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'inference', 'inference.py')
+CONTENT_TYPES = {'.png': 'image/png', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg'}
+PATTERNS = ('constant', 'ramp', 'burst', 'closed')
+PERCENTILES = (50, 90, 95, 99, 99.9)
+# Latency histogram bucket upper edges (ms); the last bucket is open-ended
+HISTOGRAM_EDGES_MS = (5, 10, 20, 50, 100, 200, 350, 500, 750, 1000, 2000, 5000, 10000)
+
+def load_requests(image_dir, limit, images_per_request):
+    """(body, content type) pairs held in memory so disk reads don't skew timings"""
+    paths = list_images(image_dir)[:limit or None]
+    if not paths:
+        raise FileNotFoundError(f"No images found in {image_dir}")
+    blobs = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            blobs.append((f.read(), CONTENT_TYPES.get(os.path.splitext(path)[1].lower(), 'application/x-image')))
+    if images_per_request == 1:
+        return blobs
+    requests = []
+    for start in range(0, len(blobs), images_per_request):
+        group = [data for data, _ in blobs[start:start + images_per_request]]
+        body = json.dumps({'images': [base64.b64encode(data).decode() for data in group]}).encode()
+        requests.append((body, 'application/json'))
+    return requests
+
+def arrival_times(pattern, rate, duration, peak_rate=None, burst_every=30.0, burst_length=5.0,
+                  poisson=False, seed=0):
+    """Request send offsets (seconds) for an open-loop arrival pattern
+
+    constant holds rate, ramp climbs linearly from rate to peak_rate over
+    the run, and burst holds rate with peak_rate for burst_length seconds
+    out of every burst_every. Arrivals are the points where the integrated
+    rate crosses each whole request. With poisson they are spread by
+    exponential gaps instead, which is closer to independent clients.
+    """
+    peak_rate = peak_rate if peak_rate is not None else rate
+    t = np.arange(0.0, duration, 0.001)
+    if pattern == 'constant':
+        rates = np.full_like(t, rate)
+    elif pattern == 'ramp':
+        rates = rate + (peak_rate - rate) * t / duration
+    elif pattern == 'burst':
+        rates = np.where(t % burst_every < burst_length, peak_rate, rate)
+    else:
+        raise ValueError(f"Unknown arrival pattern: {pattern}")
+    cumulative = np.concatenate([[0.0], np.cumsum(rates * 0.001)])
+    t = np.append(t, duration)
+    if poisson:
+        rng = np.random.default_rng(seed)
+        counts = np.cumsum(rng.exponential(1.0, int(cumulative[-1] * 1.5) + 16))
+        counts = counts[counts < cumulative[-1]]
+    else:
+        counts = np.arange(0.5, cumulative[-1])
+    return np.interp(counts, cumulative, t)
+
+class HttpClient:
+    """Keep-alive HTTP/1.1 client for a local `inference.py serve` (or any /invocations server)"""
+
+    def __init__(self, url):
+        parsed = urllib.parse.urlparse(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.path = parsed.path if parsed.path not in ('', '/') else '/invocations'
+        self.idle = []
+
+    async def _request(self, reader, writer, body, content_type):
+        head = (f"POST {self.path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+                f"Content-Type: {content_type}\r\nAccept: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n\r\n")
+        writer.write(head.encode() + body)
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode().partition(':')
+            headers[name.strip().lower()] = value.strip()
+        data = await reader.readexactly(int(headers.get('content-length', 0)))
+        return status, headers, data
+
+    async def invoke(self, body, content_type):
+        """(HTTP status, server stage timings, error or None)"""
+        reader, writer = self.idle.pop() if self.idle else await asyncio.open_connection(self.host, self.port)
+        try:
+            status, headers, data = await self._request(reader, writer, body, content_type)
+        except BaseException:
+            writer.close()
+            raise
+        self.idle.append((reader, writer))
+        error = None if status == 200 else f"HTTP {status}"
+        return status, parse_timing(headers.get(TIMING_HEADER.lower())), error
+
+    async def ping(self):
+        """/ping stats (batcher and cache counters) from the server"""
+        url = f"http://{self.host}:{self.port}/ping"
+        loop = asyncio.get_event_loop()
+        raw = await loop.run_in_executor(None, lambda: urllib.request.urlopen(url, timeout=10).read())
+        return json.loads(raw)
+
+    def close(self):
+        for _, writer in self.idle:
+            writer.close()
+
+class SageMakerClient:
+    """invoke_endpoint calls on a thread pool (boto3 is blocking)
+
+    Retries are off so throttling and model errors show up in the error
+    rate instead of as inflated latency. Stage timings come back through
+    CustomAttributes, which only our serving image sets.
+    """
+
+    def __init__(self, endpoint_name, region, concurrency):
+        import boto3
+        from botocore.config import Config
+
+        self.endpoint_name = endpoint_name
+        config = Config(max_pool_connections=concurrency, retries={'max_attempts': 1, 'mode': 'standard'})
+        self.client = boto3.client('sagemaker-runtime', region_name=region, config=config)
+        self.pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='invoke')
+
+    def _invoke(self, body, content_type):
+        from botocore.exceptions import ClientError
+
+        try:
+            response = self.client.invoke_endpoint(
+                EndpointName=self.endpoint_name,
+                ContentType=content_type,
+                Accept='application/json',
+                Body=body
+            )
+        except ClientError as e:
+            status = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+            return status, {}, e.response.get('Error', {}).get('Code', 'ClientError')
+        response['Body'].read()
+        return 200, parse_timing(response.get('CustomAttributes')), None
+
+    async def invoke(self, body, content_type):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.pool, self._invoke, body, content_type)
+
+    async def ping(self):
+        return None
+
+    def close(self):
+        self.pool.shutdown(wait=False)
+
+async def send(client, body, content_type, timeout):
+    """One request -> (status, stage timings, error); exceptions become errors"""
+    try:
+        return await asyncio.wait_for(client.invoke(body, content_type), timeout)
+    except asyncio.TimeoutError:
+        return 0, {}, 'timeout'
+    except Exception as e:
+        return 0, {}, type(e).__name__
+
+async def run_open_loop(client, requests, arrivals, concurrency, timeout):
+    """Send on the arrival schedule whatever the responses do
+
+    Latency is measured from the scheduled send time. When all
+    concurrency slots are busy, the wait for a slot counts against the
+    request, so an overloaded endpoint can't hide its backlog.
+    """
+    loop = asyncio.get_event_loop()
+    slots = asyncio.Semaphore(concurrency)
+    records = []
+    start = loop.time()
+
+    async def one(index, offset):
+        async with slots:
+            sent = loop.time() - start
+            status, timing, error = await send(client, *requests[index % len(requests)], timeout)
+        done = loop.time() - start
+        records.append({
+            'scheduled': offset,
+            'latency_ms': (done - offset) * 1000,
+            'service_ms': (done - sent) * 1000,
+            'status': status,
+            'error': error,
+            'timing': timing,
+        })
+
+    tasks = []
+    for index, offset in enumerate(arrivals):
+        delay = start + offset - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(one(index, offset)))
+    await asyncio.gather(*tasks)
+    return records, loop.time() - start
+
+async def run_closed_loop(client, requests, concurrency, duration, timeout):
+    """concurrency workers sending back to back for duration seconds (max throughput)"""
+    loop = asyncio.get_event_loop()
+    records = []
+    start = loop.time()
+    counter = iter(range(1 << 62))
+
+    async def worker():
+        while loop.time() - start < duration:
+            sent = loop.time() - start
+            status, timing, error = await send(client, *requests[next(counter) % len(requests)], timeout)
+            elapsed = (loop.time() - start - sent) * 1000
+            records.append({
+                'scheduled': sent,
+                'latency_ms': elapsed,
+                'service_ms': elapsed,
+                'status': status,
+                'error': error,
+                'timing': timing,
+            })
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return records, loop.time() - start
+
+def percentiles(values):
+    if not len(values):
+        return {}
+    values = np.asarray(values)
+    stats = {f"p{p:g}": round(float(np.percentile(values, p)), 2) for p in PERCENTILES}
+    stats.update({'mean': round(float(values.mean()), 2), 'max': round(float(values.max()), 2)})
+    return stats
+
+def histogram(values):
+    counts = np.bincount(np.searchsorted(HISTOGRAM_EDGES_MS, values), minlength=len(HISTOGRAM_EDGES_MS) + 1)
+    labels = [f"<={edge}" for edge in HISTOGRAM_EDGES_MS] + [f">{HISTOGRAM_EDGES_MS[-1]}"]
+    return dict(zip(labels, counts.tolist()))
+
+def timeline(records, slo_ms):
+    """Per-second offered load, goodput, errors and p99 by scheduled time"""
+    seconds = {}
+    for r in records:
+        seconds.setdefault(int(r['scheduled']), []).append(r)
+    rows = []
+    for second in sorted(seconds):
+        window = seconds[second]
+        ok = [r['latency_ms'] for r in window if r['error'] is None]
+        p99 = float(np.percentile(ok, 99)) if ok else None
+        errors = len(window) - len(ok)
+        rows.append({
+            'second': second,
+            'offered': len(window),
+            'ok': len(ok),
+            'errors': errors,
+            'p99_ms': round(p99, 2) if p99 is not None else None,
+            'within_slo': not errors and p99 is not None and p99 <= slo_ms,
+        })
+    return rows
+
+def summarize(records, wall, slo_ms):
+    ok = [r for r in records if r['error'] is None]
+    latencies = [r['latency_ms'] for r in ok]
+    stages = {}
+    for stage in TIMING_STAGES:
+        values = [r['timing'][stage] for r in ok if stage in r['timing']]
+        if values:
+            stages[stage] = percentiles(values)
+    # Time outside the model server: network, TLS and the SageMaker front end
+    overhead = [r['service_ms'] - r['timing']['total'] for r in ok if 'total' in r['timing']]
+    if overhead:
+        stages['outside_server'] = percentiles(overhead)
+    rows = timeline(records, slo_ms)
+    sustained = [row['offered'] for row in rows if row['within_slo']]
+    return {
+        'requests': len(records),
+        'ok': len(ok),
+        'errors': len(records) - len(ok),
+        'error_rate': round((len(records) - len(ok)) / len(records), 4) if records else 0.0,
+        'errors_by_kind': dict(Counter(r['error'] for r in records if r['error'] is not None)),
+        'wall_sec': round(wall, 2),
+        'throughput_rps': round(len(ok) / wall, 2) if wall else 0.0,
+        'latency_ms': percentiles(latencies),
+        'service_ms': percentiles([r['service_ms'] for r in ok]),
+        'histogram_ms': histogram(latencies),
+        'stages_ms': stages,
+        'slo_ms': slo_ms,
+        'max_rps_within_slo': max(sustained) if sustained else 0,
+        'timeline': rows,
+    }
+
+def print_report(report):
+    print(f"\n📊 {report['requests']} requests in {report['wall_sec']:.1f}s: "
+          f"{report['throughput_rps']:.1f} req/s ok, error rate {report['error_rate']:.2%}")
+    for kind, count in report['errors_by_kind'].items():
+        print(f"  ❌ {kind}: {count}")
+    latency = report['latency_ms']
+    if latency:
+        print("  Latency (ms): " + '  '.join(f"{key} {value:.1f}" for key, value in latency.items()))
+        widest = max(report['histogram_ms'].values()) or 1
+        for label, count in report['histogram_ms'].items():
+            print(f"  {label:>8} ms {'█' * round(40 * count / widest):<40} {count}")
+    if report['stages_ms']:
+        print("  Stages (ms):        p50      p99     mean")
+        for stage, stats in report['stages_ms'].items():
+            print(f"  {stage:>14}  {stats['p50']:8.1f} {stats['p99']:8.1f} {stats['mean']:8.1f}")
+    else:
+        print("  ⚠️ No stage timings in responses (the stock container doesn't send them; use our serving image)")
+    print(f"  Highest 1s offered load with p99 <= {report['slo_ms']:.0f}ms and no errors: "
+          f"{report['max_rps_within_slo']} req/s")
+
+def wait_for_server(url, process, timeout=600):
+    ping = urllib.parse.urljoin(url, '/ping')
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("Local inference server exited during startup")
+        try:
+            urllib.request.urlopen(ping, timeout=2)
+            return
+        except OSError:
+            time.sleep(1)
+    raise TimeoutError(f"Local inference server not ready after {timeout}s")
+
+async def run(args, requests):
+    if args.endpoint_name:
+        client = SageMakerClient(args.endpoint_name, args.region, args.concurrency)
+    else:
+        client = HttpClient(args.url)
+    try:
+        for index in range(args.warmup):
+            await send(client, *requests[index % len(requests)], args.timeout)
+        before = await client.ping()
+        if args.pattern == 'closed':
+            records, wall = await run_closed_loop(client, requests, args.concurrency, args.duration, args.timeout)
+        else:
+            arrivals = arrival_times(args.pattern, args.rate, args.duration, args.peak_rate,
+                                     args.burst_every, args.burst_length, args.poisson, args.seed)
+            print(f"📈 {len(arrivals)} requests over {args.duration:.0f}s ({args.pattern}), "
+                  f"at most {args.concurrency} in flight")
+            records, wall = await run_open_loop(client, requests, arrivals, args.concurrency, args.timeout)
+        after = await client.ping()
+    finally:
+        client.close()
+    return records, wall, before, after
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay images against the detector endpoint and profile latency")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--endpoint-name', help='SageMaker endpoint (runtime API)')
+    target.add_argument('--url', help='Local server, e.g. http://localhost:8080 (from `inference.py serve`)')
+    target.add_argument('--serve-model-dir', help='Start `inference.py serve` on this model dir and test it')
+    parser.add_argument('--images', required=True, help='Image directory or manifest to replay (cycled)')
+    parser.add_argument('--limit', type=int, default=500, help='Images loaded into memory (0 = all)')
+    parser.add_argument('--images-per-request', type=int, default=1, help='>1 sends JSON batches of base64 images')
+    parser.add_argument('--pattern', choices=PATTERNS, default='constant',
+                        help='Arrival pattern; closed = --concurrency clients back to back')
+    parser.add_argument('--rate', type=float, default=5.0, help='Requests/s (ramp: start rate; burst: base rate)')
+    parser.add_argument('--peak-rate', type=float, default=None, help='Ramp end rate / burst rate')
+    parser.add_argument('--burst-every', type=float, default=30.0, help='Seconds between burst starts')
+    parser.add_argument('--burst-length', type=float, default=5.0, help='Seconds each burst lasts')
+    parser.add_argument('--poisson', action='store_true', help='Exponential inter-arrival gaps instead of even spacing')
+    parser.add_argument('--duration', type=float, default=60.0, help='Seconds of load')
+    parser.add_argument('--concurrency', type=int, default=32, help='Max requests in flight')
+    parser.add_argument('--timeout', type=float, default=60.0, help='Per-request timeout (s)')
+    parser.add_argument('--warmup', type=int, default=5, help='Requests sent before measuring')
+    parser.add_argument('--slo-ms', type=float, default=1000.0, help='p99 target for the sustainable-load estimate')
+    parser.add_argument('--region', default='us-east-2')
+    parser.add_argument('--port', type=int, default=8080, help='Port for --serve-model-dir')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='Write the full report as JSON')
+    args = parser.parse_args()
+
+    requests = load_requests(args.images, args.limit, args.images_per_request)
+    print(f"📂 {len(requests)} request bodies from {args.images} "
+          f"({sum(len(body) for body, _ in requests) / len(requests) / 1e3:.0f} KB avg)")
+
+    server = None
+    if args.serve_model_dir:
+        args.url = f"http://127.0.0.1:{args.port}"
+        server = subprocess.Popen([sys.executable, INFERENCE_SCRIPT, 'serve', '--model-dir', args.serve_model_dir,
+                                   '--host', '127.0.0.1', '--port', str(args.port)])
+        print(f"🚀 Starting local inference server on {args.url}")
+    try:
+        if server:
+            wait_for_server(args.url, server)
+        records, wall, before, after = asyncio.get_event_loop().run_until_complete(run(args, requests))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    report = summarize(records, wall, args.slo_ms)
+    report['config'] = {key: value for key, value in vars(args).items() if key != 'output'}
+    if after:
+        batches = after['batches'] - before['batches']
+        report['server'] = {
+            'batches': batches,
+            'mean_batch_size': round((after['items'] - before['items']) / batches, 2) if batches else 0.0,
+            'cache': after.get('cache'),
+        }
+        print(f"🧮 Server formed {batches} batches, mean size {report['server']['mean_batch_size']}")
+    print_report(report)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"📄 Report: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+STAGE_MANIFEST = '_stage.json'
+IGNORED_NAMES = ('__pycache__', '.DS_Store')
+
+def hash_file(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def hash_paths(paths):
+    """Content hash of files and directory trees (names and bytes)"""
+    digest = hashlib.sha256()
+    for root_path in sorted(paths):
+        if os.path.isfile(root_path):
+            files = [root_path]
+        else:
+            files = []
+            for root, dirs, names in os.walk(root_path):
+                dirs[:] = sorted(d for d in dirs if d not in IGNORED_NAMES)
+                files.extend(os.path.join(root, n) for n in sorted(names) if n not in IGNORED_NAMES)
+        for path in files:
+            digest.update(os.path.relpath(path, os.path.dirname(root_path)).encode())
+            digest.update(hash_file(path).encode())
+    return digest.hexdigest()
+
+class Stage:
+    """One pipeline step
+    
+    run(ctx) writes the stage's artifact into ctx.output. The stage key
+    covers its code files, source inputs, params and upstream keys, so
+    any change to them reruns the stage and everything downstream.
+    """
+    
+    def __init__(self, name, run, deps=(), code=(), inputs=(), params=None):
+        self.name = name
+        self.run = run
+        self.deps = list(deps)
+        self.code = list(code)
+        self.inputs = list(inputs)
+        self.params = params or {}
+    
+    def key(self, dep_keys):
+        payload = {
+            'stage': self.name,
+            'code': hash_paths(self.code) if self.code else None,
+            'inputs': hash_paths(self.inputs) if self.inputs else None,
+            'params': self.params,
+            'deps': {dep: dep_keys[dep] for dep in self.deps},
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()[:16]
+
+class StageContext:
+    def __init__(self, stage, key, output, work, artifacts):
+        self.stage = stage
+        self.key = key
+        self.output = output
+        self.work = work
+        self.params = stage.params
+        # {dep name: artifact dir}
+        self.inputs = {dep: artifacts[dep] for dep in stage.deps}
+        self.meta = {}
+
+class ArtifactStore:
+    """Stage outputs on disk at <root>/<stage>/<key>/
+    
+    An artifact only counts once its _stage.json exists; outputs are built
+    in a scratch directory and renamed into place, so an interrupted run
+    never leaves a half-written artifact that later runs would reuse.
+    """
+    
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+    
+    def path(self, stage, key):
+        return os.path.join(self.root, stage, key)
+    
+    def lookup(self, stage, key):
+        manifest = os.path.join(self.path(stage, key), STAGE_MANIFEST)
+        if not os.path.exists(manifest):
+            return None
+        with open(manifest, 'r') as f:
+            return json.load(f)
+    
+    def scratch(self, stage, key):
+        path = os.path.join(self.root, '.scratch', f"{stage}-{key}-{os.getpid()}")
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(os.path.join(path, 'output'))
+        os.makedirs(os.path.join(path, 'work'))
+        return path
+    
+    def commit(self, stage, key, scratch, manifest):
+        output = os.path.join(scratch, 'output')
+        with open(os.path.join(output, STAGE_MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=2)
+        final = self.path(stage, key)
+        os.makedirs(os.path.dirname(final), exist_ok=True)
+        shutil.rmtree(final, ignore_errors=True)
+        os.replace(output, final)
+        shutil.rmtree(scratch, ignore_errors=True)
+        return final
+
+class Pipeline:
+    """Runs stages as a DAG, skipping any stage whose key already has an artifact
+    
+    Stages whose dependencies are all done run concurrently, up to
+    max_workers at a time.
+    """
+    
+    def __init__(self, stages, store, max_workers=2):
+        self.stages = {stage.name: stage for stage in stages}
+        self.store = store
+        self.max_workers = max_workers
+        self.order = self._topological_order()
+        self._print_lock = threading.Lock()
+    
+    def _topological_order(self):
+        order, state = [], {}
+        
+        def visit(name, path):
+            if state.get(name) == 'done':
+                return
+            if state.get(name) == 'visiting':
+                raise ValueError(f"Pipeline cycle: {' -> '.join(path + [name])}")
+            if name not in self.stages:
+                raise ValueError(f"Unknown stage '{name}' (needed by {path[-1] if path else '?'})")
+            state[name] = 'visiting'
+            for dep in self.stages[name].deps:
+                visit(dep, path + [name])
+            state[name] = 'done'
+            order.append(name)
+        
+        for name in self.stages:
+            visit(name, [])
+        return order
+    
+    def _upstream(self, targets):
+        needed = set()
+        pending = list(targets)
+        while pending:
+            name = pending.pop()
+            if name not in needed:
+                needed.add(name)
+                pending.extend(self.stages[name].deps)
+        return [name for name in self.order if name in needed]
+    
+    def _log(self, message):
+        with self._print_lock:
+            print(message, flush=True)
+    
+    def _execute(self, stage, key, artifacts):
+        scratch = self.store.scratch(stage.name, key)
+        ctx = StageContext(stage, key, os.path.join(scratch, 'output'), os.path.join(scratch, 'work'), artifacts)
+        start = time.perf_counter()
+        stage.run(ctx)
+        elapsed = time.perf_counter() - start
+        manifest = {
+            'stage': stage.name,
+            'key': key,
+            'params': stage.params,
+            'deps': {dep: os.path.basename(artifacts[dep]) for dep in stage.deps},
+            'seconds': round(elapsed, 2),
+            'finished_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'meta': ctx.meta,
+        }
+        return self.store.commit(stage.name, key, scratch, manifest), elapsed
+    
+    def run(self, targets=None, force=()):
+        """Run targets (default: every stage) and their upstream stages"""
+        names = self._upstream(targets or list(self.stages))
+        keys, artifacts, report = {}, {}, {}
+        remaining = list(names)
+        running = {}
+        failed = None
+        start = time.perf_counter()
+        
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while remaining or running:
+                # Launch (or skip) every stage whose dependencies are done
+                for name in list(remaining):
+                    stage = self.stages[name]
+                    if failed or not all(dep in artifacts for dep in stage.deps):
+                        continue
+                    remaining.remove(name)
+                    keys[name] = stage.key(keys)
+                    cached = self.store.lookup(name, keys[name])
+                    if cached is not None and name not in force:
+                        artifacts[name] = self.store.path(name, keys[name])
+                        report[name] = ('cached', cached.get('seconds', 0))
+                        self._log(f"⏭️ {name}: cached ({keys[name]}), saved ~{cached.get('seconds', 0):.0f}s")
+                        continue
+                    self._log(f"▶️ {name}: running ({keys[name]})")
+                    running[pool.submit(self._execute, stage, keys[name], dict(artifacts))] = name
+                
+                if not running:
+                    if remaining and not failed:
+                        raise RuntimeError(f"Pipeline stalled with pending stages: {remaining}")
+                    break
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        artifacts[name], elapsed = future.result()
+                    except Exception as e:
+                        failed = failed or name
+                        report[name] = ('failed', 0)
+                        self._log(f"❌ {name}: {e}")
+                        continue
+                    report[name] = ('ran', elapsed)
+                    self._log(f"✅ {name}: {elapsed:.1f}s -> {artifacts[name]}")
+        
+        for name in remaining:
+            report[name] = ('skipped', 0)
+        self._print_report(names, keys, report, time.perf_counter() - start)
+        if failed:
+            raise RuntimeError(f"Stage '{failed}' failed")
+        return artifacts
+    
+    def _print_report(self, names, keys, report, total):
+        print(f"\n📊 Pipeline summary ({total:.1f}s wall clock)")
+        print(f"{'stage':<12}{'status':<10}{'key':<18}{'seconds':>10}")
+        for name in names:
+            status, seconds = report.get(name, ('skipped', 0))
+            print(f"{name:<12}{status:<10}{keys.get(name, '-'):<18}{seconds:>10.1f}")
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+import os
+import sys
+import glob
+import json
+import shutil
+import argparse
+import subprocess
+
+from pipeline import ArtifactStore, Pipeline, Stage
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+AUTODISTILL_DIR = os.path.join(REPO_ROOT, 'docker', 'autodistill')
+TRAINING_DIR = os.path.join(REPO_ROOT, 'docker', 'training')
+DATA_DIR = os.path.join(REPO_ROOT, 'src', 'data')
+INFERENCE_DIR = os.path.join(REPO_ROOT, 'src', 'inference')
+SCRIPTS_DIR = os.path.join(REPO_ROOT, 'scripts')
+
+# Code each stage's key covers; editing any of these files reruns that stage
+LABEL_CODE = [
+    os.path.join(AUTODISTILL_DIR, name)
+    for name in ('process.py', 'labeling.py', 'dedup.py', 'self_distill.py')
+] + [os.path.join(DATA_DIR, 'dataset_utils.py')]
+PACK_CODE = [os.path.join(DATA_DIR, 'dataset_utils.py')]
+TRAIN_CODE = [
+    os.path.join(TRAINING_DIR, name)
+    for name in ('train.py', 'packed_dataset.py', 'image_cache.py', 'export.py')
+] + [os.path.join(DATA_DIR, 'dataset_utils.py')]
+EXPORT_CODE = [os.path.join(TRAINING_DIR, 'export.py'), os.path.join(TRAINING_DIR, 'packed_dataset.py')]
+SERVE_CODE = [os.path.join(INFERENCE_DIR, name) for name in ('inference.py', 'onnx_backend.py', 'boxes.py')]
+
+def run_command(command, log_path, env=None, cwd=None):
+    """Run a container entry point on the host, logging to a file"""
+    print(f"  $ {' '.join(command)}  (log: {log_path})")
+    full_env = dict(os.environ)
+    full_env.update(env or {})
+    with open(log_path, 'w') as log:
+        result = subprocess.run(command, stdout=log, stderr=subprocess.STDOUT, env=full_env, cwd=cwd)
+    if result.returncode != 0:
+        with open(log_path, 'r') as f:
+            tail = f.readlines()[-20:]
+        print(''.join(f"    {line}" for line in tail), end='')
+        raise RuntimeError(f"{os.path.basename(command[1])} exited with {result.returncode}")
+
+def link_tree(src, dst):
+    """Hardlink a directory tree (copy across filesystems), so stages never touch their inputs"""
+    def link(s, d):
+        try:
+            os.link(s, d)
+        except OSError:
+            shutil.copy2(s, d)
+    shutil.copytree(src, dst, copy_function=link)
+
+def find_best_weights(model_dir):
+    candidates = sorted(glob.glob(os.path.join(model_dir, '**', 'weights', 'best.pt'), recursive=True))
+    if not candidates:
+        raise FileNotFoundError(f"No best.pt under {model_dir}")
+    return candidates[0]
+
+def latest_label_cache(store):
+    """label_cache.json from the newest label artifact, so new images reuse old labels"""
+    caches = glob.glob(os.path.join(store.root, 'label', '*', 'label_cache.json'))
+    return os.path.dirname(max(caches, key=os.path.getmtime)) if caches else None
+
+def local_stages(args, store):
+    """processing -> training -> deployment, run on this machine"""
+    python = sys.executable
+    
+    def label(ctx):
+        images = os.path.join(ctx.work, 'input')
+        link_tree(os.path.abspath(args.images), images)
+        command = [
+            python, os.path.join(AUTODISTILL_DIR, 'process.py'),
+            '--input-dir', images,
+            '--output-dir', ctx.output,
+            '--base-model', ctx.params['base_model'],
+            '--label-workers', str(args.label_workers),
+            '--checkpoint-dir', os.path.join(ctx.work, 'checkpoints'),
+        ]
+        if ctx.params['dedup_mode'] == 'off':
+            command.append('--no-dedup')
+        else:
+            command.extend(['--dedup-mode', ctx.params['dedup_mode']])
+        cache_dir = latest_label_cache(store)
+        if cache_dir:
+            print(f"🗃️ label: reusing label cache from {cache_dir}")
+            command.extend(['--cache-dir', cache_dir])
+        run_command(command, os.path.join(ctx.work, 'process.log'),
+                    env={'PYTHONPATH': AUTODISTILL_DIR + os.pathsep + DATA_DIR})
+    
+    def pack(ctx):
+        sys.path.append(DATA_DIR)
+        from dataset_utils import pack_yolo_dataset
+        
+        summary = pack_yolo_dataset(os.path.join(ctx.inputs['label'], 'data.yaml'), ctx.output,
+                                    shard_size_mb=ctx.params['shard_size_mb'])
+        ctx.meta['counts'] = {split: manifest['count'] for split, manifest in summary.items()}
+    
+    def train(ctx):
+        config_dir = os.path.join(ctx.work, 'config')
+        os.makedirs(config_dir)
+        with open(os.path.join(config_dir, 'hyperparameters.json'), 'w') as f:
+            json.dump({key: str(value) for key, value in ctx.params.items()}, f, indent=2)
+        env = {
+            'SM_CHANNEL_TRAINING': ctx.inputs['label'],
+            'SM_MODEL_DIR': ctx.output,
+            'SM_INPUT_CONFIG_DIR': config_dir,
+            'MLFLOW_TRACKING_URI': 'file://' + os.path.join(store.root, 'mlruns'),
+        }
+        # cwd = work dir, so the downloaded yolov8n.pt never lands in the repo
+        run_command([python, os.path.join(TRAINING_DIR, 'train.py')],
+                    os.path.join(ctx.work, 'train.log'), env=env, cwd=ctx.work)
+        ctx.meta['weights'] = os.path.relpath(find_best_weights(ctx.output), ctx.output)
+    
+    def export(ctx):
+        weights = os.path.join(ctx.output, 'best.pt')
+        shutil.copy2(find_best_weights(ctx.inputs['train']), weights)
+        run_command([
+            python, os.path.join(TRAINING_DIR, 'export.py'),
+            '--weights', weights,
+            '--data', os.path.join(ctx.inputs['label'], 'data.yaml'),
+            '--img-size', str(ctx.params['img_size']),
+            '--formats', ctx.params['formats'],
+            '--quantize', ctx.params['quantize'],
+            '--max-map-drop', str(ctx.params['max_map_drop']),
+        ], os.path.join(ctx.work, 'export.log'), cwd=ctx.work)
+    
+    def evaluate(ctx):
+        metrics_path = os.path.join(ctx.output, 'metrics.json')
+        run_command([
+            python, os.path.join(TRAINING_DIR, 'export.py'),
+            '--weights', find_best_weights(ctx.inputs['train']),
+            '--data', os.path.join(ctx.inputs['pack'], 'data.yaml'),
+            '--img-size', str(ctx.params['img_size']),
+            '--validate-only',
+            '--output', metrics_path,
+        ], os.path.join(ctx.work, 'evaluate.log'), cwd=ctx.work)
+        with open(metrics_path, 'r') as f:
+            ctx.meta['metrics'] = json.load(f)
+    
+    def deploy(ctx):
+        for name in os.listdir(ctx.inputs['export']):
+            src = os.path.join(ctx.inputs['export'], name)
+            if os.path.isfile(src) and name != '_stage.json':
+                shutil.copy2(src, os.path.join(ctx.output, name))
+        shutil.copy2(os.path.join(ctx.inputs['evaluate'], 'metrics.json'), ctx.output)
+        
+        # Smoke test: load the detector the way the endpoint would and run one image
+        sys.path.append(INFERENCE_DIR)
+        import numpy as np
+        from inference import load_detector
+        
+        detector = load_detector(ctx.output)
+        detector.predict_batch([np.zeros((detector.img_size, detector.img_size, 3), dtype=np.uint8)])
+        print(f"✅ deploy: detector loads and predicts from {ctx.output}")
+    
+    image_params = {'base_model': args.base_model, 'dedup_mode': args.dedup_mode}
+    train_params = {
+        'epochs': args.epochs,
+        'batch-size': args.batch_size,
+        'img-size': args.img_size,
+        'model-name': 'hail-damage-detector',
+        'export-formats': 'none',  # the export stage does this, concurrently with evaluate
+        'image-cache': args.image_cache,
+    }
+    export_params = {
+        'img_size': args.img_size,
+        'formats': args.export_formats,
+        'quantize': args.quantize,
+        'max_map_drop': args.max_map_drop,
+    }
+    return [
+        Stage('label', label, code=LABEL_CODE, inputs=[args.images], params=image_params),
+        Stage('pack', pack, deps=['label'], code=PACK_CODE, params={'shard_size_mb': args.shard_size_mb}),
+        Stage('train', train, deps=['label'], code=TRAIN_CODE, params=train_params),
+        Stage('export', export, deps=['train', 'label'], code=EXPORT_CODE, params=export_params),
+        Stage('evaluate', evaluate, deps=['train', 'pack'], code=EXPORT_CODE,
+              params={'img_size': args.img_size}),
+        Stage('deploy', deploy, deps=['export', 'evaluate'], code=SERVE_CODE),
+    ]
+
+def sagemaker_stages(args, store):
+    """The same flow as SageMaker jobs, driven by the existing launch scripts"""
+    python = sys.executable
+    missing = [name for name in ('role', 'bucket', 'input_prefix', 'output_prefix',
+                                 'processing_image_uri', 'training_image_uri')
+               if not getattr(args, name)]
+    if missing:
+        raise SystemExit(f"❌ --backend sagemaker needs: {', '.join('--' + m.replace('_', '-') for m in missing)}")
+    
+    def label(ctx):
+        command = [
+            python, os.path.join(SCRIPTS_DIR, 'run_processing.py'),
+            '--role', args.role, '--bucket', args.bucket,
+            '--input-prefix', args.input_prefix, '--output-prefix', args.output_prefix,
+            '--image-uri', args.processing_image_uri,
+            '--dedup-mode', ctx.params['dedup_mode'],
+        ]
+        run_command(command, os.path.join(ctx.work, 'processing.log'))
+        # run_processing packs by default; train from the shards like the CI workflow
+        ctx.meta['data_prefix'] = f"{args.output_prefix}/packed"
+    
+    def train(ctx):
+        output_json = os.path.join(ctx.output, 'training_job.json')
+        run_command([
+            python, os.path.join(SCRIPTS_DIR, 'run_training.py'),
+            '--role', args.role, '--bucket', args.bucket,
+            '--data-prefix', f"{args.output_prefix}/packed", '--model-output', args.model_output,
+            '--image-uri', args.training_image_uri,
+            '--output-json', output_json,
+        ], os.path.join(ctx.work, 'training.log'))
+        with open(output_json, 'r') as f:
+            ctx.meta.update(json.load(f))
+    
+    def deploy(ctx):
+        with open(os.path.join(ctx.inputs['train'], 'training_job.json'), 'r') as f:
+            artifacts = json.load(f)['model_artifacts']
+        # s3://<bucket>/<prefix>/output/model.tar.gz -> <prefix>
+        model_prefix = artifacts.split('/', 3)[3].rsplit('/output/', 1)[0]
+        command = [
+            python, os.path.join(SCRIPTS_DIR, 'deploy_endpoint.py'),
+            '--role', args.role, '--bucket', args.bucket, '--model-prefix', model_prefix,
+        ]
+        if args.serving_image_uri:
+            command.extend(['--image-uri', args.serving_image_uri])
+        run_command(command, os.path.join(ctx.work, 'deploy.log'))
+        ctx.meta['model_prefix'] = model_prefix
+    
+    # No local copy of the S3 images to hash, so the run id stands in for "inputs changed"
+    image_params = {'input_prefix': args.input_prefix, 'run_id': args.run_id,
+                    'dedup_mode': args.dedup_mode}
+    return [
+        Stage('label', label, code=LABEL_CODE, params=image_params),
+        Stage('train', train, deps=['label'], code=TRAIN_CODE,
+              params={'model_output': args.model_output, 'image_uri': args.training_image_uri}),
+        Stage('deploy', deploy, deps=['train'], code=SERVE_CODE,
+              params={'image_uri': args.serving_image_uri}),
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description="Run processing -> training -> deployment as a memoized DAG")
+    parser.add_argument('--backend', choices=['local', 'sagemaker'], default='local')
+    parser.add_argument('--store', default='.pipeline', help='Artifact store directory')
+    parser.add_argument('--workers', type=int, default=2, help='Stages run concurrently')
+    parser.add_argument('--until', default=None, help='Stop after this stage (and its upstream)')
+    parser.add_argument('--force', default='', help='Comma-separated stages to rerun even if cached')
+    parser.add_argument('--dedup-mode', choices=['inherit', 'drop', 'off'], default='inherit')
+    # local backend
+    parser.add_argument('--images', default=None, help='Raw image directory (local backend)')
+    parser.add_argument('--base-model', choices=['grounded-sam', 'stub'], default='grounded-sam')
+    parser.add_argument('--label-workers', type=int, default=1)
+    parser.add_argument('--shard-size-mb', type=int, default=256)
+    parser.add_argument('--epochs', type=int, default=100)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--img-size', type=int, default=640)
+    parser.add_argument('--image-cache', choices=['on', 'off'], default='on')
+    parser.add_argument('--export-formats', default='onnx')
+    parser.add_argument('--quantize', default='static')
+    parser.add_argument('--max-map-drop', type=float, default=0.02)
+    # sagemaker backend
+    parser.add_argument('--role', default=None)
+    parser.add_argument('--bucket', default=None)
+    parser.add_argument('--input-prefix', default=None)
+    parser.add_argument('--output-prefix', default=None)
+    parser.add_argument('--model-output', default='models')
+    parser.add_argument('--processing-image-uri', default=None)
+    parser.add_argument('--training-image-uri', default=None)
+    parser.add_argument('--serving-image-uri', default=None)
+    parser.add_argument('--run-id', default='1',
+                        help='Bump to relabel when the S3 input prefix contents change')
+    args = parser.parse_args()
+    
+    store = ArtifactStore(args.store)
+    if args.backend == 'local':
+        if not args.images or not os.path.isdir(args.images):
+            raise SystemExit("❌ --backend local needs --images <directory>")
+        stages = local_stages(args, store)
+    else:
+        stages = sagemaker_stages(args, store)
+    
+    print(f"🏗️ Pipeline ({args.backend}): store {store.root}, {args.workers} concurrent stages")
+    pipeline = Pipeline(stages, store, max_workers=args.workers)
+    force = [name.strip() for name in args.force.split(',') if name.strip()]
+    try:
+        artifacts = pipeline.run(targets=[args.until] if args.until else None, force=force)
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    
+    for name, path in artifacts.items():
+        print(f"📦 {name}: {path}")
+
+if __name__ == "__main__":
+    main()
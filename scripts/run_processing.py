@@ -5,6 +5,51 @@ import time
 from sagemaker.processing import ScriptProcessor, ProcessingInput, ProcessingOutput
 from sagemaker import Session
 
+CHECKPOINT_DIR = '/opt/ml/processing/checkpoints'
+RESUME_DIR = '/opt/ml/processing/resume'
+STUDENT_DIR = '/opt/ml/processing/student'
+WEIGHTS_DIR = '/opt/ml/processing/weights'
+
+def s3_prefix_exists(bucket, prefix):
+    """Check whether any object exists under an S3 key or prefix"""
+    s3 = boto3.client('s3')
+    response = s3.list_objects_v2(Bucket=bucket, Prefix=prefix, MaxKeys=1)
+    return response.get('KeyCount', 0) > 0
+
+def make_processor(args, session, instance_count):
+    """Processing job runner for the Autodistill container"""
+    return ScriptProcessor(
+        image_uri=args.image_uri,
+        command=['python3'],
+        role=args.role,
+        instance_count=instance_count,
+        instance_type='ml.m5.xlarge',  # CPU instance under default quota
+        volume_size_in_gb=100,
+        max_runtime_in_seconds=3600,
+        # weights_registry.py looks for a mounted registry here before the baked-in one
+        env={'SM_CHANNEL_WEIGHTS': WEIGHTS_DIR} if args.weights_registry else None,
+        sagemaker_session=session
+    )
+
+def delete_s3_prefix(bucket, prefix):
+    """Delete every object under an S3 prefix; returns how many were removed"""
+    s3 = boto3.client('s3')
+    deleted = 0
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+        keys = [{'Key': obj['Key']} for obj in page.get('Contents', [])]
+        if keys:
+            s3.delete_objects(Bucket=bucket, Delete={'Objects': keys, 'Quiet': True})
+            deleted += len(keys)
+    return deleted
+
+def checkpoint_output(uri):
+    """Upload per-image checkpoints as they are written, not at job end"""
+    return ProcessingOutput(
+        source=CHECKPOINT_DIR,
+        destination=uri,
+        s3_upload_mode='Continuous'
+    )
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--role', required=True)
@@ -12,7 +57,26 @@ def main():
     parser.add_argument('--input-prefix', required=True)
     parser.add_argument('--output-prefix', required=True)
     parser.add_argument('--image-uri', required=True)
+    parser.add_argument('--no-label-cache', action='store_true',
+                        help='Relabel everything instead of reusing label_cache.json')
+    parser.add_argument('--instance-count', type=int, default=1,
+                        help='Processing instances, each labeling one hash shard')
+    parser.add_argument('--label-workers', type=int, default=1,
+                        help='Labeling worker processes per instance')
+    parser.add_argument('--no-pack', action='store_true',
+                        help='Skip writing packed shards to <output-prefix>/packed')
+    parser.add_argument('--student-model', default=None,
+                        help='s3:// URI of a trained model.tar.gz; labels with it first and '
+                             'sends only uncertain images to GroundedSAM')
+    parser.add_argument('--dedup-mode', choices=['inherit', 'drop', 'off'], default='inherit',
+                        help='Near-duplicates inherit their representative\'s labels, are dropped, or are all labeled')
+    parser.add_argument('--resume-run', default=None,
+                        help='Run ID of a failed run whose checkpoints to resume from (printed at job start)')
+    parser.add_argument('--weights-registry', default=None,
+                        help='s3:// prefix of a weights registry to use instead of the one baked into the image')
     args = parser.parse_args()
+    if args.resume_run and args.no_label_cache:
+        parser.error('--resume-run reuses earlier labels; it cannot be combined with --no-label-cache')
     
     print("🏗️ Setting up Autodistill processing job (CPU instance)...")
     print(f"📦 Container URI: {args.image_uri}")
@@ -20,41 +84,116 @@ def main():
     print(f"📂 Output Prefix: s3://{args.bucket}/{args.output_prefix}")
     
     session = Session()
-    processor = ScriptProcessor(
-        image_uri=args.image_uri,
-        command=['python3'],
-        role=args.role,
-        instance_count=1,
-        instance_type='ml.m5.xlarge',  # CPU instance under default quota
-        volume_size_in_gb=100,
-        max_runtime_in_seconds=3600,
-        sagemaker_session=session
-    )
     
-    job_name = f"autodistill-{int(time.time())}"
-    print(f"🚀 Starting processing job: {job_name}")
-    
-    processor.run(
-        code='docker/autodistill/process.py',
-        job_name=job_name,
-        inputs=[
-            ProcessingInput(
-                source=f's3://{args.bucket}/{args.input_prefix}',
-                destination='/opt/ml/processing/input'
-            )
-        ],
-        outputs=[
-            ProcessingOutput(
-                source='/opt/ml/processing/output',
-                destination=f's3://{args.bucket}/{args.output_prefix}'
-            )
-        ],
-        wait=True,
-        logs=True
+    inputs = [
+        ProcessingInput(
+            source=f's3://{args.bucket}/{args.input_prefix}',
+            destination='/opt/ml/processing/input'
+        )
+    ]
+    arguments = [
+        '--label-workers', str(args.label_workers),
+        '--checkpoint-dir', CHECKPOINT_DIR,
+    ]
+    if not args.no_pack:
+        arguments.append('--pack')
+    if args.dedup_mode == 'off':
+        arguments.append('--no-dedup')
+    else:
+        arguments.extend(['--dedup-mode', args.dedup_mode])
+    
+    # Self-distillation: the last trained detector labels the easy images
+    if args.student_model:
+        print(f"🎓 Student model: {args.student_model}")
+        inputs.append(ProcessingInput(source=args.student_model, destination=STUDENT_DIR))
+        arguments.extend(['--base-model', 'self-distill', '--student-weights', STUDENT_DIR])
+    
+    if args.weights_registry:
+        print(f"🏋️ Weights registry: {args.weights_registry}")
+        inputs.append(ProcessingInput(source=args.weights_registry, destination=WEIGHTS_DIR))
+    
+    # Reuse labels from the previous run's manifest when one exists
+    cache_key = f"{args.output_prefix.rstrip('/')}/label_cache.json"
+    if args.no_label_cache:
+        arguments.append('--no-cache')
+    elif s3_prefix_exists(args.bucket, cache_key):
+        print(f"🗃️ Reusing label cache: s3://{args.bucket}/{cache_key}")
+        inputs.append(ProcessingInput(
+            source=f's3://{args.bucket}/{cache_key}',
+            destination='/opt/ml/processing/cache'
+        ))
+        arguments.extend(['--cache-dir', '/opt/ml/processing/cache'])
+    else:
+        print("🗃️ No label cache found, labeling every image")
+    
+    # Checkpoints are kept per run, so a new run never picks up another run's
+    # labels; only a failed run resumed with --resume-run reads them again
+    timestamp = int(time.time())
+    run_id = args.resume_run or str(timestamp)
+    checkpoint_prefix = f"{args.output_prefix.rstrip('/')}-checkpoints/{run_id}/"
+    checkpoint_uri = f's3://{args.bucket}/{checkpoint_prefix}'
+    print(f"🆔 Run ID: {run_id} (checkpoints: {checkpoint_uri})")
+    if args.resume_run:
+        if not s3_prefix_exists(args.bucket, checkpoint_prefix):
+            print(f"❌ No checkpoints found for run {run_id}")
+            raise SystemExit(1)
+        print(f"♻️ Resuming from checkpoints: {checkpoint_uri}")
+        resume_input = ProcessingInput(source=checkpoint_uri, destination=RESUME_DIR)
+        inputs.append(resume_input)
+        arguments.extend(['--resume-dir', RESUME_DIR])
+    
+    dataset_output = ProcessingOutput(
+        source='/opt/ml/processing/output',
+        destination=f's3://{args.bucket}/{args.output_prefix}'
     )
     
+    if args.instance_count > 1:
+        # Each instance labels the shard picked from its host index, then a
+        # single-instance job merges every shard's checkpoints
+        job_name = f"autodistill-label-{timestamp}"
+        print(f"🚀 Starting sharded labeling job on {args.instance_count} instances: {job_name}")
+        make_processor(args, session, args.instance_count).run(
+            code='docker/autodistill/process.py',
+            job_name=job_name,
+            inputs=inputs,
+            arguments=arguments + ['--label-only'],
+            outputs=[checkpoint_output(checkpoint_uri)],
+            wait=True,
+            logs=True
+        )
+        
+        merge_inputs = [i for i in inputs if i.destination != RESUME_DIR]
+        merge_inputs.append(ProcessingInput(source=checkpoint_uri, destination=RESUME_DIR))
+        merge_arguments = [a for a in arguments if a not in ('--resume-dir', RESUME_DIR)]
+        job_name = f"autodistill-merge-{timestamp}"
+        print(f"🚀 Starting merge job: {job_name}")
+        make_processor(args, session, 1).run(
+            code='docker/autodistill/process.py',
+            job_name=job_name,
+            inputs=merge_inputs,
+            arguments=merge_arguments + ['--merge-only', '--resume-dir', RESUME_DIR],
+            outputs=[dataset_output],
+            wait=True,
+            logs=True
+        )
+    else:
+        job_name = f"autodistill-{timestamp}"
+        print(f"🚀 Starting processing job: {job_name}")
+        make_processor(args, session, 1).run(
+            code='docker/autodistill/process.py',
+            job_name=job_name,
+            inputs=inputs,
+            arguments=arguments,
+            outputs=[dataset_output, checkpoint_output(checkpoint_uri)],
+            wait=True,
+            logs=True
+        )
+    
+    # Every label is now in label_cache.json; a failed run keeps its checkpoints for --resume-run
+    deleted = delete_s3_prefix(args.bucket, checkpoint_prefix)
+    print(f"🧹 Deleted {deleted} checkpoints of run {run_id}")
+    
     print("✅ Autodistill processing completed successfully!")
 
 if __name__ == "__main__":
     main()
-
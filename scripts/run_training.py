@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import argparse
+import json
 import boto3
 import time
 
@@ -10,8 +11,48 @@ def main():
     parser.add_argument('--data-prefix', required=True)
     parser.add_argument('--model-output', required=True)
     parser.add_argument('--image-uri', required=True)
+    parser.add_argument('--input-mode', choices=['File', 'FastFile'], default='File',
+                        help='FastFile streams packed shards from S3 instead of copying them')
+    parser.add_argument('--output-json', default=None,
+                        help='Write the job name and model artifact URI here (for pipeline runners)')
+    parser.add_argument('--instance-type', default='ml.p3.2xlarge',
+                        help='CPU types (e.g. ml.c5.9xlarge) train with DDP over gloo')
+    parser.add_argument('--instance-count', type=int, default=1,
+                        help='Instances for CPU distributed training')
+    parser.add_argument('--workers-per-host', type=int, default=0,
+                        help='CPU DDP workers per instance (0 = one per 4 vCPUs)')
+    parser.add_argument('--epochs', type=int, default=100)
+    parser.add_argument('--autotune', action='store_true',
+                        help='Probe the instance and replace batch size 8 and the loader workers with the fastest that fit')
+    parser.add_argument('--spot', action='store_true',
+                        help='Managed spot training; interrupted jobs resume from their checkpoints')
+    parser.add_argument('--max-wait-hours', type=float, default=48,
+                        help='Spot only: total time allowed including waiting for capacity')
+    parser.add_argument('--resume-from', default=None,
+                        help='Job name of a failed/stopped run to resume from its checkpoints')
+    parser.add_argument('--warm-start-model', default=None,
+                        help='s3:// URI of a previous model.tar.gz to fine-tune from instead of COCO weights')
+    parser.add_argument('--tuned-config', default=None,
+                        help='s3:// URI of a sweep\'s best_hyperparameters.json to train with')
+    parser.add_argument('--sweep-space', default=None,
+                        help='YAML/JSON search space file: run an ASHA hyperparameter sweep instead')
+    parser.add_argument('--sweep-trials', type=int, default=16)
+    parser.add_argument('--sweep-workers', type=int, default=2, help='Trials trained concurrently')
+    parser.add_argument('--sweep-min-epochs', type=int, default=5)
+    parser.add_argument('--keep-alive-seconds', type=int, default=0,
+                        help='Warm pool keep-alive; reused instances keep the pre-decoded image cache')
+    parser.add_argument('--weights-registry', default=None,
+                        help='s3:// prefix of a weights registry to use instead of the one baked into the image')
+    parser.add_argument('--cache-disk-gb', default='50',
+                        help='Disk budget for the pre-decoded image cache ("0" disables it)')
     args = parser.parse_args()
     
+    gpu_instance = args.instance_type.split('.')[1].startswith(('g', 'p'))
+    if gpu_instance and args.instance_count > 1:
+        parser.error('multi-instance training is CPU-only (DDP over gloo); use a CPU --instance-type')
+    if args.sweep_space and args.instance_count > 1:
+        parser.error('a sweep runs on one instance; every extra instance would repeat it')
+    
     print("🏗️ Setting up YOLOv8 training job...")
     print(f"📦 Container: {args.image_uri}")
     print(f"📂 Data: s3://{args.bucket}/{args.data_prefix}")
@@ -22,13 +63,15 @@ def main():
     
     # Generate unique job name
     job_name = f"yolo-hail-damage-{int(time.time())}"
+    # Checkpoints are per run; spot restarts of this job (or --resume-from) pick them up
+    checkpoint_uri = f"s3://{args.bucket}/{args.model_output}/checkpoints/{args.resume_from or job_name}"
     
     # Training job configuration
     training_config = {
         'TrainingJobName': job_name,
         'AlgorithmSpecification': {
             'TrainingImage': args.image_uri,
-            'TrainingInputMode': 'File'
+            'TrainingInputMode': args.input_mode
         },
         'RoleArn': args.role,
         'InputDataConfig': [{
@@ -47,20 +90,97 @@ def main():
             'S3OutputPath': f's3://{args.bucket}/{args.model_output}'
         },
         'ResourceConfig': {
-            'InstanceType': 'ml.p3.2xlarge',  # GPU for training
-            'InstanceCount': 1,
+            'InstanceType': args.instance_type,
+            'InstanceCount': args.instance_count,
             'VolumeSizeInGB': 100
         },
         'StoppingCondition': {
             'MaxRuntimeInSeconds': 24 * 3600  # 24 hours max
         },
         'HyperParameters': {
-            'epochs': '100',
+            'epochs': str(args.epochs),
             'batch-size': '8', 
             'img-size': '640',
-            'model-name': 'hail-damage-detector'
+            'model-name': 'hail-damage-detector',
+            'export-formats': 'onnx',
+            'quantize': 'static',
+            'image-cache': 'off' if float(args.cache_disk_gb) <= 0 else 'on',
+            'cache-disk-gb': args.cache_disk_gb,
+            'distributed': 'off' if gpu_instance else 'cpu',
+            'workers-per-host': str(args.workers_per_host),
+            'autotune': 'on' if args.autotune else 'off'
         }
     }
+    training_config['CheckpointConfig'] = {
+        'S3Uri': checkpoint_uri,
+        'LocalPath': '/opt/ml/checkpoints'
+    }
+    print(f"💾 Checkpoints: {checkpoint_uri}")
+    if args.spot:
+        training_config['EnableManagedSpotTraining'] = True
+        training_config['StoppingCondition']['MaxWaitTimeInSeconds'] = int(args.max_wait_hours * 3600)
+        print(f"💸 Managed spot training (max wait {args.max_wait_hours}h)")
+    if args.tuned_config:
+        # Let the tuned config decide what the sweep searched over
+        print(f"🏆 Tuned hyperparameters: {args.tuned_config}")
+        for key in ('batch-size', 'img-size'):
+            training_config['HyperParameters'].pop(key)
+        # The sweep's batch size goes with its learning rate; don't let the probe replace it
+        training_config['HyperParameters']['autotune'] = 'off'
+        training_config['InputDataConfig'].append({
+            'ChannelName': 'tuned',
+            'DataSource': {
+                'S3DataSource': {
+                    'S3DataType': 'S3Prefix',
+                    'S3Uri': args.tuned_config,
+                    'S3DataDistributionType': 'FullyReplicated'
+                }
+            },
+            'ContentType': 'application/json',
+            'CompressionType': 'None'
+        })
+    if args.weights_registry:
+        print(f"🏋️ Weights registry: {args.weights_registry}")
+        training_config['InputDataConfig'].append({
+            'ChannelName': 'weights',
+            'DataSource': {
+                'S3DataSource': {
+                    'S3DataType': 'S3Prefix',
+                    'S3Uri': args.weights_registry,
+                    'S3DataDistributionType': 'FullyReplicated'
+                }
+            },
+            'ContentType': 'application/octet-stream',
+            'CompressionType': 'None'
+        })
+    if args.sweep_space:
+        with open(args.sweep_space, 'r') as f:
+            space = f.read()
+        print(f"🔎 ASHA sweep over {args.sweep_space}: {args.sweep_trials} trials, {args.sweep_workers} at a time")
+        training_config['HyperParameters'].update({
+            'sweep-space': space,
+            'sweep-trials': str(args.sweep_trials),
+            'sweep-workers': str(args.sweep_workers),
+            'sweep-min-epochs': str(args.sweep_min_epochs),
+            'export-formats': 'none',
+            # Trials run side by side in one process; DDP would repeat the whole sweep per rank
+            'distributed': 'off'
+        })
+    if args.warm_start_model:
+        print(f"🔥 Warm start from: {args.warm_start_model}")
+        training_config['InputDataConfig'].append({
+            'ChannelName': 'warmstart',
+            'DataSource': {
+                'S3DataSource': {
+                    'S3DataType': 'S3Prefix',
+                    'S3Uri': args.warm_start_model,
+                    'S3DataDistributionType': 'FullyReplicated'
+                }
+            },
+            'CompressionType': 'None'
+        })
+    if args.keep_alive_seconds:
+        training_config['ResourceConfig']['KeepAlivePeriodInSeconds'] = args.keep_alive_seconds
     
     # Start training job
     print(f"🚀 Starting training job: {job_name}")
@@ -78,10 +198,20 @@ def main():
     if status == 'Completed':
         print("✅ Training completed successfully!")
         print(f"📦 Model artifacts: {response['ModelArtifacts']['S3ModelArtifacts']}")
+        if args.spot and 'BillableTimeInSeconds' in response:
+            saved = 1 - response['BillableTimeInSeconds'] / max(response.get('TrainingTimeInSeconds', 1), 1)
+            print(f"💸 Spot savings: {saved:.0%} of training time not billed")
+        if args.output_json:
+            with open(args.output_json, 'w') as f:
+                json.dump({
+                    'job_name': job_name,
+                    'model_artifacts': response['ModelArtifacts']['S3ModelArtifacts'],
+                }, f, indent=2)
     else:
         print(f"❌ Training failed with status: {status}")
         if 'FailureReason' in response:
             print(f"💥 Failure reason: {response['FailureReason']}")
+        print(f"♻️ Resume with: --resume-from {job_name}")
 
 if __name__ == "__main__":
     main()
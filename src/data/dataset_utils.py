@@ -0,0 +1,783 @@
+import os
+import glob
+import json
+import tarfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+PACKED_FORMAT_VERSION = 1
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+SPLITS = (('train', 'train'), ('val', 'valid'))
+
+# Per-image index columns in <shard>.index.npy
+INDEX_COLUMNS = ('offset', 'length', 'height', 'width', 'label_start', 'label_count')
+OFFSET, LENGTH, HEIGHT, WIDTH, LABEL_START, LABEL_COUNT = range(len(INDEX_COLUMNS))
+
+def load_data_yaml(data_yaml):
+    """Load a YOLO data.yaml and resolve split image directories"""
+    import yaml
+
+    with open(data_yaml, 'r') as f:
+        data = yaml.safe_load(f)
+    yaml_dir = os.path.dirname(os.path.abspath(data_yaml))
+    base_dir = data.get('path') or yaml_dir
+    if not os.path.isabs(base_dir):
+        base_dir = os.path.join(yaml_dir, base_dir)
+
+    names = data.get('names', [])
+    if isinstance(names, dict):
+        names = [names[k] for k in sorted(names)]
+    data['names'] = list(names)
+
+    dirs = {}
+    for key, default in SPLITS:
+        split_dir = data.get(key) or f"{default}/images"
+        if not os.path.isabs(split_dir):
+            split_dir = os.path.join(base_dir, split_dir)
+        if not os.path.isdir(split_dir):
+            # Older Autodistill output records absolute paths from the processing box
+            alt_dir = os.path.join(base_dir, f"{default}/images")
+            split_dir = alt_dir if os.path.isdir(alt_dir) else split_dir
+        dirs[default] = split_dir
+    return data, dirs
+
+def list_split_images(images_dir):
+    return sorted(
+        path for path in glob.glob(os.path.join(images_dir, '*'))
+        if path.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+def label_path_for(image_path):
+    """YOLO convention: .../images/x.jpg -> .../labels/x.txt"""
+    images_dir, name = os.path.split(image_path)
+    labels_dir = os.path.join(os.path.dirname(images_dir), 'labels')
+    return os.path.join(labels_dir, os.path.splitext(name)[0] + '.txt')
+
+def read_yolo_labels(label_path):
+    """Parse a YOLO label file into (N, 5) float32 [class, cx, cy, w, h]
+
+    Polygon rows (segmentation labels) are reduced to their bounding box.
+    """
+    rows = []
+    if os.path.exists(label_path):
+        with open(label_path, 'r') as f:
+            for line in f:
+                values = line.split()
+                if len(values) < 5:
+                    continue
+                coords = np.asarray(values[1:], dtype=np.float32)
+                if len(coords) > 4:
+                    xs, ys = coords[0::2], coords[1::2]
+                    x1, y1, x2, y2 = xs.min(), ys.min(), xs.max(), ys.max()
+                    coords = np.array([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1], dtype=np.float32)
+                rows.append(np.concatenate([[float(values[0])], coords[:4]]))
+    if not rows:
+        return np.zeros((0, 5), dtype=np.float32)
+    return np.stack(rows).astype(np.float32)
+
+def _read_packable(image_path):
+    from PIL import Image
+
+    with open(image_path, 'rb') as f:
+        data = f.read()
+    with Image.open(image_path) as img:
+        width, height = img.size
+    return data, height, width, read_yolo_labels(label_path_for(image_path))
+
+class _ShardWriter:
+    def __init__(self, output_dir, split, shard_bytes):
+        self.output_dir = output_dir
+        self.split = split
+        self.shard_bytes = shard_bytes
+        self.shards = []
+        self._open_next()
+
+    def _open_next(self):
+        self.name = f"{self.split}-{len(self.shards):05d}"
+        self.blob = open(os.path.join(self.output_dir, f"{self.name}.bin"), 'wb')
+        self.offset = 0
+        self.index = []
+        self.labels = []
+        self.label_count = 0
+        self.file_names = []
+
+    def add(self, file_name, data, height, width, labels):
+        if self.index and self.offset + len(data) > self.shard_bytes:
+            self._close_current()
+            self._open_next()
+        self.blob.write(data)
+        self.index.append((self.offset, len(data), height, width, self.label_count, len(labels)))
+        self.labels.append(labels)
+        self.label_count += len(labels)
+        self.offset += len(data)
+        self.file_names.append(file_name)
+
+    def _close_current(self):
+        self.blob.close()
+        index = np.asarray(self.index, dtype=np.int64).reshape(-1, len(INDEX_COLUMNS))
+        labels = np.concatenate(self.labels) if self.labels else np.zeros((0, 5), np.float32)
+        np.save(os.path.join(self.output_dir, f"{self.name}.index.npy"), index)
+        np.save(os.path.join(self.output_dir, f"{self.name}.labels.npy"), labels.astype(np.float32))
+        with open(os.path.join(self.output_dir, f"{self.name}.names.txt"), 'w') as f:
+            f.write('\n'.join(self.file_names))
+        self.shards.append({'name': self.name, 'count': len(self.index), 'bytes': self.offset})
+
+    def close(self):
+        self._close_current()
+        return self.shards
+
+def pack_yolo_dataset(data_yaml, output_dir, shard_size_mb=256, workers=8):
+    """Pack a YOLO train/valid dataset into a few large shard files
+
+    Each shard is a contiguous image-bytes blob (<shard>.bin), an int64
+    offset index (<shard>.index.npy) and a float32 [class, cx, cy, w, h]
+    box array (<shard>.labels.npy). A per-split manifest (train.json /
+    valid.json) lists the shards, and a data.yaml pointing at those
+    manifests is written so training code can consume the packed copy.
+    """
+    import yaml
+
+    data, split_dirs = load_data_yaml(data_yaml)
+    os.makedirs(output_dir, exist_ok=True)
+    shard_bytes = int(shard_size_mb * 1024 * 1024)
+
+    summary = {}
+    for split, images_dir in split_dirs.items():
+        image_paths = list_split_images(images_dir)
+        writer = _ShardWriter(output_dir, split, shard_bytes)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # map() keeps input order, so shards are deterministic
+            for image_path, packed in zip(image_paths, pool.map(_read_packable, image_paths)):
+                writer.add(os.path.basename(image_path), *packed)
+        shards = writer.close()
+        manifest = {
+            'format_version': PACKED_FORMAT_VERSION,
+            'split': split,
+            'names': data['names'],
+            'count': sum(s['count'] for s in shards),
+            'shards': shards,
+        }
+        with open(os.path.join(output_dir, f"{split}.json"), 'w') as f:
+            json.dump(manifest, f, indent=2)
+        summary[split] = manifest
+
+    packed_yaml = {
+        'names': data['names'],
+        'nc': len(data['names']),
+        'train': 'train.json',
+        'val': 'valid.json',
+    }
+    with open(os.path.join(output_dir, 'data.yaml'), 'w') as f:
+        yaml.safe_dump(packed_yaml, f, sort_keys=False)
+    return summary
+
+def is_packed_split(path):
+    """True if a data.yaml split entry points at a packed manifest"""
+    return isinstance(path, str) and path.endswith('.json') and os.path.isfile(path)
+
+class PackedDataset:
+    """Memory-mapped reader over one split of a packed dataset
+
+    Image bytes are read straight out of np.memmap views of the shard
+    blobs, so opening a split costs a few small index reads regardless of
+    dataset size.
+    """
+
+    def __init__(self, manifest_path):
+        with open(manifest_path, 'r') as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('format_version') != PACKED_FORMAT_VERSION:
+            raise ValueError(f"Unsupported packed dataset format: {manifest_path}")
+        self.root = os.path.dirname(os.path.abspath(manifest_path))
+        self.split = self.manifest['split']
+        self.names = self.manifest['names']
+
+        self.blobs, self.indexes, self.labels_arrays, self.file_names = [], [], [], []
+        for shard in self.manifest['shards']:
+            prefix = os.path.join(self.root, shard['name'])
+            self.blobs.append(np.memmap(f"{prefix}.bin", dtype=np.uint8, mode='r')
+                              if shard['bytes'] else np.zeros(0, np.uint8))
+            self.indexes.append(np.load(f"{prefix}.index.npy"))
+            self.labels_arrays.append(np.load(f"{prefix}.labels.npy", mmap_mode='r'))
+            with open(f"{prefix}.names.txt", 'r') as f:
+                self.file_names.extend(f.read().splitlines())
+        counts = np.array([len(index) for index in self.indexes], dtype=np.int64)
+        self._starts = np.concatenate([[0], np.cumsum(counts)])
+
+    def __len__(self):
+        return int(self._starts[-1])
+
+    def _locate(self, i):
+        if i < 0 or i >= len(self):
+            raise IndexError(i)
+        shard = int(np.searchsorted(self._starts, i, side='right') - 1)
+        return shard, i - int(self._starts[shard])
+
+    def image_bytes(self, i):
+        shard, j = self._locate(i)
+        row = self.indexes[shard][j]
+        return self.blobs[shard][row[OFFSET]:row[OFFSET] + row[LENGTH]]
+
+    def shape(self, i):
+        """(height, width) of the original image"""
+        shard, j = self._locate(i)
+        row = self.indexes[shard][j]
+        return int(row[HEIGHT]), int(row[WIDTH])
+
+    def labels(self, i):
+        """(N, 5) float32 [class, cx, cy, w, h] normalized labels"""
+        shard, j = self._locate(i)
+        row = self.indexes[shard][j]
+        return np.asarray(self.labels_arrays[shard][row[LABEL_START]:row[LABEL_START] + row[LABEL_COUNT]])
+
+    def file_name(self, i):
+        return self.file_names[i]
+
+    def decode(self, i):
+        """Decode image i to a BGR uint8 array"""
+        import cv2
+
+        image = cv2.imdecode(np.asarray(self.image_bytes(i)), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError(f"Could not decode packed image {self.file_name(i)}")
+        return image
+
+# COCO IoU thresholds 0.50:0.05:0.95 for mAP50-95
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+# COCO-style 101-point recall grid for AP interpolation
+RECALL_GRID = np.linspace(0, 1, 101)
+DETECTION_KEYS = ('image', 'class', 'boxes', 'score')
+
+def read_yolo_predictions(label_path):
+    """Parse a YOLO prediction file (save_conf) into (N, 6) float32 [class, cx, cy, w, h, conf]
+
+    Rows without a confidence (plain labels, e.g. auto-labels) get 1.0.
+    """
+    rows = []
+    if os.path.exists(label_path):
+        with open(label_path, 'r') as f:
+            for line in f:
+                values = line.split()
+                if len(values) == 5:
+                    values.append('1.0')
+                if len(values) == 6:
+                    rows.append(values)
+    if not rows:
+        return np.zeros((0, 6), dtype=np.float32)
+    return np.asarray(rows, dtype=np.float32)
+
+def _xywh_to_xyxy(boxes):
+    xy, wh = boxes[:, :2], boxes[:, 2:4] / 2
+    return np.concatenate([xy - wh, xy + wh], axis=1)
+
+def _flatten(images, per_image):
+    """Per-image (N, 6) [class, cx, cy, w, h, score] rows -> flat detection arrays
+
+    Every detection set is a dict of parallel arrays: 'image' (index
+    into 'images'), 'class', 'boxes' (normalized xyxy) and 'score'.
+    """
+    counts = np.array([len(rows) for rows in per_image], dtype=np.int64)
+    rows = np.concatenate(per_image) if per_image else np.zeros((0, 6), np.float32)
+    return {
+        'images': list(images),
+        'image': np.repeat(np.arange(len(per_image), dtype=np.int64), counts),
+        'class': rows[:, 0].astype(np.int64),
+        'boxes': _xywh_to_xyxy(rows[:, 1:5]).astype(np.float32),
+        'score': rows[:, 5].astype(np.float32),
+    }
+
+def load_yolo_detections(labels_dir, images=None, predictions=False, workers=8):
+    """Load a YOLO labels/ (or predict labels/) directory into flat arrays
+
+    images is the list of file stems to include. It defaults to every
+    .txt file in the directory; stems without a file get no boxes.
+    Ground truth may contain polygons; predictions carry a confidence.
+    """
+    if images is None:
+        images = sorted(os.path.splitext(os.path.basename(p))[0]
+                        for p in glob.glob(os.path.join(labels_dir, '*.txt')))
+    paths = [os.path.join(labels_dir, f"{stem}.txt") for stem in images]
+    if predictions:
+        read = read_yolo_predictions
+    else:
+        def read(path):
+            labels = read_yolo_labels(path)
+            return np.concatenate([labels, np.ones((len(labels), 1), np.float32)], axis=1)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        per_image = list(pool.map(read, paths))
+    return _flatten(images, per_image)
+
+def load_prediction_jsonl(path):
+    """Load batch_inference.py JSONL results (pixel xyxy boxes) into flat arrays"""
+    images, per_image = [], []
+    with open(path, 'r') as f:
+        for line in f:
+            record = json.loads(line)
+            if record.get('error'):
+                continue
+            width, height = record['image_size']
+            detections = record['detections']
+            rows = np.zeros((len(detections), 6), np.float32)
+            for i, d in enumerate(detections):
+                x1, y1, x2, y2 = d['box']
+                rows[i] = (d['class_id'], (x1 + x2) / 2 / width, (y1 + y2) / 2 / height,
+                           (x2 - x1) / width, (y2 - y1) / height, d['confidence'])
+            images.append(os.path.splitext(os.path.basename(record['path']))[0])
+            per_image.append(rows)
+    return _flatten(images, per_image)
+
+def align_detections(detections, images):
+    """Re-index a detection set onto another image list, dropping unknown images"""
+    position = {stem: i for i, stem in enumerate(images)}
+    lookup = np.array([position.get(stem, -1) for stem in detections['images']], dtype=np.int64)
+    image = lookup[detections['image']] if len(detections['image']) else detections['image']
+    keep = image >= 0
+    aligned = {key: detections[key][keep] for key in DETECTION_KEYS}
+    aligned['image'] = image[keep]
+    aligned['images'] = list(images)
+    return aligned
+
+def pairwise_iou(a, b):
+    """Elementwise IoU of two (N, 4) xyxy arrays"""
+    inter_wh = np.clip(np.minimum(a[:, 2:], b[:, 2:]) - np.maximum(a[:, :2], b[:, :2]), 0, None)
+    inter = inter_wh[:, 0] * inter_wh[:, 1]
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a + area_b - inter, 1e-9)
+
+def match_detections(gt, pred, iou_thresholds=IOU_THRESHOLDS):
+    """(P, T) bool true-positive matrix for every prediction at every IoU threshold
+
+    Candidate pairs are every (prediction, ground truth) of the same image
+    and class, built for all images at once with repeat/offset arithmetic
+    instead of per-image loops. Per threshold, pairs are taken greedily by
+    IoU, one per prediction and one per ground truth, as Ultralytics'
+    validator does.
+    """
+    num_classes = int(max(gt['class'].max(initial=-1), pred['class'].max(initial=-1))) + 1
+    gt_key = gt['image'] * num_classes + gt['class']
+    gt_order = np.argsort(gt_key, kind='stable')
+    sorted_key = gt_key[gt_order]
+    pred_key = pred['image'] * num_classes + pred['class']
+    lo = np.searchsorted(sorted_key, pred_key, side='left')
+    counts = np.searchsorted(sorted_key, pred_key, side='right') - lo
+
+    pair_pred = np.repeat(np.arange(len(pred_key)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    pair_gt = gt_order[np.repeat(lo, counts) + offsets]
+    iou = pairwise_iou(pred['boxes'][pair_pred], gt['boxes'][pair_gt])
+
+    tp = np.zeros((len(pred_key), len(iou_thresholds)), dtype=bool)
+    by_iou = np.argsort(-iou, kind='stable')
+    for j, threshold in enumerate(iou_thresholds):
+        candidates = by_iou[iou[by_iou] >= threshold]
+        _, first = np.unique(pair_pred[candidates], return_index=True)
+        candidates = candidates[first]
+        candidates = candidates[np.argsort(-iou[candidates], kind='stable')]  # unique() sorted by prediction
+        _, first = np.unique(pair_gt[candidates], return_index=True)
+        tp[pair_pred[candidates[first]], j] = True
+    return tp
+
+def _match_shard(args):
+    return match_detections(*args)
+
+def match_detections_sharded(gt, pred, iou_thresholds=IOU_THRESHOLDS, workers=1):
+    """match_detections over contiguous image ranges in a process pool"""
+    num_images = len(gt['images'])
+    if workers <= 1 or num_images < 2 * workers:
+        return match_detections(gt, pred, iou_thresholds)
+    from concurrent.futures import ProcessPoolExecutor
+
+    bounds = np.linspace(0, num_images, workers + 1).astype(np.int64)
+    shards, masks = [], []
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        gt_mask = (gt['image'] >= lo) & (gt['image'] < hi)
+        pred_mask = (pred['image'] >= lo) & (pred['image'] < hi)
+        shards.append(({key: gt[key][gt_mask] for key in DETECTION_KEYS},
+                       {key: pred[key][pred_mask] for key in DETECTION_KEYS},
+                       iou_thresholds))
+        masks.append(pred_mask)
+    tp = np.zeros((len(pred['image']), len(iou_thresholds)), dtype=bool)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for mask, shard_tp in zip(masks, pool.map(_match_shard, shards)):
+            tp[mask] = shard_tp
+    return tp
+
+def precision_recall_curves(tp, score, pred_class, gt_class, num_classes):
+    """Per-class AP at each IoU threshold and the interpolated PR curve at the first
+
+    Returns (ap (C, T), precision (C, 101) on RECALL_GRID). AP uses the
+    COCO 101-point interpolation of the precision envelope.
+    """
+    order = np.argsort(-score, kind='stable')
+    tp, pred_class = tp[order], pred_class[order]
+    instances = np.bincount(gt_class, minlength=num_classes)
+    ap = np.zeros((num_classes, tp.shape[1]))
+    curves = np.zeros((num_classes, len(RECALL_GRID)))
+    for c in range(num_classes):
+        hits = tp[pred_class == c]
+        if not instances[c] or not len(hits):
+            continue
+        tp_cum = np.cumsum(hits, axis=0)
+        recall = tp_cum / instances[c]
+        precision = tp_cum / np.arange(1, len(hits) + 1)[:, None]
+        envelope = np.maximum.accumulate(precision[::-1], axis=0)[::-1]
+        for j in range(tp.shape[1]):
+            idx = np.searchsorted(recall[:, j], RECALL_GRID, side='left')
+            sampled = np.where(idx < len(hits), envelope[np.minimum(idx, len(hits) - 1), j], 0.0)
+            ap[c, j] = sampled.mean()
+            if j == 0:
+                curves[c] = sampled
+    return ap, curves
+
+def evaluate_detections(gt, pred, names=None, conf=0.25, iou_thresholds=IOU_THRESHOLDS, workers=1):
+    """mAP50 / mAP50-95 plus per-class and per-image breakdowns
+
+    gt and pred are flat detection sets (load_yolo_detections,
+    load_prediction_jsonl). pred is aligned onto gt's image list, so
+    predictions for images outside the audit set are ignored. Precision,
+    recall and the per-image counts are at IoU 0.5 and score >= conf.
+    """
+    pred = align_detections(pred, gt['images'])
+    num_classes = int(max(gt['class'].max(initial=-1), pred['class'].max(initial=-1))) + 1
+    if names:
+        num_classes = max(num_classes, len(names))
+    tp = match_detections_sharded(gt, pred, iou_thresholds, workers)
+    ap, curves = precision_recall_curves(tp, pred['score'], pred['class'], gt['class'], num_classes)
+
+    # P/R at conf come from matching only the confident predictions: in the
+    # all-score matching a low-score duplicate can take a ground truth box
+    # from a confident prediction, which would then count as a false positive
+    instances = np.bincount(gt['class'], minlength=num_classes)
+    confident = pred['score'] >= conf
+    tp50 = np.zeros(len(confident), dtype=bool)
+    kept = {key: pred[key][confident] for key in DETECTION_KEYS}
+    tp50[confident] = match_detections_sharded(gt, dict(kept, images=gt['images']),
+                                               iou_thresholds[:1], workers)[:, 0]
+    class_tp = np.bincount(pred['class'], weights=tp50, minlength=num_classes)
+    class_pred = np.bincount(pred['class'], weights=confident, minlength=num_classes)
+    precision = class_tp / np.maximum(class_pred, 1)
+    recall = class_tp / np.maximum(instances, 1)
+
+    num_images = len(gt['images'])
+    image_gt = np.bincount(gt['image'], minlength=num_images)
+    image_tp = np.bincount(pred['image'], weights=tp50, minlength=num_images).astype(np.int64)
+    image_fp = np.bincount(pred['image'], weights=confident, minlength=num_images).astype(np.int64) - image_tp
+
+    present = instances > 0
+    per_class = [
+        {
+            'class_id': c,
+            'name': names[c] if names and c < len(names) else str(c),
+            'instances': int(instances[c]),
+            'AP50': float(ap[c, 0]),
+            'AP50-95': float(ap[c].mean()),
+            'precision': float(precision[c]),
+            'recall': float(recall[c]),
+            'pr_curve': [round(float(p), 4) for p in curves[c]],
+        }
+        for c in range(num_classes)
+    ]
+    per_image = [
+        {'image': stem, 'instances': int(n), 'tp': int(t), 'fp': int(f), 'fn': int(n - t)}
+        for stem, n, t, f in zip(gt['images'], image_gt, image_tp, image_fp)
+    ]
+    return {
+        'images': num_images,
+        'instances': int(len(gt['class'])),
+        'predictions': int(len(pred['class'])),
+        'mAP50': float(ap[present, 0].mean()) if present.any() else 0.0,
+        'mAP50-95': float(ap[present].mean()) if present.any() else 0.0,
+        'precision': float(class_tp.sum() / max(class_pred.sum(), 1)),
+        'recall': float(class_tp.sum() / max(instances.sum(), 1)),
+        'conf': conf,
+        'per_class': per_class,
+        'per_image': per_image,
+    }
+
+MASK_FORMAT_VERSION = 1
+MASK_ENCODINGS = ('rle', 'bits')
+# Per-instance index columns in <split>/masks.index.npy; x/y/width/height is the mask's crop box in pixels
+MASK_COLUMNS = ('image', 'class_id', 'x', 'y', 'width', 'height', 'image_height', 'image_width', 'offset', 'length')
+(M_IMAGE, M_CLASS, M_X, M_Y, M_WIDTH, M_HEIGHT,
+ M_IMAGE_HEIGHT, M_IMAGE_WIDTH, M_OFFSET, M_LENGTH) = range(len(MASK_COLUMNS))
+
+def varint_encode(values):
+    """LEB128 bytes for non-negative ints (7 bits per byte, high bit = more follow)"""
+    values = np.asarray(values, dtype=np.uint64)
+    if not len(values):
+        return np.zeros(0, np.uint8)
+    bits = np.floor(np.log2(np.maximum(values, 1).astype(np.float64))).astype(np.int64) + 1
+    sizes = (bits + 6) // 7
+    repeated = np.repeat(values, sizes)
+    position = np.arange(len(repeated)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    out = (repeated >> (7 * position).astype(np.uint64)) & np.uint64(0x7F)
+    more = position < np.repeat(sizes - 1, sizes)
+    return (out | (more.astype(np.uint64) << np.uint64(7))).astype(np.uint8)
+
+def varint_decode(data):
+    data = np.asarray(data, dtype=np.uint8)
+    if not len(data):
+        return np.zeros(0, np.int64)
+    last = (data & 0x80) == 0
+    value_id = np.concatenate([[0], np.cumsum(last)[:-1]])
+    starts = np.flatnonzero(np.concatenate([[True], last[:-1]]))
+    position = np.arange(len(data)) - starts[value_id]
+    parts = (data & 0x7F).astype(np.int64) << (7 * position)
+    return np.add.reduceat(parts, starts)
+
+def rle_encode(mask):
+    """Run lengths of a binary mask in column-major order, starting with a zero run (COCO layout)"""
+    flat = np.asarray(mask, dtype=bool).ravel(order='F')
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    bounds = np.concatenate([[0], changes, [len(flat)]])
+    counts = np.diff(bounds)
+    if len(flat) and flat[0]:
+        counts = np.concatenate([[0], counts])
+    return counts
+
+def rle_decode(counts, shape):
+    values = np.arange(len(counts)) % 2 == 1
+    return np.repeat(values, counts).reshape(shape, order='F')
+
+def mask_crop(mask):
+    """(x, y, width, height) of a mask's set pixels, or None if it is empty"""
+    rows, cols = np.flatnonzero(mask.any(axis=1)), np.flatnonzero(mask.any(axis=0))
+    if not len(rows):
+        return None
+    return int(cols[0]), int(rows[0]), int(cols[-1] - cols[0] + 1), int(rows[-1] - rows[0] + 1)
+
+def encode_mask(mask, encoding='rle'):
+    """(crop box, bytes) for a full-image binary mask, cropped to its extent
+
+    rle stores varint run lengths (small for blobby regions); bits packs
+    the crop at one bit per pixel (predictable size, fastest to decode).
+    """
+    mask = np.asarray(mask, dtype=bool)
+    box = mask_crop(mask)
+    if box is None:
+        return (0, 0, 0, 0), b''
+    x, y, w, h = box
+    crop = mask[y:y + h, x:x + w]
+    if encoding == 'rle':
+        return box, varint_encode(rle_encode(crop)).tobytes()
+    if encoding == 'bits':
+        return box, np.packbits(crop, axis=None).tobytes()
+    raise ValueError(f"Unknown mask encoding: {encoding}")
+
+def decode_mask(data, box, image_shape=None, encoding='rle'):
+    """Crop (or full image_shape mask when given) from encode_mask output"""
+    x, y, w, h = (int(v) for v in box)
+    data = np.frombuffer(data, dtype=np.uint8) if isinstance(data, bytes) else np.asarray(data)
+    if encoding == 'rle':
+        crop = rle_decode(varint_decode(data), (h, w))
+    elif encoding == 'bits':
+        crop = np.unpackbits(data, count=h * w).reshape(h, w).astype(bool)
+    else:
+        raise ValueError(f"Unknown mask encoding: {encoding}")
+    if image_shape is None:
+        return crop
+    mask = np.zeros(image_shape[:2], dtype=bool)
+    mask[y:y + h, x:x + w] = crop
+    return mask
+
+def polygons_to_mask(polygons, height, width):
+    """Rasterize normalized YOLO polygons (flat x1 y1 x2 y2 ... arrays) into one mask"""
+    import cv2
+
+    mask = np.zeros((height, width), dtype=np.uint8)
+    points = [np.round(np.asarray(p, np.float32).reshape(-1, 2) * (width, height)).astype(np.int32)
+              for p in polygons]
+    cv2.fillPoly(mask, points, 1)
+    return mask.astype(bool)
+
+def mask_to_polygon_lines(mask, class_id, min_area=0):
+    """YOLO polygon label lines for each external contour of a mask"""
+    import cv2
+
+    height, width = mask.shape[:2]
+    contours, _ = cv2.findContours(mask.astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    lines = []
+    for contour in contours:
+        if len(contour) < 3 or cv2.contourArea(contour) < min_area:
+            continue
+        points = contour.reshape(-1, 2) / (width, height)
+        lines.append(f"{class_id} " + ' '.join(f"{v:.6f}" for v in points.ravel()))
+    return lines
+
+class MaskStoreWriter:
+    """Writes one split's instance masks into a single indexed store
+
+    <split>/masks.bin holds the encoded masks back to back, masks.index.npy
+    the int64 MASK_COLUMNS per instance, masks.names.txt the image stems
+    and masks.json the encoding. Same blob + index layout as the packed
+    image shards, so reading is a memmap and a few array lookups.
+    """
+
+    def __init__(self, split_dir, encoding='rle'):
+        if encoding not in MASK_ENCODINGS:
+            raise ValueError(f"Unknown mask encoding: {encoding}")
+        self.split_dir = split_dir
+        self.encoding = encoding
+        self.blob = open(os.path.join(split_dir, 'masks.bin'), 'wb')
+        self.offset = 0
+        self.index = []
+        self.names = []
+
+    def add_image(self, name):
+        self.names.append(name)
+        return len(self.names) - 1
+
+    def add(self, image, class_id, box, image_shape, data):
+        self.blob.write(data)
+        self.index.append((image, class_id, *box, image_shape[0], image_shape[1], self.offset, len(data)))
+        self.offset += len(data)
+
+    def add_mask(self, image, class_id, mask):
+        box, data = encode_mask(mask, self.encoding)
+        self.add(image, class_id, box, mask.shape, data)
+
+    def close(self):
+        self.blob.close()
+        index = np.asarray(self.index, dtype=np.int64).reshape(-1, len(MASK_COLUMNS))
+        np.save(os.path.join(self.split_dir, 'masks.index.npy'), index)
+        with open(os.path.join(self.split_dir, 'masks.names.txt'), 'w') as f:
+            f.write('\n'.join(self.names))
+        with open(os.path.join(self.split_dir, 'masks.json'), 'w') as f:
+            json.dump({'format_version': MASK_FORMAT_VERSION, 'encoding': self.encoding,
+                       'images': len(self.names), 'instances': len(index), 'bytes': self.offset}, f, indent=2)
+        return len(index)
+
+class MaskStore:
+    """Memory-mapped reader for a split's masks.* files"""
+
+    def __init__(self, split_dir):
+        with open(os.path.join(split_dir, 'masks.json'), 'r') as f:
+            self.header = json.load(f)
+        if self.header.get('format_version') != MASK_FORMAT_VERSION:
+            raise ValueError(f"Unsupported mask store format: {split_dir}")
+        self.encoding = self.header['encoding']
+        self.index = np.load(os.path.join(split_dir, 'masks.index.npy'))
+        self.blob = (np.memmap(os.path.join(split_dir, 'masks.bin'), dtype=np.uint8, mode='r')
+                     if self.header['bytes'] else np.zeros(0, np.uint8))
+        with open(os.path.join(split_dir, 'masks.names.txt'), 'r') as f:
+            self.names = f.read().splitlines()
+        self.positions = {name: i for i, name in enumerate(self.names)}
+        # Instances are written image by image, so each image's rows are one contiguous range
+        self._starts = np.searchsorted(self.index[:, M_IMAGE], np.arange(len(self.names) + 1))
+
+    def __len__(self):
+        return len(self.names)
+
+    def instances(self, image):
+        """Index rows for an image (position or stem)"""
+        i = self.positions[image] if isinstance(image, str) else image
+        return self.index[self._starts[i]:self._starts[i + 1]]
+
+    def masks(self, image, full=True):
+        """(class ids, masks) for one image: full-size bool masks, or crops if full=False"""
+        rows = self.instances(image)
+        masks = []
+        for row in rows:
+            data = self.blob[row[M_OFFSET]:row[M_OFFSET] + row[M_LENGTH]]
+            shape = (int(row[M_IMAGE_HEIGHT]), int(row[M_IMAGE_WIDTH])) if full else None
+            masks.append(decode_mask(data, row[M_X:M_HEIGHT + 1], shape, self.encoding))
+        return rows[:, M_CLASS].copy(), masks
+
+def _split_dirs(dataset_dir):
+    return [os.path.join(dataset_dir, split) for split in ('train', 'valid')
+            if os.path.isdir(os.path.join(dataset_dir, split, 'labels'))]
+
+def _image_size(images_dir, stem):
+    from PIL import Image
+
+    for path in glob.glob(os.path.join(images_dir, glob.escape(stem) + '.*')):
+        if path.lower().endswith(IMAGE_EXTENSIONS):
+            with Image.open(path) as img:
+                return img.height, img.width
+    raise FileNotFoundError(f"No image for label {stem} in {images_dir}")
+
+def polygon_labels_to_masks(dataset_dir, encoding='rle'):
+    """Move polygon labels into per-split mask stores, leaving box labels
+
+    Every polygon row is rasterized at the image's resolution into the
+    store and replaced by its bounding box row, so detection training
+    reads exactly the boxes it derived from the polygons before. Returns
+    {split: (instances, label bytes before, label + store bytes after)}.
+    """
+    summary = {}
+    for split_dir in _split_dirs(dataset_dir):
+        writer = MaskStoreWriter(split_dir, encoding)
+        before = after = 0
+        for label_path in sorted(glob.glob(os.path.join(split_dir, 'labels', '*.txt'))):
+            stem = os.path.splitext(os.path.basename(label_path))[0]
+            image = writer.add_image(stem)
+            before += os.path.getsize(label_path)
+            with open(label_path, 'r') as f:
+                rows = [line.split() for line in f if line.strip()]
+            if any(len(row) > 5 for row in rows):
+                height, width = _image_size(os.path.join(split_dir, 'images'), stem)
+            lines = []
+            for row in rows:
+                if len(row) <= 5:
+                    lines.append(' '.join(row))
+                    continue
+                coords = np.asarray(row[1:], dtype=np.float32)
+                writer.add_mask(image, int(row[0]), polygons_to_mask([coords], height, width))
+                xs, ys = coords[0::2], coords[1::2]
+                x1, y1, x2, y2 = xs.min(), ys.min(), xs.max(), ys.max()
+                lines.append(f"{row[0]} {(x1 + x2) / 2:.6f} {(y1 + y2) / 2:.6f} {x2 - x1:.6f} {y2 - y1:.6f}")
+            with open(label_path, 'w') as f:
+                f.write('\n'.join(lines))
+            after += os.path.getsize(label_path)
+        instances = writer.close()
+        after += sum(os.path.getsize(os.path.join(split_dir, f"masks.{ext}"))
+                     for ext in ('bin', 'index.npy', 'names.txt', 'json'))
+        summary[os.path.basename(split_dir)] = (instances, before, after)
+    return summary
+
+def masks_to_polygon_labels(dataset_dir, min_area=0):
+    """Rewrite label files with polygons traced from each split's mask store
+
+    Inverse of polygon_labels_to_masks for tools that expect polygon
+    labels. Each stored instance replaces one box row of its class in
+    file order; box rows without a stored mask are kept.
+    """
+    summary = {}
+    for split_dir in _split_dirs(dataset_dir):
+        store = MaskStore(split_dir)
+        for stem in store.names:
+            class_ids, masks = store.masks(stem)
+            label_path = os.path.join(split_dir, 'labels', f"{stem}.txt")
+            with open(label_path, 'r') as f:
+                rows = [line.split() for line in f if line.strip()]
+            pending = list(zip(class_ids.tolist(), masks))
+            lines = []
+            for row in rows:
+                match = next((i for i, (c, _) in enumerate(pending) if c == int(row[0])), None)
+                if match is None:
+                    lines.append(' '.join(row))
+                    continue
+                class_id, mask = pending.pop(match)
+                lines.extend(mask_to_polygon_lines(mask, class_id, min_area))
+            for class_id, mask in pending:
+                lines.extend(mask_to_polygon_lines(mask, class_id, min_area))
+            with open(label_path, 'w') as f:
+                f.write('\n'.join(lines))
+        summary[os.path.basename(split_dir)] = len(store.index)
+    return summary
+
+def extract_archive(archive, destination):
+    """Extract a .tar.gz from S3 without letting members escape destination"""
+    with tarfile.open(archive) as tar:
+        if hasattr(tarfile, 'data_filter'):
+            tar.extractall(destination, filter='data')
+            return
+        # Pythons without extraction filters: only plain files and dirs inside destination
+        root = os.path.realpath(destination)
+        for member in tar.getmembers():
+            target = os.path.realpath(os.path.join(root, member.name))
+            if not (member.isfile() or member.isdir()) or os.path.commonpath([root, target]) != root:
+                raise ValueError(f"Refusing to extract {member.name!r} from {archive}")
+        tar.extractall(destination)
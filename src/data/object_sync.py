@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import shutil
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+MANIFEST_VERSION = 1
+# Written next to the synced files: the remote copy replaces listing the bucket,
+# the local copy lets unchanged files skip rehashing (same size and mtime)
+REMOTE_MANIFEST = '_manifest.json'
+LOCAL_MANIFEST = '.sync_manifest.json'
+EXCLUDED_NAMES = (REMOTE_MANIFEST, LOCAL_MANIFEST, '.DS_Store')
+
+MULTIPART_THRESHOLD = 64 * 1024 * 1024
+MULTIPART_CHUNK_SIZE = 16 * 1024 * 1024
+# Parts in flight per multipart transfer (on top of the per-file workers)
+PART_CONCURRENCY = 4
+
+def sha256_file(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def split_uri(uri):
+    """s3://bucket/prefix -> ('bucket', 'prefix')"""
+    bucket, _, prefix = uri[len('s3://'):].partition('/')
+    return bucket, prefix.strip('/')
+
+class LocalBackend:
+    """Directory standing in for a bucket prefix (tests, NFS, local runs)"""
+    
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+    
+    def _path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+    
+    def read_manifest(self):
+        path = self._path(REMOTE_MANIFEST)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            return json.load(f)
+    
+    def write_manifest(self, manifest):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = self._path(REMOTE_MANIFEST) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self._path(REMOTE_MANIFEST))
+    
+    def list_sizes(self):
+        """{key: size} of every object (only used when there is no manifest yet)"""
+        sizes = {}
+        for root, _, names in os.walk(self.root):
+            for name in names:
+                if name in EXCLUDED_NAMES or name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                sizes[os.path.relpath(path, self.root).replace(os.sep, '/')] = os.path.getsize(path)
+        return sizes
+    
+    def upload(self, local_path, key):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(local_path, path + '.tmp')
+        os.replace(path + '.tmp', path)
+    
+    def download(self, key, local_path):
+        shutil.copyfile(self._path(key), local_path)
+    
+    def delete(self, key):
+        os.remove(self._path(key))
+
+class S3Backend:
+    """Bucket prefix behind one shared, thread-safe boto3 client
+    
+    The client's connection pool is sized for every worker's in-flight
+    requests, so connections are reused instead of re-established per
+    object. Files above MULTIPART_THRESHOLD go up and down in parts.
+    """
+    
+    def __init__(self, bucket, prefix, workers=16, client=None):
+        import boto3
+        from botocore.config import Config
+        from boto3.s3.transfer import TransferConfig
+        
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = client or boto3.client('s3', config=Config(
+            max_pool_connections=workers * PART_CONCURRENCY,
+            retries={'max_attempts': 10, 'mode': 'adaptive'},
+        ))
+        self.transfer_config = TransferConfig(
+            multipart_threshold=MULTIPART_THRESHOLD,
+            multipart_chunksize=MULTIPART_CHUNK_SIZE,
+            max_concurrency=PART_CONCURRENCY,
+        )
+    
+    def _key(self, key):
+        return f"{self.prefix}/{key}" if self.prefix else key
+    
+    def read_manifest(self):
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._key(REMOTE_MANIFEST))
+        except self.client.exceptions.NoSuchKey:
+            return None
+        return json.loads(response['Body'].read())
+    
+    def write_manifest(self, manifest):
+        self.client.put_object(Bucket=self.bucket, Key=self._key(REMOTE_MANIFEST),
+                               Body=json.dumps(manifest).encode(), ContentType='application/json')
+    
+    def list_sizes(self):
+        sizes = {}
+        start = len(self.prefix) + 1 if self.prefix else 0
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._key('')):
+            for obj in page.get('Contents', []):
+                key = obj['Key'][start:]
+                if key and key.rsplit('/', 1)[-1] not in EXCLUDED_NAMES:
+                    sizes[key] = obj['Size']
+        return sizes
+    
+    def upload(self, local_path, key):
+        self.client.upload_file(local_path, self.bucket, self._key(key), Config=self.transfer_config)
+    
+    def download(self, key, local_path):
+        self.client.download_file(self.bucket, self._key(key), local_path, Config=self.transfer_config)
+    
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+def make_backend(uri, workers=16):
+    """S3Backend for s3:// URIs, LocalBackend for anything else"""
+    if uri.startswith('s3://'):
+        return S3Backend(*split_uri(uri), workers=workers)
+    if uri.startswith('file://'):
+        uri = uri[len('file://'):]
+    return LocalBackend(uri)
+
+def new_manifest(files=None):
+    return {'version': MANIFEST_VERSION, 'files': files or {}}
+
+def scan_local(local_dir, workers=16):
+    """Manifest of local_dir, rehashing only files whose size or mtime changed
+    
+    Entries are {relative key: {'sha256', 'size', 'mtime_ns'}}.
+    """
+    previous = {}
+    cache_path = os.path.join(local_dir, LOCAL_MANIFEST)
+    if os.path.exists(cache_path):
+        with open(cache_path, 'r') as f:
+            previous = json.load(f).get('files', {})
+    
+    files, to_hash = {}, []
+    for root, dirs, names in os.walk(local_dir):
+        dirs.sort()
+        for name in sorted(names):
+            if name in EXCLUDED_NAMES:
+                continue
+            path = os.path.join(root, name)
+            key = os.path.relpath(path, local_dir).replace(os.sep, '/')
+            stat = os.stat(path)
+            entry = previous.get(key)
+            if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+                files[key] = entry
+            else:
+                to_hash.append((key, path, stat))
+    
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        hashes = pool.map(lambda item: sha256_file(item[1]), to_hash)
+        for (key, _, stat), digest in zip(to_hash, hashes):
+            files[key] = {'sha256': digest, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    return new_manifest(files), len(to_hash)
+
+def save_local_manifest(local_dir, manifest):
+    with open(os.path.join(local_dir, LOCAL_MANIFEST), 'w') as f:
+        json.dump(manifest, f)
+
+def remote_manifest(backend, local_files=None):
+    """The remote manifest, bootstrapped from a listing the first time
+    
+    Without a manifest, an object counts as unchanged when its size matches
+    the local file (what `aws s3 sync` compares too); every later run diffs
+    content hashes.
+    """
+    manifest = backend.read_manifest()
+    if manifest is not None:
+        return manifest
+    print("🗂️ No remote manifest yet, listing objects once to bootstrap it")
+    local_files = local_files or {}
+    files = {}
+    for key, size in backend.list_sizes().items():
+        local = local_files.get(key)
+        files[key] = {'sha256': local['sha256'] if local and local['size'] == size else None, 'size': size}
+    return new_manifest(files)
+
+def diff_manifests(source, target):
+    """(keys to copy, keys to delete) to make target match source"""
+    source_files, target_files = source['files'], target['files']
+    changed = [
+        key for key, entry in source_files.items()
+        if key not in target_files or target_files[key].get('sha256') != entry['sha256']
+    ]
+    removed = [key for key in target_files if key not in source_files]
+    return sorted(changed), sorted(removed)
+
+class SyncReport:
+    def __init__(self, direction, total_files):
+        self.direction = direction
+        self.total_files = total_files
+        self.files = 0
+        self.bytes = 0
+        self.deleted = 0
+        self.failed = []
+        self.start = time.perf_counter()
+        self.seconds = 0.0
+    
+    def finish(self):
+        self.seconds = time.perf_counter() - self.start
+        return self
+    
+    def as_dict(self):
+        seconds = max(self.seconds, 1e-9)
+        return {
+            'direction': self.direction,
+            'files_total': self.total_files,
+            'files_transferred': self.files,
+            'files_skipped': self.total_files - self.files - len(self.failed),
+            'files_deleted': self.deleted,
+            'files_failed': len(self.failed),
+            'bytes': self.bytes,
+            'seconds': round(self.seconds, 2),
+            'MB_per_s': round(self.bytes / seconds / 1e6, 2),
+            'files_per_s': round(self.files / seconds, 1),
+        }
+    
+    def print(self):
+        stats = self.as_dict()
+        status = "✅" if not self.failed else "⚠️"
+        print(f"{status} {self.direction}: {stats['files_transferred']} transferred, "
+              f"{stats['files_skipped']} unchanged, {stats['files_deleted']} deleted, "
+              f"{stats['files_failed']} failed in {stats['seconds']:.1f}s "
+              f"({stats['MB_per_s']:.1f} MB/s, {stats['files_per_s']:.0f} files/s)")
+        for key, error in self.failed[:10]:
+            print(f"  ❌ {key}: {error}")
+
+def _transfer_all(keys, transfer, workers, report, sizes):
+    """Run transfer(key) across a bounded pool; returns the keys that succeeded"""
+    done = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(transfer, key): key for key in keys}
+        for count, future in enumerate(as_completed(futures), 1):
+            key = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                report.failed.append((key, str(e)))
+                continue
+            done.append(key)
+            report.files += 1
+            report.bytes += sizes[key]
+            if count % 1000 == 0:
+                elapsed = time.perf_counter() - report.start
+                print(f"  {count}/{len(keys)} ({report.bytes / elapsed / 1e6:.1f} MB/s)")
+    return done
+
+def push(local_dir, remote_uri, delete=False, workers=16, backend=None, dry_run=False):
+    """Upload files whose content hash differs from the remote manifest"""
+    backend = backend or make_backend(remote_uri, workers)
+    local, rehashed = scan_local(local_dir, workers)
+    remote = remote_manifest(backend, local['files'])
+    changed, removed = diff_manifests(local, remote)
+    print(f"🔁 push {local_dir} -> {remote_uri}: {len(local['files'])} files "
+          f"({rehashed} rehashed), {len(changed)} to upload, {len(removed) if delete else 0} to delete")
+    report = SyncReport('push', len(local['files']))
+    if dry_run:
+        return report.finish()
+    
+    sizes = {key: entry['size'] for key, entry in local['files'].items()}
+    uploaded = _transfer_all(
+        changed, lambda key: backend.upload(os.path.join(local_dir, *key.split('/')), key),
+        workers, report, sizes
+    )
+    
+    # Record only what is really on the remote, so failures retry next run
+    files = dict(remote['files'])
+    for key in uploaded:
+        files[key] = {'sha256': local['files'][key]['sha256'], 'size': sizes[key]}
+    if delete:
+        for key in removed:
+            try:
+                backend.delete(key)
+            except Exception as e:
+                report.failed.append((key, str(e)))
+                continue
+            files.pop(key, None)
+            report.deleted += 1
+    backend.write_manifest(new_manifest(files))
+    save_local_manifest(local_dir, local)
+    report.finish().print()
+    return report
+
+def pull(remote_uri, local_dir, delete=False, workers=16, backend=None, dry_run=False):
+    """Download objects whose content hash differs from the local files"""
+    backend = backend or make_backend(remote_uri, workers)
+    os.makedirs(local_dir, exist_ok=True)
+    local, rehashed = scan_local(local_dir, workers)
+    remote = backend.read_manifest()
+    if remote is None:
+        raise FileNotFoundError(f"No {REMOTE_MANIFEST} under {remote_uri}; push it with object_sync first")
+    changed, removed = diff_manifests(remote, local)
+    print(f"🔁 pull {remote_uri} -> {local_dir}: {len(remote['files'])} files "
+          f"({rehashed} rehashed locally), {len(changed)} to download, {len(removed) if delete else 0} to delete")
+    report = SyncReport('pull', len(remote['files']))
+    if dry_run:
+        return report.finish()
+    
+    def download(key):
+        path = os.path.join(local_dir, *key.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        backend.download(key, path + '.part')
+        os.replace(path + '.part', path)
+    
+    sizes = {key: entry['size'] for key, entry in remote['files'].items()}
+    downloaded = _transfer_all(changed, download, workers, report, sizes)
+    # Downloaded files carry the remote hash, so the next scan needn't rehash them
+    for key in downloaded:
+        stat = os.stat(os.path.join(local_dir, *key.split('/')))
+        local['files'][key] = {'sha256': remote['files'][key]['sha256'], 'size': stat.st_size,
+                               'mtime_ns': stat.st_mtime_ns}
+    if delete:
+        for key in removed:
+            os.remove(os.path.join(local_dir, *key.split('/')))
+            local['files'].pop(key)
+            report.deleted += 1
+    save_local_manifest(local_dir, local)
+    report.finish().print()
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Manifest-diff sync between a directory and S3 (or another directory)")
+    parser.add_argument('direction', choices=['push', 'pull'])
+    parser.add_argument('source', help='push: local dir; pull: s3://bucket/prefix or dir')
+    parser.add_argument('destination', help='push: s3://bucket/prefix or dir; pull: local dir')
+    parser.add_argument('--delete', action='store_true', help='Remove files missing from the source')
+    parser.add_argument('--workers', type=int, default=32, help='Files transferred concurrently')
+    parser.add_argument('--dry-run', action='store_true')
+    parser.add_argument('--report', default=None, help='Write throughput stats to this JSON file')
+    args = parser.parse_args()
+    
+    sync = push if args.direction == 'push' else pull
+    report = sync(args.source, args.destination, delete=args.delete, workers=args.workers, dry_run=args.dry_run)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report.as_dict(), f, indent=2)
+    if report.failed:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+import os
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+CLASS_NAMES = ['damage']
+# Mark types composited onto the shingles
+DENT, GRANULE_LOSS, BRUISE = range(3)
+
+# RGB base colors of common asphalt shingles
+SHINGLE_PALETTE = np.array([
+    [92, 92, 96],     # slate gray
+    [70, 62, 58],     # weathered wood
+    [48, 48, 52],     # charcoal
+    [112, 90, 72],    # desert tan
+    [84, 70, 60],     # brown
+    [60, 66, 74],     # blue-gray
+], dtype=np.float32)
+
+_NOISE_BANKS = {}
+
+def noise_bank(size):
+    """Per-process (2*size, 2*size, 3) multiplicative granule noise
+    
+    Generated once and randomly cropped per image; drawing fresh normals
+    for every pixel of every image costs more than the rest of rendering.
+    """
+    if size not in _NOISE_BANKS:
+        rng = np.random.default_rng(size)
+        granules = 1.0 + rng.standard_normal((2 * size, 2 * size, 1), dtype=np.float32) * 0.12
+        jitter = 1.0 + rng.standard_normal((2 * size, 2 * size, 3), dtype=np.float32) * 0.04
+        _NOISE_BANKS[size] = granules * jitter
+    return _NOISE_BANKS[size]
+
+def shingle_shading(rng, batch, size):
+    """(batch, size, size) float32 three-tab shingle layout and lighting"""
+    y = np.arange(size, dtype=np.float32)[None, :, None]
+    x = np.arange(size, dtype=np.float32)[None, None, :]
+    
+    course = rng.uniform(size / 10, size / 6, (batch, 1, 1)).astype(np.float32)
+    tab = course * rng.uniform(2.5, 3.5, (batch, 1, 1)).astype(np.float32)
+    y = y + rng.uniform(0, size, (batch, 1, 1)).astype(np.float32)
+    row = np.floor(y / course)
+    y_in = y / course - row
+    
+    # Per-course tone variation, indexed by course number
+    tones = rng.uniform(0.9, 1.1, (batch, 64)).astype(np.float32)
+    tone = np.take_along_axis(tones, row.astype(np.int64).reshape(batch, -1) % 64, axis=1)
+    shade = (1.0 - 0.2 * y_in) * tone.reshape(batch, size, 1)
+    shade = np.where(y_in > 0.93, np.float32(0.45), shade)  # shadow under the course above
+    
+    # Slots between tabs; alternate courses are offset by half a tab, so
+    # only two column patterns per image are needed
+    x_in = np.mod(x + rng.uniform(0, size, (batch, 1, 1)).astype(np.float32), tab)
+    gap = np.maximum(tab * 0.02, 2)
+    slots_even = x_in < gap
+    slots_odd = np.mod(x_in + tab / 2, tab) < gap
+    slots = np.where(row % 2 == 1, slots_odd, slots_even)
+    
+    # Lighting: per-image linear gradient plus brightness
+    xs = np.linspace(-1, 1, size, dtype=np.float32)
+    light = (1 + rng.uniform(-0.15, 0.15, (batch, 1, 1)).astype(np.float32) * xs) \
+        * rng.uniform(0.8, 1.25, (batch, 1, 1)).astype(np.float32)
+    return np.where(slots, np.float32(0.4), shade) * light
+
+def sample_marks(rng, batch, size, max_marks):
+    """Random hail mark parameters for a batch, one row per mark"""
+    counts = rng.integers(1, max_marks + 1, batch)
+    total = int(counts.sum())
+    marks = {
+        'image': np.repeat(np.arange(batch), counts),
+        'type': rng.integers(0, 3, total),
+        'radius': rng.uniform(size * 0.012, size * 0.045, total).astype(np.float32),
+        'aspect': rng.uniform(0.65, 1.0, total).astype(np.float32),
+        'theta': rng.uniform(0, np.pi, total).astype(np.float32),
+        'jag': rng.uniform(0.0, 0.18, total).astype(np.float32),
+        'lobes': rng.integers(3, 8, total).astype(np.float32),
+        'phase': rng.uniform(0, 2 * np.pi, total).astype(np.float32),
+        'strength': rng.uniform(0.0, 1.0, total).astype(np.float32),
+    }
+    half_w, half_h = mark_extents(marks)
+    marks['cx'] = rng.uniform(half_w, size - half_w).astype(np.float32)
+    marks['cy'] = rng.uniform(half_h, size - half_h).astype(np.float32)
+    return marks
+
+def mark_extents(marks):
+    """Half width/height of each mark's rotated, jagged ellipse (incl. dent rim)"""
+    a = marks['radius'] * (1 + marks['jag']) * np.where(marks['type'] == DENT, 1.15, 1.0)
+    b = a * marks['aspect']
+    cos, sin = np.cos(marks['theta']), np.sin(marks['theta'])
+    return np.sqrt((a * cos) ** 2 + (b * sin) ** 2), np.sqrt((a * sin) ** 2 + (b * cos) ** 2)
+
+def render_marks(marks, batch, size):
+    """Touched pixel indices with their mat alpha and rim highlight, for all marks at once
+    
+    Each mark is evaluated on a fixed-size window around its center, so
+    the work scales with total mark area rather than batch x image area.
+    """
+    half_w, half_h = mark_extents(marks)
+    reach = int(np.ceil(max(half_w.max(), half_h.max()))) + 1
+    offsets = np.arange(-reach, reach + 1, dtype=np.float32)
+    
+    # (M, P, P) pixel coordinates of each mark's window
+    xs = np.round(marks['cx'])[:, None, None] + offsets[None, None, :]
+    ys = np.round(marks['cy'])[:, None, None] + offsets[None, :, None]
+    dx = xs - marks['cx'][:, None, None]
+    dy = ys - marks['cy'][:, None, None]
+    
+    cos, sin = np.cos(marks['theta'])[:, None, None], np.sin(marks['theta'])[:, None, None]
+    u = (dx * cos + dy * sin) / marks['radius'][:, None, None]
+    v = (-dx * sin + dy * cos) / (marks['radius'] * marks['aspect'])[:, None, None]
+    angle = np.arctan2(v, u)
+    edge = 1 + marks['jag'][:, None, None] * np.sin(
+        marks['lobes'][:, None, None] * angle + marks['phase'][:, None, None])
+    d = np.sqrt(u * u + v * v) / edge
+    
+    kind = marks['type'][:, None, None]
+    strength = marks['strength'][:, None, None]
+    alpha = np.select(
+        [kind == GRANULE_LOSS, kind == DENT],
+        [np.clip((1 - d) / 0.12, 0, 1) * (0.7 + 0.25 * strength),
+         np.exp(-2.5 * d * d) * (0.5 + 0.3 * strength)],
+        np.exp(-1.5 * d * d) * (0.4 + 0.25 * strength) * (d < 1.3),
+    ).astype(np.float32)
+    rim = np.where(kind == DENT, np.exp(-((d - 1) / 0.12) ** 2) * (0.15 + 0.2 * strength), 0)
+    
+    inside = (xs >= 0) & (xs < size) & (ys >= 0) & (ys < size) & ((alpha > 1e-3) | (rim > 1e-3))
+    flat = (marks['image'][:, None, None] * size * size + ys * size + xs).astype(np.int64)[inside]
+    alpha_map = np.zeros(batch * size * size, dtype=np.float32)
+    rim_map = np.zeros(batch * size * size, dtype=np.float32)
+    np.maximum.at(alpha_map, flat, alpha[inside])
+    np.add.at(rim_map, flat, rim[inside].astype(np.float32))
+    
+    # Only touched pixels are returned, so compositing stays sparse
+    pixels = np.flatnonzero((alpha_map > 0) | (rim_map > 0))
+    return pixels, alpha_map[pixels], rim_map[pixels]
+
+def marks_to_labels(marks, batch, size):
+    """Exact YOLO [class, cx, cy, w, h] rows per image from mark geometry"""
+    half_w, half_h = mark_extents(marks)
+    rows = np.stack([
+        np.zeros_like(half_w),
+        marks['cx'] / size,
+        marks['cy'] / size,
+        2 * half_w / size,
+        2 * half_h / size,
+    ], axis=1)
+    splits = np.cumsum(np.bincount(marks['image'], minlength=batch))[:-1]
+    return np.split(rows, splits)
+
+def generate_batch(rng, batch, size, max_marks=8):
+    """(batch, size, size, 3) uint8 RGB images and their YOLO label arrays
+    
+    Layout, lighting and hail marks are computed for the whole batch at
+    once; only the final noise/color/composite pass walks the images, so
+    the float working set stays one image in size.
+    """
+    shade = shingle_shading(rng, batch, size)
+    base = SHINGLE_PALETTE[rng.integers(0, len(SHINGLE_PALETTE), batch)]
+    base = base * rng.uniform(0.85, 1.2, (batch, 1)).astype(np.float32)
+    marks = sample_marks(rng, batch, size, max_marks)
+    pixels, alpha, rim = render_marks(marks, batch, size)
+    
+    # Exposed fiberglass mat is a darker version of the same pixel, which
+    # keeps the granule noise and lighting: img * (1 - a) + img * ratio * a
+    # Clamped so marks stay visible on dark shingles
+    mat_ratio = np.minimum(rng.uniform(22, 48, batch).astype(np.float32) / base.mean(axis=1), 0.6)
+    image_of_pixel = pixels // (size * size)
+    factor = (1 - alpha * (1 - mat_ratio[image_of_pixel]))[:, None]
+    highlight = (rim * 255 * 0.25)[:, None]
+    bounds = np.searchsorted(image_of_pixel, np.arange(batch + 1))
+    
+    bank = noise_bank(size)
+    offsets = rng.integers(0, size, (batch, 2))
+    images = np.empty((batch, size, size, 3), dtype=np.uint8)
+    work = np.empty((size, size, 3), dtype=np.float32)
+    flat = work.reshape(-1, 3)
+    for i, (oy, ox) in enumerate(offsets):
+        np.multiply(bank[oy:oy + size, ox:ox + size], shade[i, :, :, None], out=work)
+        work *= base[i]
+        lo, hi = bounds[i], bounds[i + 1]
+        local = pixels[lo:hi] - i * size * size
+        flat[local] = flat[local] * factor[lo:hi] + highlight[lo:hi]
+        np.clip(work, 0, 255, out=work)
+        images[i] = work
+    return images, marks_to_labels(marks, batch, size)
+
+def write_batch(task):
+    """Generate one batch and stream it into the train/valid layout"""
+    from PIL import Image
+    
+    batch_index, batch, size, seed, output_dir, valid_fraction, quality, max_marks = task
+    rng = np.random.default_rng([seed, batch_index])
+    images, labels = generate_batch(rng, batch, size, max_marks)
+    splits = np.where(rng.random(batch) < valid_fraction, 'valid', 'train')
+    
+    counts = {'train': 0, 'valid': 0, 'marks': 0}
+    for j, (image, rows, split) in enumerate(zip(images, labels, splits)):
+        stem = f"synthetic_{seed}_{batch_index:06d}_{j:03d}"
+        Image.fromarray(image).save(os.path.join(output_dir, split, 'images', f"{stem}.jpg"), quality=quality)
+        with open(os.path.join(output_dir, split, 'labels', f"{stem}.txt"), 'w') as f:
+            f.write('\n'.join(f"{int(r[0])} {r[1]:.6f} {r[2]:.6f} {r[3]:.6f} {r[4]:.6f}" for r in rows))
+        counts[split] += 1
+        counts['marks'] += len(rows)
+    return counts
+
+def write_data_yaml(output_dir):
+    """Write data.yaml unless the output already holds a labeled dataset"""
+    import yaml
+    
+    path = os.path.join(output_dir, 'data.yaml')
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            names = (yaml.safe_load(f) or {}).get('names', [])
+        if isinstance(names, dict):
+            names = [names[k] for k in sorted(names)]
+        if list(names[:1]) != CLASS_NAMES:
+            raise ValueError(f"{path} has classes {names}; synthetic labels use {CLASS_NAMES}")
+        return path
+    data = {
+        'names': CLASS_NAMES,
+        'nc': len(CLASS_NAMES),
+        'train': 'train/images',
+        'val': 'valid/images',
+    }
+    with open(path, 'w') as f:
+        yaml.safe_dump(data, f, sort_keys=False)
+    return path
+
+def generate_dataset(output_dir, count, img_size=640, batch_size=32, workers=None, seed=0,
+                     valid_fraction=0.2, quality=90, max_marks=8):
+    """Generate count labeled images into output_dir/{train,valid}/{images,labels}"""
+    for split in ('train', 'valid'):
+        os.makedirs(os.path.join(output_dir, split, 'images'), exist_ok=True)
+        os.makedirs(os.path.join(output_dir, split, 'labels'), exist_ok=True)
+    write_data_yaml(output_dir)
+    
+    tasks = []
+    for batch_index, start in enumerate(range(0, count, batch_size)):
+        batch = min(batch_size, count - start)
+        tasks.append((batch_index, batch, img_size, seed, output_dir, valid_fraction, quality, max_marks))
+    
+    workers = workers or os.cpu_count() or 1
+    print(f"🎨 Generating {count} synthetic images ({img_size}px) with {workers} workers...")
+    totals = {'train': 0, 'valid': 0, 'marks': 0}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(write_batch, task) for task in tasks]
+        for done, future in enumerate(as_completed(futures), 1):
+            for key, value in future.result().items():
+                totals[key] += value
+            if done % max(1, len(futures) // 10) == 0 or done == len(futures):
+                elapsed = time.perf_counter() - start
+                generated = totals['train'] + totals['valid']
+                print(f"  {generated}/{count} images ({generated / elapsed * 60:.0f} images/min)")
+    
+    elapsed = time.perf_counter() - start
+    print(f"✅ Wrote {totals['train']} train / {totals['valid']} valid images with "
+          f"{totals['marks']} damage boxes in {elapsed:.1f}s")
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic hail-damage training images")
+    parser.add_argument('--output-dir', required=True, help='Dataset root; existing train/valid splits are extended')
+    parser.add_argument('--count', type=int, default=10000)
+    parser.add_argument('--img-size', type=int, default=640)
+    parser.add_argument('--batch-size', type=int, default=32, help='Images rendered together per worker task')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0, help='Different seeds give disjoint file names')
+    parser.add_argument('--valid-fraction', type=float, default=0.2)
+    parser.add_argument('--jpeg-quality', type=int, default=90)
+    parser.add_argument('--max-marks', type=int, default=8, help='Maximum hail marks per image')
+    args = parser.parse_args()
+    
+    generate_dataset(
+        args.output_dir, args.count, args.img_size, args.batch_size, args.workers,
+        args.seed, args.valid_fraction, args.jpeg_quality, args.max_marks
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import urllib.request
+
+INDEX_FILE = 'index.json'
+# Registries searched in order: a 'weights' channel mounted on the job, then the copy baked into the image
+CHANNEL_DIR = os.environ.get('SM_CHANNEL_WEIGHTS', '/opt/ml/input/data/weights')
+IMAGE_DIR = os.environ.get('WEIGHTS_REGISTRY', '/opt/weights')
+
+# Upstream locations, only contacted when a registry is built
+KNOWN_WEIGHTS = {
+    'yolov8n.pt': 'https://github.com/ultralytics/assets/releases/download/v0.0.0/yolov8n.pt',
+    'Arial.ttf': 'https://ultralytics.com/assets/Arial.ttf',
+    'groundingdino_swint_ogc.pth':
+        'https://github.com/IDEA-Research/GroundingDINO/releases/download/v0.1.0-alpha/groundingdino_swint_ogc.pth',
+    'GroundingDINO_SwinT_OGC.py':
+        'https://raw.githubusercontent.com/roboflow/GroundingDINO/main/groundingdino/config/GroundingDINO_SwinT_OGC.py',
+    'sam_vit_h_4b8939.pth': 'https://dl.fbaipublicfiles.com/segment_anything/sam_vit_h_4b8939.pth',
+}
+
+# Where autodistill_grounded_sam looks before downloading its checkpoints
+AUTODISTILL_CACHE_DIR = os.path.expanduser('~/.cache/autodistill')
+GROUNDED_SAM_FILES = {
+    'GroundingDINO_SwinT_OGC.py': os.path.join(AUTODISTILL_CACHE_DIR, 'groundingdino', 'GroundingDINO_SwinT_OGC.py'),
+    'groundingdino_swint_ogc.pth': os.path.join(AUTODISTILL_CACHE_DIR, 'groundingdino', 'groundingdino_swint_ogc.pth'),
+    'sam_vit_h_4b8939.pth': os.path.join(AUTODISTILL_CACHE_DIR, 'segment_anything', 'sam_vit_h_4b8939.pth'),
+}
+
+def sha256_file(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class WeightsRegistry:
+    """Content-addressed store of pretrained weights on local disk
+    
+    Files live at sha256/<digest>/<name>; the name is kept so loaders
+    that dispatch on the suffix (.pt, .pth) still work. index.json maps
+    each name to its digest, so a job resolves weights with one small
+    read and no network. The same layout works baked into an image or
+    synced to S3 and mounted as a channel.
+    """
+    
+    def __init__(self, root):
+        self.root = root
+        self.index = {}
+        index_path = os.path.join(root, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path, 'r') as f:
+                self.index = json.load(f)
+    
+    def _blob(self, name, digest):
+        return os.path.join(self.root, 'sha256', digest, name)
+    
+    def path(self, name):
+        """Local path of name, or None if this registry doesn't hold it"""
+        entry = self.index.get(name)
+        if entry is None:
+            return None
+        path = self._blob(name, entry['sha256'])
+        return path if os.path.exists(path) else None
+    
+    def add(self, source_path, name=None, source=None):
+        """Copy a file in under its content hash and index it as name"""
+        name = name or os.path.basename(source_path)
+        digest = sha256_file(source_path)
+        blob = self._blob(name, digest)
+        if not os.path.exists(blob):
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            shutil.copy2(source_path, blob + '.tmp')
+            os.replace(blob + '.tmp', blob)
+        self.index[name] = {'sha256': digest, 'size': os.path.getsize(blob), 'source': source}
+        self._save_index()
+        return blob
+    
+    def fetch(self, name, url=None):
+        """Download name from its upstream URL into the registry (image build time)"""
+        url = url or KNOWN_WEIGHTS[name]
+        os.makedirs(self.root, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=self.root) as tmp_dir:
+            download = os.path.join(tmp_dir, name)
+            urllib.request.urlretrieve(url, download)
+            return self.add(download, name, source=url)
+    
+    def verify(self):
+        """Names whose file is missing or no longer matches its digest"""
+        return [
+            name for name, entry in self.index.items()
+            if not os.path.exists(self._blob(name, entry['sha256']))
+            or sha256_file(self._blob(name, entry['sha256'])) != entry['sha256']
+        ]
+    
+    def _save_index(self):
+        os.makedirs(self.root, exist_ok=True)
+        index_path = os.path.join(self.root, INDEX_FILE)
+        with open(index_path + '.tmp', 'w') as f:
+            json.dump(self.index, f, indent=2, sort_keys=True)
+        os.replace(index_path + '.tmp', index_path)
+
+def resolve_weights(name, registry_dirs=(CHANNEL_DIR, IMAGE_DIR)):
+    """Local path of pretrained weights from the first registry holding them, else None"""
+    for root in registry_dirs:
+        if root and os.path.isdir(root):
+            path = WeightsRegistry(root).path(name)
+            if path:
+                return path
+    print(f"⚠️ {name} is not in a local weights registry; it will be downloaded")
+    return None
+
+def link_weights(name, destination, registry_dirs=(CHANNEL_DIR, IMAGE_DIR)):
+    """Symlink registry weights to where a library expects its cached copy; False if absent"""
+    if os.path.exists(destination):
+        return True
+    path = resolve_weights(name, registry_dirs)
+    if path is None:
+        return False
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    if os.path.islink(destination):
+        os.remove(destination)  # dangling link from an older registry
+    os.symlink(path, destination)
+    return True
+
+def stage_grounded_sam_weights():
+    """Put GroundingDINO and SAM checkpoints where autodistill_grounded_sam finds them"""
+    staged = [name for name, destination in GROUNDED_SAM_FILES.items() if link_weights(name, destination)]
+    print(f"📦 GroundedSAM checkpoints from the weights registry: {len(staged)}/{len(GROUNDED_SAM_FILES)}")
+    return len(staged) == len(GROUNDED_SAM_FILES)
+
+class StartupTimer:
+    """Seconds from process start to named milestones
+    
+    The clock starts when the kernel created the process (from /proc),
+    so interpreter startup and module imports are included.
+    """
+    
+    def __init__(self):
+        self.started = self._process_start()
+        self.marks = {}
+    
+    @staticmethod
+    def _process_start():
+        try:
+            with open('/proc/self/stat', 'r') as f:
+                start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+            with open('/proc/uptime', 'r') as f:
+                uptime = float(f.read().split()[0])
+            return time.time() - (uptime - start_ticks / os.sysconf('SC_CLK_TCK'))
+        except (OSError, ValueError, IndexError):
+            return time.time()
+    
+    def mark(self, name):
+        self.marks[name] = max(0.0, time.time() - self.started)
+        print(f"⏱️ {self.marks[name]:.1f}s since start: {name}")
+        return self.marks[name]
+    
+    def metrics(self):
+        return {f"startup_{name.replace(' ', '_')}_sec": value for name, value in self.marks.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or inspect a content-addressed pretrained-weights registry")
+    parser.add_argument('command', choices=['fetch', 'add', 'list', 'verify'])
+    parser.add_argument('names', nargs='*', help=f"fetch: names from {', '.join(KNOWN_WEIGHTS)}; add: file paths")
+    parser.add_argument('--root', default=IMAGE_DIR, help='Registry directory')
+    args = parser.parse_args()
+    
+    registry = WeightsRegistry(args.root)
+    if args.command == 'fetch':
+        for name in args.names:
+            print(f"⬇️ {name}: {registry.fetch(name)}")
+    elif args.command == 'add':
+        for path in args.names:
+            print(f"➕ {os.path.basename(path)}: {registry.add(path)}")
+    elif args.command == 'list':
+        for name, entry in sorted(registry.index.items()):
+            print(f"{entry['sha256'][:16]}  {entry['size'] / 1e6:9.1f} MB  {name}")
+    else:
+        bad = registry.verify()
+        for name in bad:
+            print(f"❌ {name} is missing or corrupt")
+        if bad:
+            raise SystemExit(1)
+        print(f"✅ {len(registry.index)} files verified in {args.root}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+import os
+import json
+import glob
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from inference import (CONF_THRESHOLD, IMG_SIZE, IOU_THRESHOLD, YoloDetector,
+                       decode_image, load_detector)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+# Rows per Parquet part file; each part is written atomically, so this is also the resume granularity
+PARQUET_PART_ROWS = 5000
+
+def list_images(source):
+    """Image paths from a directory (recursive, sorted) or a manifest file
+
+    A manifest is either plain text with one path per line or JSONL with
+    a 'path' field. Relative paths are resolved against the manifest's
+    directory. The order must be stable across runs for resume offsets
+    to mean anything, so directories are sorted.
+    """
+    if os.path.isdir(source):
+        paths = []
+        for root, _, files in os.walk(source):
+            paths.extend(os.path.join(root, f) for f in files if f.lower().endswith(IMAGE_EXTENSIONS))
+        return sorted(paths)
+    base = os.path.dirname(os.path.abspath(source))
+    paths = []
+    with open(source, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            path = json.loads(line)['path'] if line.startswith('{') else line
+            paths.append(path if os.path.isabs(path) else os.path.join(base, path))
+    return paths
+
+def load_image(path):
+    with open(path, 'rb') as f:
+        return decode_image(f.read())
+
+def prefetch_images(paths, start, threads, depth):
+    """Yield (index, path, image or None, error) in order, decoding up to depth ahead
+
+    At most depth images are decoded but not yet consumed, which bounds
+    memory no matter how large the input list is.
+    """
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='decode') as pool:
+        index = start
+        while index < len(paths) or pending:
+            while index < len(paths) and len(pending) < depth:
+                pending.append((index, paths[index], pool.submit(load_image, paths[index])))
+                index += 1
+            i, path, future = pending.popleft()
+            try:
+                yield i, path, future.result(), None
+            except Exception as e:
+                yield i, path, None, str(e)
+
+def summarize(result):
+    """Flat per-image fields for quick filtering without parsing detections"""
+    detections = result['detections'] if result else []
+    return {
+        'num_detections': len(detections),
+        'max_confidence': max((d['confidence'] for d in detections), default=0.0),
+    }
+
+class JsonlWriter:
+    """Appends one JSON record per image; a torn last line is dropped on resume"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def completed(self):
+        """Input index to resume at: one past the last complete record"""
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            end = data.rfind(b'\n') + 1
+            if end < len(data):
+                f.truncate(end)  # partial record from a killed run
+        lines = data[:end].splitlines()
+        return json.loads(lines[-1])['index'] + 1 if lines else 0
+
+    def write(self, records):
+        if self.file is None:
+            self.file = open(self.path, 'a')
+        for record in records:
+            self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+    def close(self):
+        if self.file:
+            os.fsync(self.file.fileno())
+            self.file.close()
+
+class ParquetWriter:
+    """Writes part-<first index>.parquet files of PARQUET_PART_ROWS rows into a directory
+
+    Parquet files can't be appended to, so records are buffered into
+    parts. Each part is written to a temp file and renamed into place,
+    so after a crash every part on disk is complete. Resume continues
+    after the last complete part.
+    """
+
+    def __init__(self, path, part_rows=PARQUET_PART_ROWS):
+        self.path = path
+        self.part_rows = part_rows
+        self.buffer = []
+        os.makedirs(path, exist_ok=True)
+
+    def completed(self):
+        """Input index to resume at: one past the last complete part"""
+        import pyarrow.parquet as pq
+
+        done = 0
+        for part in glob.glob(os.path.join(self.path, 'part-*.parquet')):
+            first = int(os.path.basename(part)[5:-8])
+            done = max(done, first + pq.ParquetFile(part).metadata.num_rows)
+        return done
+
+    def write(self, records):
+        self.buffer.extend(records)
+        if len(self.buffer) >= self.part_rows:
+            self._flush()
+
+    def _flush(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if not self.buffer:
+            return
+        rows = [dict(r, detections=json.dumps(r['detections'])) for r in self.buffer]
+        part = os.path.join(self.path, f"part-{rows[0]['index']:010d}.parquet")
+        schema = pa.schema([
+            ('index', pa.int64()),
+            ('path', pa.string()),
+            ('error', pa.string()),
+            ('num_detections', pa.int64()),
+            ('max_confidence', pa.float64()),
+            ('image_size', pa.list_(pa.int64())),
+            ('detections', pa.string()),  # JSON list, same layout as the endpoint response
+        ])
+        pq.write_table(pa.Table.from_pylist(rows, schema=schema), part + '.tmp')
+        os.replace(part + '.tmp', part)
+        self.buffer = []
+
+    def close(self):
+        self._flush()
+
+def open_writer(path, output_format=None):
+    output_format = output_format or ('jsonl' if path.endswith('.jsonl') else 'parquet')
+    if output_format == 'jsonl':
+        return JsonlWriter(path)
+    if output_format == 'parquet':
+        return ParquetWriter(path)
+    raise ValueError(f"Unknown output format: {output_format}")
+
+def build_detector(model, backend='auto', img_size=IMG_SIZE, conf=CONF_THRESHOLD, iou=IOU_THRESHOLD):
+    """Detector from a weights file (.pt / .onnx) or an extracted model dir"""
+    if os.path.isdir(model):
+        return load_detector(model, backend, img_size, conf, iou)
+    if model.endswith('.onnx'):
+        from onnx_backend import OnnxDetector
+        return OnnxDetector(model, img_size, conf, iou)
+    return YoloDetector(model, img_size, conf, iou)
+
+def run_batch_inference(detector, paths, writer, batch_size=16, decode_threads=4,
+                        prefetch_batches=4, offset=0, log_every=30.0):
+    """Score paths[offset:] in batches, writing each batch before the next one
+
+    Images that fail to decode are written with an 'error' and no
+    detections so the output stays aligned with the input list. Returns
+    a stats dict with end-to-end images/sec.
+    """
+    stats = {'images': 0, 'errors': 0, 'batches': 0, 'forward_sec': 0.0, 'write_sec': 0.0}
+    start = last_log = time.perf_counter()
+    batch = []
+
+    def flush():
+        images = [image for _, _, image, _ in batch if image is not None]
+        forward_start = time.perf_counter()
+        results = iter(detector.predict_batch(images) if images else [])
+        stats['forward_sec'] += time.perf_counter() - forward_start
+        records = []
+        for index, path, image, error in batch:
+            result = next(results) if image is not None else None
+            records.append({
+                'index': index,
+                'path': path,
+                'error': error,
+                **summarize(result),
+                'image_size': result['image_size'] if result else None,
+                'detections': result['detections'] if result else [],
+            })
+        write_start = time.perf_counter()
+        writer.write(records)
+        stats['write_sec'] += time.perf_counter() - write_start
+        stats['images'] += len(batch)
+        stats['batches'] += 1
+        batch.clear()
+
+    for index, path, image, error in prefetch_images(paths, offset, decode_threads, batch_size * prefetch_batches):
+        if error:
+            stats['errors'] += 1
+        batch.append((index, path, image, error))
+        if len(batch) == batch_size:
+            flush()
+            now = time.perf_counter()
+            if now - last_log >= log_every:
+                last_log = now
+                rate = stats['images'] / (now - start)
+                remaining = (len(paths) - offset - stats['images']) / rate if rate else 0
+                print(f"  {offset + stats['images']}/{len(paths)} images, {rate:.1f} images/s, ~{remaining / 60:.0f} min left")
+    if batch:
+        flush()
+    writer.close()
+
+    elapsed = time.perf_counter() - start
+    stats.update({
+        'offset': offset,
+        'total': len(paths),
+        'elapsed_sec': round(elapsed, 2),
+        'images_per_sec': round(stats['images'] / elapsed, 2) if elapsed else 0.0,
+        'forward_sec': round(stats['forward_sec'], 2),
+        'write_sec': round(stats['write_sec'], 2),
+    })
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline batch scoring of an image directory or manifest")
+    parser.add_argument('--input', required=True, help='Image directory, or manifest (.txt paths / .jsonl with "path")')
+    parser.add_argument('--model', required=True, help='Local best.pt / .onnx weights, or an extracted model dir')
+    parser.add_argument('--output', required=True, help='results.jsonl, or a directory for Parquet parts')
+    parser.add_argument('--format', choices=['jsonl', 'parquet'], default=None,
+                        help='Output format (default: from the --output extension)')
+    parser.add_argument('--backend', choices=['auto', 'torch', 'onnx'], default='auto',
+                        help='Backend when --model is a directory')
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--decode-threads', type=int, default=os.cpu_count() or 4)
+    parser.add_argument('--prefetch-batches', type=int, default=4,
+                        help='Decoded batches buffered ahead of the model (bounds memory)')
+    parser.add_argument('--img-size', type=int, default=IMG_SIZE)
+    parser.add_argument('--conf', type=float, default=CONF_THRESHOLD)
+    parser.add_argument('--iou', type=float, default=IOU_THRESHOLD)
+    parser.add_argument('--tile-size', type=int, default=0, help='Tiled full-resolution inference (0 = whole image)')
+    parser.add_argument('--offset', type=int, default=None,
+                        help='Start at this input index (default: resume after what --output already holds)')
+    parser.add_argument('--report', default=None, help='Write the run stats JSON here')
+    args = parser.parse_args()
+
+    paths = list_images(args.input)
+    writer = open_writer(args.output, args.format)
+    offset = args.offset if args.offset is not None else writer.completed()
+    print(f"📂 {len(paths)} images from {args.input}")
+    if offset:
+        print(f"♻️ Resuming at image {offset}")
+    if offset >= len(paths):
+        print("✅ Nothing left to score")
+        return
+
+    detector = build_detector(args.model, args.backend, args.img_size, args.conf, args.iou)
+    if args.tile_size:
+        from tiling import TiledDetector
+        detector = TiledDetector(detector, args.tile_size)
+    print(f"🚀 Scoring {len(paths) - offset} images (batch {args.batch_size}, {args.decode_threads} decode threads)")
+
+    stats = run_batch_inference(
+        detector, paths, writer,
+        batch_size=args.batch_size,
+        decode_threads=args.decode_threads,
+        prefetch_batches=args.prefetch_batches,
+        offset=offset
+    )
+    print(f"✅ {stats['images']} images in {stats['elapsed_sec']:.1f}s: {stats['images_per_sec']:.1f} images/s end to end "
+          f"(forward {stats['forward_sec']:.1f}s, write {stats['write_sec']:.1f}s, {stats['errors']} unreadable)")
+    print(f"📄 Results: {args.output}")
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(stats, f, indent=2)
+
+if __name__ == "__main__":
+    main()
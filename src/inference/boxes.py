@@ -0,0 +1,85 @@
+import numpy as np
+
+LETTERBOX_COLOR = (114, 114, 114)
+
+def letterbox(image, size, color=LETTERBOX_COLOR):
+    """Resize keeping aspect ratio and pad to a size x size square
+
+    Returns the padded image, the scale ratio and the (left, top) padding
+    needed to map boxes back to the original image.
+    """
+    import cv2
+
+    height, width = image.shape[:2]
+    ratio = min(size / height, size / width)
+    new_width, new_height = int(round(width * ratio)), int(round(height * ratio))
+    if (new_width, new_height) != (width, height):
+        image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+    pad_left = (size - new_width) // 2
+    pad_top = (size - new_height) // 2
+    padded = np.full((size, size, 3), color, dtype=np.uint8)
+    padded[pad_top:pad_top + new_height, pad_left:pad_left + new_width] = image
+    return padded, ratio, (pad_left, pad_top)
+
+def unletterbox_boxes(boxes, ratio, pad, image_shape):
+    """Map xyxy boxes from letterboxed coordinates back to the original image"""
+    boxes = boxes.copy()
+    boxes[:, [0, 2]] -= pad[0]
+    boxes[:, [1, 3]] -= pad[1]
+    boxes /= ratio
+    height, width = image_shape[:2]
+    boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, width)
+    boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, height)
+    return boxes
+
+def xywh_to_xyxy(boxes):
+    """Convert center x/y, width, height boxes to corner coordinates"""
+    out = np.empty_like(boxes)
+    half_w = boxes[..., 2] / 2
+    half_h = boxes[..., 3] / 2
+    out[..., 0] = boxes[..., 0] - half_w
+    out[..., 1] = boxes[..., 1] - half_h
+    out[..., 2] = boxes[..., 0] + half_w
+    out[..., 3] = boxes[..., 1] + half_h
+    return out
+
+def box_area(boxes):
+    return (boxes[..., 2] - boxes[..., 0]).clip(0) * (boxes[..., 3] - boxes[..., 1]).clip(0)
+
+def box_iou(a, b):
+    """Pairwise IoU matrix between (N, 4) and (M, 4) xyxy boxes"""
+    top_left = np.maximum(a[:, None, :2], b[None, :, :2])
+    bottom_right = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    intersection = (bottom_right - top_left).clip(0).prod(axis=2)
+    union = box_area(a)[:, None] + box_area(b)[None, :] - intersection
+    return intersection / np.maximum(union, 1e-9)
+
+def nms(boxes, scores, iou_threshold):
+    """Greedy non-maximum suppression; returns kept indices by score
+
+    Each step suppresses every remaining box overlapping the current best
+    in one vectorized IoU computation.
+    """
+    order = np.argsort(-scores, kind='stable')
+    areas = box_area(boxes)
+    keep = []
+    while order.size:
+        best = order[0]
+        keep.append(best)
+        rest = order[1:]
+        if not rest.size:
+            break
+        top_left = np.maximum(boxes[best, :2], boxes[rest, :2])
+        bottom_right = np.minimum(boxes[best, 2:], boxes[rest, 2:])
+        intersection = (bottom_right - top_left).clip(0).prod(axis=1)
+        iou = intersection / np.maximum(areas[best] + areas[rest] - intersection, 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.asarray(keep, dtype=np.int64)
+
+def batched_nms(boxes, scores, class_ids, iou_threshold):
+    """Class-aware NMS by offsetting each class into its own coordinate range"""
+    if not len(boxes):
+        return np.zeros(0, dtype=np.int64)
+    offset = boxes.max() + 1
+    shifted = boxes + (class_ids.astype(boxes.dtype) * offset)[:, None]
+    return nms(shifted, scores, iou_threshold)
@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+import os
+import json
+import glob
+import time
+import queue
+import base64
+import argparse
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Serving knobs (set as endpoint environment variables)
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', '8'))
+MAX_BATCH_WAIT_MS = float(os.environ.get('MAX_BATCH_WAIT_MS', '10'))
+DECODE_THREADS = int(os.environ.get('DECODE_THREADS', '4'))
+IMG_SIZE = int(os.environ.get('IMG_SIZE', '640'))
+CONF_THRESHOLD = float(os.environ.get('CONF_THRESHOLD', '0.25'))
+IOU_THRESHOLD = float(os.environ.get('IOU_THRESHOLD', '0.45'))
+# auto = PyTorch on GPU, exported ONNX (INT8 if present) on CPU
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'auto')
+PREFER_INT8 = os.environ.get('PREFER_INT8', 'true').lower() == 'true'
+# Tiled full-resolution inference for large roof images (0 = whole image)
+TILE_SIZE = int(os.environ.get('TILE_SIZE', '0'))
+TILE_OVERLAP = float(os.environ.get('TILE_OVERLAP', '0.2'))
+TILE_MERGE = os.environ.get('TILE_MERGE', 'wbf')
+
+JSON_CONTENT_TYPE = 'application/json'
+IMAGE_CONTENT_TYPES = ('application/x-image', 'image/jpeg', 'image/png', 'image/jpg')
+# SageMaker passes this response header back to invoke_endpoint callers as CustomAttributes
+TIMING_HEADER = 'X-Amzn-SageMaker-Custom-Attributes'
+TIMING_STAGES = ('decode', 'queue', 'preprocess', 'model', 'postprocess', 'total')
+
+_decode_pool = None
+_decode_pool_lock = threading.Lock()
+
+def decode_pool():
+    """Shared thread pool for image decoding (cv2 releases the GIL)"""
+    global _decode_pool
+    with _decode_pool_lock:
+        if _decode_pool is None:
+            _decode_pool = ThreadPoolExecutor(
+                max_workers=DECODE_THREADS, thread_name_prefix='decode'
+            )
+        return _decode_pool
+
+def decode_image(data):
+    """Decode encoded image bytes to a BGR uint8 array"""
+    import cv2
+    import numpy as np
+    
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Could not decode image payload")
+    return image
+
+def format_timing(timing):
+    """Per-stage milliseconds as a header value: decode=1.2;queue=0.4;..."""
+    return ';'.join(f"{stage}={timing[stage]:.2f}" for stage in TIMING_STAGES if stage in timing)
+
+def parse_timing(value):
+    """Inverse of format_timing; {} for a missing or foreign header"""
+    timing = {}
+    for part in (value or '').split(';'):
+        stage, _, ms = part.partition('=')
+        if stage in TIMING_STAGES:
+            try:
+                timing[stage] = float(ms)
+            except ValueError:
+                pass
+    return timing
+
+def find_weights(model_dir):
+    """Locate YOLOv8 weights inside an extracted model.tar.gz"""
+    for name in ('best.pt', 'last.pt'):
+        matches = sorted(glob.glob(os.path.join(model_dir, '**', name), recursive=True))
+        if matches:
+            return matches[0]
+    matches = sorted(glob.glob(os.path.join(model_dir, '**', '*.pt'), recursive=True))
+    if matches:
+        return matches[0]
+    raise FileNotFoundError(f"No .pt weights found under {model_dir}")
+
+class MicroBatcher:
+    """Groups concurrent requests into a single forward pass
+    
+    A background thread takes the first waiting item, then keeps pulling
+    until it has max_batch_size items or max_wait_ms has passed, and runs
+    predict_batch once for the whole group. Each future gets a timing
+    dict: its queue wait plus the batch's stage times from stage_timing.
+    """
+    
+    def __init__(self, predict_batch, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_BATCH_WAIT_MS,
+                 stage_timing=None):
+        self.predict_batch = predict_batch
+        self.stage_timing = stage_timing
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.batches = 0
+        self.items = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._thread.start()
+    
+    def submit(self, item):
+        future = Future()
+        future.submitted = time.perf_counter()
+        self._queue.put((item, future))
+        return future
+    
+    def predict(self, items):
+        """Submit items and block until all of their results are ready"""
+        futures = [self.submit(item) for item in items]
+        return [future.result() for future in futures]
+    
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'items': self.items,
+            'mean_batch_size': self.items / self.batches if self.batches else 0.0,
+        }
+    
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+    
+    def _collect(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    entry = self._queue.get(timeout=remaining)
+                else:
+                    entry = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is None:
+                # Finish this batch, then shut down
+                self._queue.put(None)
+                break
+            batch.append(entry)
+        return batch
+    
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            started = time.perf_counter()
+            try:
+                results = list(self.predict_batch([item for item, _ in batch]))
+                if len(results) != len(batch):
+                    # zip would leave the unmatched requests waiting forever
+                    raise RuntimeError(f"predict_batch returned {len(results)} results for {len(batch)} inputs")
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            stages = self.stage_timing() if self.stage_timing else {}
+            for (_, future), result in zip(batch, results):
+                future.timing = dict(stages, queue=(started - future.submitted) * 1000)
+                future.set_result(result)
+
+class YoloDetector:
+    """YOLOv8 weights wrapped for batched prediction on decoded images"""
+    
+    def __init__(self, weights, img_size=IMG_SIZE, conf=CONF_THRESHOLD, iou=IOU_THRESHOLD, device=None):
+        import torch
+        from ultralytics import YOLO
+        
+        self.weights = weights
+        self.img_size = img_size
+        self.conf = conf
+        self.iou = iou
+        self.device = device if device is not None else (0 if torch.cuda.is_available() else 'cpu')
+        self.model = YOLO(weights)
+        self.names = self.model.names
+        self.last_timing = {}
+    
+    def predict_batch(self, images):
+        results = self.model.predict(
+            images,
+            imgsz=self.img_size,
+            conf=self.conf,
+            iou=self.iou,
+            device=self.device,
+            verbose=False
+        )
+        start = time.perf_counter()
+        outputs = [self._to_dict(result) for result in results]
+        # Ultralytics reports per-image averages for the batch; scale back to batch wall time
+        speed = results[0].speed if results else {}
+        self.last_timing = {
+            'preprocess': (speed.get('preprocess') or 0.0) * len(results),
+            'model': (speed.get('inference') or 0.0) * len(results),
+            'postprocess': (speed.get('postprocess') or 0.0) * len(results) + (time.perf_counter() - start) * 1000,
+        }
+        return outputs
+    
+    def _to_dict(self, result):
+        boxes = result.boxes
+        xyxy = boxes.xyxy.cpu().numpy().tolist()
+        confidences = boxes.conf.cpu().numpy().tolist()
+        class_ids = boxes.cls.cpu().numpy().astype(int).tolist()
+        height, width = result.orig_shape
+        return {
+            'image_size': [width, height],
+            'detections': [
+                {
+                    'box': [round(v, 2) for v in box],
+                    'confidence': round(confidence, 4),
+                    'class_id': class_id,
+                    'class_name': self.names.get(class_id, str(class_id)),
+                }
+                for box, confidence, class_id in zip(xyxy, confidences, class_ids)
+            ],
+        }
+
+class InferenceModel:
+    """Detector plus the micro-batcher that feeds it and an optional response cache"""
+    
+    def __init__(self, detector, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_BATCH_WAIT_MS, cache=None):
+        self.detector = detector
+        self.batcher = MicroBatcher(detector.predict_batch, max_batch_size, max_wait_ms,
+                                    stage_timing=lambda: getattr(detector, 'last_timing', {}))
+        self.cache = cache
+    
+    def predict(self, images, timing=None):
+        """Results for decoded images; fills timing with the slowest batch's stage times"""
+        futures = [self.batcher.submit(image) for image in images]
+        results = [future.result() for future in futures]
+        if timing is not None:
+            for future in futures:
+                for stage, ms in future.timing.items():
+                    timing[stage] = max(timing.get(stage, 0.0), ms)
+        return results
+    
+    def _decode(self, payloads, timing):
+        start = time.perf_counter()
+        images = list(decode_pool().map(decode_image, payloads))
+        if timing is not None:
+            timing['decode'] = (time.perf_counter() - start) * 1000
+        return images
+    
+    def predict_payloads(self, payloads, timing=None):
+        """Results for encoded images, answering repeats from the cache
+        
+        Exact repeats skip decoding and the forward pass. Near-duplicates
+        (when the pHash tier is on) skip the forward pass. Only the rest
+        reach the micro-batcher. Pass a dict as timing to collect per-stage
+        milliseconds for the request.
+        """
+        if self.cache is None:
+            return self.predict(self._decode(payloads, timing), timing)
+        
+        from response_cache import perceptual_hash
+        
+        results = [None] * len(payloads)
+        keys = [self.cache.content_key(payload) for payload in payloads]
+        pending = []
+        for i, key in enumerate(keys):
+            results[i] = self.cache.get_exact(key)
+            if results[i] is None:
+                pending.append(i)
+        images = dict(zip(pending, self._decode([payloads[i] for i in pending], timing)))
+        
+        misses, phashes = [], {}
+        for i in pending:
+            image = images[i]
+            if self.cache.phash_threshold:
+                phashes[i] = perceptual_hash(image)
+                results[i] = self.cache.get_near(phashes[i], [image.shape[1], image.shape[0]])
+            if results[i] is None:
+                self.cache.miss()
+                misses.append(i)
+        if misses:
+            start = time.perf_counter()
+            predictions = self.predict([images[i] for i in misses], timing)
+            latency_ms = (time.perf_counter() - start) * 1000 / len(misses)
+            for i, prediction in zip(misses, predictions):
+                results[i] = prediction
+                self.cache.put(keys[i], prediction, latency_ms, phashes.get(i))
+        return results
+    
+    def stats(self):
+        stats = self.batcher.stats()
+        if self.cache is not None:
+            stats['cache'] = self.cache.stats()
+        return stats
+
+def load_detector(model_dir, backend=INFERENCE_BACKEND, img_size=IMG_SIZE, conf=CONF_THRESHOLD, iou=IOU_THRESHOLD):
+    """Pick the PyTorch or ONNX Runtime backend for the artifacts present"""
+    from onnx_backend import OnnxDetector, find_onnx
+    
+    onnx_path = find_onnx(model_dir, prefer_int8=PREFER_INT8)
+    if backend == 'auto':
+        try:
+            import torch
+            has_gpu = torch.cuda.is_available()
+        except ImportError:
+            has_gpu = False
+        backend = 'onnx' if onnx_path and not has_gpu else 'torch'
+    
+    if backend == 'onnx':
+        if not onnx_path:
+            raise FileNotFoundError(f"No exported .onnx model found under {model_dir}")
+        print(f"🤖 Loading ONNX Runtime model: {onnx_path}")
+        return OnnxDetector(onnx_path, img_size, conf, iou)
+    if backend == 'torch':
+        weights = find_weights(model_dir)
+        print(f"🤖 Loading detector weights: {weights}")
+        return YoloDetector(weights, img_size, conf, iou)
+    raise ValueError(f"Unknown inference backend: {backend}")
+
+def model_fn(model_dir):
+    """Load the detector once per worker"""
+    detector = load_detector(model_dir)
+    if TILE_SIZE:
+        from tiling import TiledDetector
+        print(f"🧩 Tiled inference: {TILE_SIZE}px tiles, {TILE_OVERLAP:.0%} overlap, {TILE_MERGE} merge")
+        detector = TiledDetector(detector, TILE_SIZE, TILE_OVERLAP, merge=TILE_MERGE)
+    
+    # Warm up so the first real request doesn't pay for CUDA/kernel setup
+    import numpy as np
+    detector.predict_batch([np.zeros((detector.img_size, detector.img_size, 3), dtype=np.uint8)])
+    print(f"✅ Detector ready (batch<={MAX_BATCH_SIZE}, wait<={MAX_BATCH_WAIT_MS}ms)")
+    
+    from response_cache import make_cache
+    cache = make_cache(detector, extra_version=(TILE_SIZE, TILE_OVERLAP, TILE_MERGE))
+    return InferenceModel(detector, cache=cache)
+
+def input_fn(request_body, content_type=JSON_CONTENT_TYPE):
+    """Extract one raw image or a JSON list of base64 images (decoded in predict_fn)"""
+    if isinstance(request_body, str):
+        request_body = request_body.encode()
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    
+    if content_type in IMAGE_CONTENT_TYPES:
+        payloads = [bytes(request_body)]
+        batched = False
+    elif content_type == JSON_CONTENT_TYPE:
+        body = json.loads(request_body)
+        if 'images' in body:
+            payloads = [base64.b64decode(image) for image in body['images']]
+            batched = True
+        elif 'image' in body:
+            payloads = [base64.b64decode(body['image'])]
+            batched = False
+        else:
+            raise ValueError("JSON body must contain 'image' or 'images'")
+    else:
+        raise ValueError(f"Unsupported content type: {content_type}")
+    
+    return {'payloads': payloads, 'batched': batched, 'timing': {}}
+
+def predict_fn(input_data, model):
+    """Serve cached results, queue the rest on the micro-batcher and wait for them"""
+    results = model.predict_payloads(input_data['payloads'], input_data.get('timing'))
+    return results if input_data['batched'] else results[0]
+
+def output_fn(prediction, accept=JSON_CONTENT_TYPE):
+    """Serialize predictions as JSON"""
+    accept = (accept or JSON_CONTENT_TYPE).split(';')[0].strip().lower()
+    if accept not in (JSON_CONTENT_TYPE, '*/*'):
+        raise ValueError(f"Unsupported accept type: {accept}")
+    return json.dumps(prediction)
+
+def make_handler(model):
+    """HTTP handler implementing the SageMaker /ping and /invocations contract"""
+    
+    class InvocationHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        
+        def _respond(self, status, body, content_type=JSON_CONTENT_TYPE, timing=None):
+            data = body.encode() if isinstance(body, str) else body
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            if timing:
+                self.send_header(TIMING_HEADER, format_timing(timing))
+            self.end_headers()
+            self.wfile.write(data)
+        
+        def do_GET(self):
+            if self.path == '/ping':
+                self._respond(200, json.dumps({'status': 'ok', **model.stats()}))
+            else:
+                self._respond(404, json.dumps({'error': 'not found'}))
+        
+        def do_POST(self):
+            if self.path != '/invocations':
+                self._respond(404, json.dumps({'error': 'not found'}))
+                return
+            length = int(self.headers.get('Content-Length', 0))
+            body = self.rfile.read(length)
+            start = time.perf_counter()
+            try:
+                data = input_fn(body, self.headers.get('Content-Type'))
+                prediction = predict_fn(data, model)
+                output = output_fn(prediction, self.headers.get('Accept'))
+                data['timing']['total'] = (time.perf_counter() - start) * 1000
+                self._respond(200, output, timing=data['timing'])
+            except ValueError as e:
+                self._respond(400, json.dumps({'error': str(e)}))
+            except Exception as e:
+                self._respond(500, json.dumps({'error': str(e)}))
+        
+        def log_message(self, format, *args):
+            pass
+    
+    return InvocationHandler
+
+def serve(model_dir, host='0.0.0.0', port=8080):
+    """Serve the model with one thread per connection so requests can batch"""
+    model = model_fn(model_dir)
+    server = ThreadingHTTPServer((host, port), make_handler(model))
+    server.daemon_threads = True
+    print(f"🚀 Serving on http://{host}:{port} (model dir: {model_dir})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        model.batcher.close()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', nargs='?', default='serve', choices=['serve'])
+    parser.add_argument('--model-dir', default=os.environ.get('SM_MODEL_DIR', '/opt/ml/model'))
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('SAGEMAKER_BIND_TO_PORT', '8080')))
+    args = parser.parse_args()
+    
+    serve(args.model_dir, args.host, args.port)
+
+if __name__ == "__main__":
+    main()
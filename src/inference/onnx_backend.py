@@ -0,0 +1,122 @@
+import os
+import ast
+import glob
+import time
+
+import numpy as np
+
+from boxes import batched_nms, letterbox, unletterbox_boxes, xywh_to_xyxy
+
+# Preference order when several exported artifacts are present
+ONNX_CANDIDATES = ('best.int8.onnx', 'best.onnx', 'last.onnx')
+
+def find_onnx(model_dir, prefer_int8=True):
+    """Locate an exported ONNX model inside an extracted model.tar.gz"""
+    candidates = ONNX_CANDIDATES if prefer_int8 else ONNX_CANDIDATES[1:] + ONNX_CANDIDATES[:1]
+    for name in candidates:
+        matches = sorted(glob.glob(os.path.join(model_dir, '**', name), recursive=True))
+        if matches:
+            return matches[0]
+    return None
+
+def preprocess(images, img_size):
+    """Letterbox BGR images into a float32 NCHW RGB batch"""
+    batch = np.empty((len(images), 3, img_size, img_size), dtype=np.float32)
+    transforms = []
+    for i, image in enumerate(images):
+        padded, ratio, pad = letterbox(image, img_size)
+        batch[i] = padded[:, :, ::-1].transpose(2, 0, 1) / 255.0
+        transforms.append((ratio, pad, image.shape))
+    return batch, transforms
+
+class OnnxDetector:
+    """YOLOv8 ONNX export served with ONNX Runtime (CPU by default)
+
+    Same predict_batch() contract as inference.YoloDetector, so it plugs
+    into the micro-batcher unchanged.
+    """
+
+    def __init__(self, model_path, img_size=640, conf=0.25, iou=0.45, providers=None, threads=0):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(
+            model_path, sess_options=options,
+            providers=providers or ['CPUExecutionProvider']
+        )
+        self.weights = model_path
+        self.input_name = self.session.get_inputs()[0].name
+        self.conf = conf
+        self.iou = iou
+
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.img_size = img_size
+        if 'imgsz' in metadata:
+            self.img_size = int(ast.literal_eval(metadata['imgsz'])[0])
+        self.names = ast.literal_eval(metadata['names']) if 'names' in metadata else {}
+
+        # Exports without a dynamic batch axis must be fed one image at a time
+        batch_dim = self.session.get_inputs()[0].shape[0]
+        self.max_batch = batch_dim if isinstance(batch_dim, int) else None
+        self.last_timing = {}
+
+    def forward(self, batch):
+        if self.max_batch is None or len(batch) <= self.max_batch:
+            return self.session.run(None, {self.input_name: batch})[0]
+        outputs = [
+            self.session.run(None, {self.input_name: batch[i:i + self.max_batch]})[0]
+            for i in range(0, len(batch), self.max_batch)
+        ]
+        return np.concatenate(outputs)
+
+    def predict_batch(self, images):
+        start = time.perf_counter()
+        batch, transforms = preprocess(images, self.img_size)
+        preprocessed = time.perf_counter()
+        outputs = self.forward(batch)
+        forwarded = time.perf_counter()
+        results = [
+            self.postprocess(output, *transform)
+            for output, transform in zip(outputs, transforms)
+        ]
+        # Stage wall times (ms) for the whole batch, read by the micro-batcher
+        self.last_timing = {
+            'preprocess': (preprocessed - start) * 1000,
+            'model': (forwarded - preprocessed) * 1000,
+            'postprocess': (time.perf_counter() - forwarded) * 1000,
+        }
+        return results
+
+    def postprocess(self, output, ratio, pad, image_shape):
+        """Decode one (4 + nc, anchors) YOLOv8 output into detections"""
+        predictions = output.T
+        class_scores = predictions[:, 4:]
+        class_ids = class_scores.argmax(axis=1)
+        scores = class_scores[np.arange(len(class_scores)), class_ids]
+        mask = scores >= self.conf
+        boxes = xywh_to_xyxy(predictions[mask, :4])
+        scores, class_ids = scores[mask], class_ids[mask]
+
+        keep = batched_nms(boxes, scores, class_ids, self.iou)
+        boxes = unletterbox_boxes(boxes[keep], ratio, pad, image_shape)
+        scores, class_ids = scores[keep], class_ids[keep]
+        return format_detections(boxes, scores, class_ids, self.names, image_shape)
+
+def format_detections(boxes, scores, class_ids, names, image_shape):
+    """Detections in the same JSON-friendly layout as YoloDetector"""
+    height, width = image_shape[:2]
+    return {
+        'image_size': [int(width), int(height)],
+        'detections': [
+            {
+                'box': [round(float(v), 2) for v in box],
+                'confidence': round(float(score), 4),
+                'class_id': int(class_id),
+                'class_name': names.get(int(class_id), str(int(class_id))),
+            }
+            for box, score, class_id in zip(boxes, scores, class_ids)
+        ],
+    }
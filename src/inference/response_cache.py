@@ -0,0 +1,280 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Response cache knobs (set as endpoint environment variables)
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory')  # memory, redis or off
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', '10000'))
+CACHE_MAX_MB = float(os.environ.get('CACHE_MAX_MB', '256'))
+CACHE_TTL_SECONDS = int(os.environ.get('CACHE_TTL_SECONDS', str(7 * 24 * 3600)))
+# Max pHash Hamming distance for a near-duplicate hit (0 = exact bytes only; at most 3 is exhaustive)
+CACHE_PHASH_THRESHOLD = int(os.environ.get('CACHE_PHASH_THRESHOLD', '0'))
+CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+
+# The 64-bit pHash is split into 4 16-bit bands; any hash within 3 bits shares a band exactly
+PHASH_BANDS = 4
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    x = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * x + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+DCT_32 = _dct_matrix(32)
+
+def perceptual_hash(image):
+    """64-bit DCT pHash of a decoded BGR image
+
+    Same DCT construction as the labeling dedup pHash, but resized with
+    cv2 INTER_AREA instead of PIL draft + bilinear, so the two hashes of
+    one image can differ and are not interchangeable.
+    """
+    import cv2
+
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    pixels = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = (DCT_32 @ pixels @ DCT_32.T)[:8, :8]
+    return int(np.packbits((low > np.median(low)).ravel()).view('>u8')[0])
+
+def phash_bands(phash):
+    return [(band, (phash >> (16 * band)) & 0xFFFF) for band in range(PHASH_BANDS)]
+
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def model_version(detector, extra=()):
+    """Cache namespace for a detector: its weights' content hash plus the settings that change outputs"""
+    inner = getattr(detector, 'detector', detector)  # TiledDetector wraps the real one
+    parts = [file_digest(inner.weights)[:16], detector.img_size, inner.conf, inner.iou, *extra]
+    return hashlib.sha256(repr(parts).encode()).hexdigest()[:16]
+
+def rescale_result(result, image_size):
+    """Move a near-duplicate's detections onto this image's resolution"""
+    width, height = image_size
+    old_width, old_height = result['image_size']
+    if (width, height) == (old_width, old_height):
+        return result
+    sx, sy = width / old_width, height / old_height
+    return {
+        'image_size': [width, height],
+        'detections': [
+            dict(d, box=[round(d['box'][0] * sx, 2), round(d['box'][1] * sy, 2),
+                         round(d['box'][2] * sx, 2), round(d['box'][3] * sy, 2)])
+            for d in result['detections']
+        ],
+    }
+
+class MemoryBackend:
+    """In-process LRU store bounded by entry count and bytes, with per-entry TTL"""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_MB * 1e6):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (value, expires_at)
+        self.bands = {}  # band key -> keys indexed under it
+        self.memberships = {}  # key -> band keys it is indexed under, so eviction unindexes it
+        self.bytes = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                return None
+            if item[1] < time.time():
+                self._remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return item[0]
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, time.time() + ttl)
+            self.bytes += len(value)
+            while self.entries and (len(self.entries) > self.max_entries or self.bytes > self.max_bytes):
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        value, _ = self.entries.pop(key)
+        self.bytes -= len(value)
+        for band_key in self.memberships.pop(key, ()):
+            members = self.bands[band_key]
+            members.discard(key)
+            if not members:
+                del self.bands[band_key]
+
+    def add_to_band(self, band_key, key, ttl):
+        with self.lock:
+            if key not in self.entries:
+                return  # already evicted
+            self.bands.setdefault(band_key, set()).add(key)
+            self.memberships.setdefault(key, set()).add(band_key)
+
+    def band(self, band_key):
+        with self.lock:
+            return list(self.bands.get(band_key, ()))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bands.clear()
+            self.memberships.clear()
+            self.bytes = 0
+
+    def stats(self):
+        return {'entries': len(self.entries), 'bytes': self.bytes, 'evictions': self.evictions}
+
+class RedisBackend:
+    """Shared store on a Redis-compatible server (redis, valkey, KeyDB, ...)
+
+    Lets every serving worker on the instance (or a fleet) share one
+    cache. TTLs are set per key; the entry/byte bound is the server's job
+    (maxmemory with an allkeys-lru policy).
+    """
+
+    def __init__(self, url=CACHE_REDIS_URL):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.client.ping()
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value, ttl):
+        self.client.set(key, value, ex=ttl)
+
+    def add_to_band(self, band_key, key, ttl):
+        pipe = self.client.pipeline()
+        pipe.sadd(band_key, key)
+        pipe.expire(band_key, ttl)
+        pipe.execute()
+
+    def band(self, band_key):
+        return [m.decode() for m in self.client.smembers(band_key)]
+
+    def clear(self):
+        pass  # Keys are namespaced by model version and expire on their own
+
+    def stats(self):
+        info = self.client.info('memory')
+        return {'bytes': info.get('used_memory'), 'evictions': self.client.info('stats').get('evicted_keys')}
+
+class ResponseCache:
+    """Detection results keyed by image content, namespaced by model version
+
+    The exact tier keys on the SHA-256 of the request bytes, so a hit
+    skips decoding as well as the forward pass. The optional near tier
+    keys on a 64-bit pHash of the decoded image. It finds stored
+    re-encodes/resizes within phash_threshold bits through 16-bit band
+    buckets and rescales their boxes to the new image size. Keys carry
+    the model version, so a new model never sees the old one's results.
+    """
+
+    def __init__(self, backend, version, ttl=CACHE_TTL_SECONDS, phash_threshold=CACHE_PHASH_THRESHOLD):
+        self.backend = backend
+        self.ttl = ttl
+        self.phash_threshold = phash_threshold
+        self.lock = threading.Lock()
+        self.counters = {'requests': 0, 'exact_hits': 0, 'near_hits': 0, 'misses': 0, 'saved_ms': 0.0}
+        self.version = None
+        self.set_model_version(version)
+
+    def set_model_version(self, version):
+        """Switch namespaces; an in-process store drops the old model's entries"""
+        if version != self.version:
+            if self.version is not None:
+                self.backend.clear()
+            self.version = version
+
+    def content_key(self, payload):
+        return hashlib.sha256(payload).hexdigest()
+
+    def _key(self, kind, value):
+        return f"det:{self.version}:{kind}:{value}"
+
+    def _count(self, **increments):
+        with self.lock:
+            for name, value in increments.items():
+                self.counters[name] += value
+
+    def _load(self, key):
+        raw = self.backend.get(key)
+        return json.loads(raw) if raw else None
+
+    def get_exact(self, content_key):
+        entry = self._load(self._key('sha', content_key))
+        if entry:
+            self._count(requests=1, exact_hits=1, saved_ms=entry['latency_ms'])
+            return entry['result']
+        return None
+
+    def get_near(self, phash, image_size):
+        if not self.phash_threshold:
+            return None
+        candidates = set()
+        for band, value in phash_bands(phash):
+            candidates.update(self.backend.band(self._key(f"band{band}", value)))
+        best = None
+        for key in candidates:
+            entry = self._load(key)
+            if entry is None or entry.get('phash') is None:
+                continue
+            distance = bin(entry['phash'] ^ phash).count('1')
+            if distance <= self.phash_threshold and (best is None or distance < best[0]):
+                best = (distance, entry)
+        if best:
+            self._count(requests=1, near_hits=1, saved_ms=best[1]['latency_ms'])
+            return rescale_result(best[1]['result'], image_size)
+        return None
+
+    def miss(self):
+        self._count(requests=1, misses=1)
+
+    def put(self, content_key, result, latency_ms, phash=None):
+        entry = {'result': result, 'latency_ms': latency_ms, 'phash': phash}
+        self.backend.set(self._key('sha', content_key), json.dumps(entry).encode(), self.ttl)
+        if phash is not None and self.phash_threshold:
+            for band, value in phash_bands(phash):
+                self.backend.add_to_band(self._key(f"band{band}", value), self._key('sha', content_key), self.ttl)
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters)
+        hits = counters['exact_hits'] + counters['near_hits']
+        counters['hit_rate'] = hits / counters['requests'] if counters['requests'] else 0.0
+        counters['saved_ms'] = round(counters['saved_ms'], 1)
+        try:
+            counters.update(self.backend.stats())
+        except Exception as e:
+            counters['backend_error'] = str(e)
+        return counters
+
+def make_cache(detector, backend=CACHE_BACKEND, extra_version=()):
+    """ResponseCache for a loaded detector, or None when caching is off"""
+    if backend == 'off':
+        return None
+    if backend == 'memory':
+        store = MemoryBackend()
+    elif backend == 'redis':
+        store = RedisBackend()
+    else:
+        raise ValueError(f"Unknown cache backend: {backend}")
+    version = model_version(detector, extra_version)
+    near = f"<= {CACHE_PHASH_THRESHOLD} bits" if CACHE_PHASH_THRESHOLD else 'off'
+    print(f"🗄️ Response cache: {backend} (model version {version}, pHash tier {near})")
+    return ResponseCache(store, version)
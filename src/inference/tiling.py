@@ -0,0 +1,132 @@
+import time
+
+import numpy as np
+
+from boxes import batched_nms, box_iou
+from onnx_backend import format_detections
+
+def tile_origins(length, tile_size, stride):
+    """Tile start offsets along one axis, with the last tile flush to the edge"""
+    if length <= tile_size:
+        return np.zeros(1, dtype=np.int64)
+    starts = np.arange(0, length - tile_size, stride, dtype=np.int64)
+    return np.append(starts, length - tile_size)
+
+def tile_grid(width, height, tile_size, overlap):
+    """(N, 2) array of x/y tile origins covering an image with overlap"""
+    stride = max(1, int(round(tile_size * (1 - overlap))))
+    xs = tile_origins(width, tile_size, stride)
+    ys = tile_origins(height, tile_size, stride)
+    grid_x, grid_y = np.meshgrid(xs, ys)
+    return np.stack([grid_x.ravel(), grid_y.ravel()], axis=1)
+
+def detections_to_arrays(result):
+    """Detector output dict -> (boxes, scores, class_ids) arrays"""
+    detections = result['detections']
+    if not detections:
+        return np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros(0, np.int64)
+    boxes = np.array([d['box'] for d in detections], dtype=np.float32)
+    scores = np.array([d['confidence'] for d in detections], dtype=np.float32)
+    class_ids = np.array([d['class_id'] for d in detections], dtype=np.int64)
+    return boxes, scores, class_ids
+
+def weighted_box_fusion(boxes, scores, class_ids, iou_threshold):
+    """Fuse overlapping same-class boxes into score-weighted averages
+
+    NMS picks one seed per cluster, then every box joins the same-class
+    seed it overlaps most, and each cluster is averaged with np.add.at.
+    There is no per-box Python loop.
+    """
+    seeds = batched_nms(boxes, scores, class_ids, iou_threshold)
+    if not len(seeds):
+        return boxes, scores, class_ids
+
+    iou = box_iou(boxes, boxes[seeds])
+    iou[class_ids[:, None] != class_ids[seeds][None, :]] = -1
+    cluster = iou.argmax(axis=1)
+    matched = iou[np.arange(len(boxes)), cluster] >= iou_threshold
+    # Seeds always belong to their own cluster
+    cluster[seeds] = np.arange(len(seeds))
+    matched[seeds] = True
+
+    cluster, weights, members = cluster[matched], scores[matched], boxes[matched]
+    fused = np.zeros((len(seeds), 4), dtype=np.float64)
+    total = np.zeros(len(seeds), dtype=np.float64)
+    counts = np.zeros(len(seeds), dtype=np.float64)
+    np.add.at(fused, cluster, members * weights[:, None])
+    np.add.at(total, cluster, weights)
+    np.add.at(counts, cluster, 1)
+    fused /= total[:, None]
+    fused_scores = total / counts
+    return fused.astype(np.float32), fused_scores.astype(np.float32), class_ids[seeds]
+
+class TiledDetector:
+    """Runs a detector over overlapping full-resolution tiles
+
+    Tiles from every image in the request are batched through the wrapped
+    detector together. Tile detections are shifted back to full-image
+    coordinates and merged across tile seams with NMS or WBF.
+    """
+
+    def __init__(self, detector, tile_size=640, overlap=0.2, tile_batch_size=16,
+                 merge='wbf', merge_iou=0.5, include_full_image=False):
+        if merge not in ('nms', 'wbf'):
+            raise ValueError(f"Unknown tile merge method: {merge}")
+        self.detector = detector
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.tile_batch_size = tile_batch_size
+        self.merge = merge
+        self.merge_iou = merge_iou
+        self.include_full_image = include_full_image
+        self.img_size = detector.img_size
+        self.names = getattr(detector, 'names', {})
+        self.last_timing = {}
+
+    def predict_batch(self, images):
+        start = time.perf_counter()
+        tiles, owners, origins = [], [], []
+        for index, image in enumerate(images):
+            height, width = image.shape[:2]
+            for x, y in tile_grid(width, height, self.tile_size, self.overlap):
+                tiles.append(image[y:y + self.tile_size, x:x + self.tile_size])
+                owners.append(index)
+                origins.append((x, y))
+            if self.include_full_image:
+                # Downscaled whole-image pass for damage larger than a tile
+                tiles.append(image)
+                owners.append(index)
+                origins.append((0, 0))
+
+        timing = {'preprocess': (time.perf_counter() - start) * 1000, 'model': 0.0, 'postprocess': 0.0}
+        results = []
+        for first in range(0, len(tiles), self.tile_batch_size):
+            results.extend(self.detector.predict_batch(tiles[first:first + self.tile_batch_size]))
+            for stage, ms in getattr(self.detector, 'last_timing', {}).items():
+                timing[stage] += ms
+
+        merge_start = time.perf_counter()
+        per_image = [[] for _ in images]
+        for owner, origin, result in zip(owners, origins, results):
+            per_image[owner].append((origin, detections_to_arrays(result)))
+        merged = [self._merge(parts, image.shape) for parts, image in zip(per_image, images)]
+        timing['postprocess'] += (time.perf_counter() - merge_start) * 1000
+        self.last_timing = timing
+        return merged
+
+    def _merge(self, parts, image_shape):
+        counts = np.array([len(arrays[0]) for _, arrays in parts], dtype=np.int64)
+        if not counts.sum():
+            return format_detections([], [], [], self.names, image_shape)
+        offsets = np.repeat(np.array([origin for origin, _ in parts], dtype=np.float32), counts, axis=0)
+        boxes = np.concatenate([arrays[0] for _, arrays in parts]) + np.tile(offsets, 2)
+        scores = np.concatenate([arrays[1] for _, arrays in parts])
+        class_ids = np.concatenate([arrays[2] for _, arrays in parts])
+
+        if self.merge == 'wbf':
+            boxes, scores, class_ids = weighted_box_fusion(boxes, scores, class_ids, self.merge_iou)
+        else:
+            keep = batched_nms(boxes, scores, class_ids, self.merge_iou)
+            boxes, scores, class_ids = boxes[keep], scores[keep], class_ids[keep]
+        order = np.argsort(-scores, kind='stable')
+        return format_detections(boxes[order], scores[order], class_ids[order], self.names, image_shape)